@@ -0,0 +1,347 @@
+import json
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from celery.utils.log import get_task_logger
+
+
+__all__ = ["AFFINITY_TTL", "HEARTBEAT_INTERVAL", "HEARTBEAT_TTL", "AffinityRouter"]
+
+logger = get_task_logger(__name__)
+
+# Seconds a worker is remembered as holding an affinity key after its last task with that key
+AFFINITY_TTL = 86400
+# Seconds between the heartbeats of a worker, which keep its affinity queue registered and move the tasks
+# whose affinity deadline passed back to their queues
+HEARTBEAT_INTERVAL = 10
+# Seconds after its last heartbeat a worker stops receiving tasks through its affinity queue, e.g. once its
+# node was preempted without shutting the worker down
+HEARTBEAT_TTL = 30
+# Number of messages read at a time from the end of an affinity queue, where its oldest tasks wait
+MOVE_CHUNK_SIZE = 100
+
+# Registers the affinity queue of a worker for ARGV[2] seconds, unless the worker is draining
+HEARTBEAT_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# Moves the last n messages of the list KEYS[1], given as ARGV[1..n], to the head of the lists KEYS[2..n+1]
+# as ARGV[n+1..2n], only if they are still the last messages of the list, so a message taken by a worker in
+# the meantime is not sent twice. The oldest message ends up at the head of its new list.
+MOVE_MESSAGES_SCRIPT = """
+local n = #ARGV / 2
+local tail = redis.call('LRANGE', KEYS[1], -n, -1)
+if #tail ~= n then
+    return 0
+end
+for i = 1, n do
+    if tail[i] ~= ARGV[i] then
+        return 0
+    end
+end
+redis.call('LTRIM', KEYS[1], 0, -n - 1)
+for i = 1, n do
+    redis.call('RPUSH', KEYS[i + 1], ARGV[n + i])
+end
+return n
+"""
+
+
+class AffinityRouter:
+    """
+    Sends tasks tagged with an affinity key, e.g. the digest of the scene they render, to a worker that
+    already ran a task with that key, so the assets it loaded are reused instead of downloaded again by
+    another node. Every worker consumes from its own affinity queue (affinity.<hostname>) before its other
+    queues, keeps it registered with a heartbeat, and records the keys of the tasks it ran in
+    affinity:<key>. Tasks still waiting in an affinity queue after the affinity timeout, or whose worker
+    stopped or missed its heartbeats, are moved back to the queue they would have been sent to without
+    affinity, so any worker can run them.
+    """
+
+    def __init__(self, distributaur, timeout: float = 60) -> None:
+        """
+        Args:
+            distributaur (Distributaur): The Distributaur instance whose Redis and queues are used.
+            timeout (float): Seconds a task waits for the worker holding its affinity key before any worker
+                may run it. Defaults to 60.
+        """
+        self.distributaur = distributaur
+        self.timeout = timeout
+        # set once this instance sent a task to an affinity queue, so only drivers using affinity check them
+        self.routed = False
+        self.heartbeat_script = None
+        self.move_script = None
+
+    @staticmethod
+    def queue_for(hostname: str) -> str:
+        """
+        Return the name of the affinity queue of a worker.
+        """
+        return f"affinity.{hostname}"
+
+    @staticmethod
+    def _worker_key(hostname: str) -> str:
+        return f"affinity_worker:{hostname}"
+
+    @staticmethod
+    def _drained_key(hostname: str) -> str:
+        return f"affinity_drained:{hostname}"
+
+    def register_worker(self, consumer) -> None:
+        """
+        Make a starting worker consume from its affinity queue before its other queues, register the queue
+        so drivers can send tasks to it, and start the worker's heartbeat.
+
+        Args:
+            consumer (celery.worker.consumer.Consumer): The consumer of the worker, as sent by worker_ready.
+        """
+        queue = self.queue_for(consumer.hostname)
+        others = [q.name for q in consumer.task_consumer.queues if q.name != queue]
+        consumer.add_task_queue(queue)
+        # with the priority queue order strategy, queues are emptied in the order they were consumed from
+        for name in others:
+            consumer.cancel_task_queue(name)
+            consumer.add_task_queue(name)
+        self.add_worker(consumer.hostname)
+        consumer.timer.call_repeatedly(HEARTBEAT_INTERVAL, self.heartbeat, (consumer.hostname,))
+
+    def add_worker(self, hostname: str) -> None:
+        """
+        Let drivers send tasks to the affinity queue of a worker, e.g. when it stops draining.
+        """
+        pipeline = self.distributaur.get_redis_connection().pipeline(transaction=False)
+        pipeline.delete(self._drained_key(hostname))
+        pipeline.set(self._worker_key(hostname), self.queue_for(hostname), ex=HEARTBEAT_TTL)
+        pipeline.sadd("affinity_queues", self.queue_for(hostname))
+        pipeline.execute()
+
+    def heartbeat(self, hostname: str) -> None:
+        """
+        Keep the affinity queue of a worker registered for another HEARTBEAT_TTL seconds, unless the worker
+        is draining, and move the tasks whose affinity deadline passed back to their queues, so they move even
+        while no driver follows its tasks. Called by the worker every HEARTBEAT_INTERVAL seconds.
+        """
+        try:
+            redis_client = self.distributaur.get_redis_connection()
+            if self.heartbeat_script is None:
+                self.heartbeat_script = redis_client.register_script(HEARTBEAT_SCRIPT)
+            self.heartbeat_script(
+                keys=[self._worker_key(hostname), self._drained_key(hostname)],
+                args=[self.queue_for(hostname), HEARTBEAT_TTL],
+            )
+            self.rebalance()
+        except Exception as e:
+            logger.warning(f"Affinity heartbeat of {hostname} failed: {e}")
+
+    def unregister_worker(self, hostname: str) -> int:
+        """
+        Stop sending tasks to a worker's affinity queue, e.g. when it shuts down or drains, and move the tasks
+        still waiting in it back to their queues. The worker's heartbeats do not register it again until
+        add_worker is called.
+
+        Returns:
+            int: The number of tasks moved.
+        """
+        pipeline = self.distributaur.get_redis_connection().pipeline(transaction=False)
+        pipeline.delete(self._worker_key(hostname))
+        pipeline.set(self._drained_key(hostname), 1, ex=AFFINITY_TTL)
+        pipeline.execute()
+        return self.rebalance([self.queue_for(hostname)])
+
+    def record(self, key: str, hostname: str) -> None:
+        """
+        Record that a worker ran a task with an affinity key, so later tasks with the key are sent to it.
+        """
+        pipeline = self.distributaur.get_redis_connection().pipeline(transaction=False)
+        pipeline.hset(f"affinity:{key}", hostname, time.time())
+        pipeline.expire(f"affinity:{key}", AFFINITY_TTL)
+        pipeline.execute()
+
+    def get_holders(self, key: str) -> Dict[str, str]:
+        """
+        Return the running workers that ran a task with an affinity key.
+
+        Returns:
+            Dict[str, str]: The hostnames of the workers mapped to their affinity queues.
+        """
+        redis_client = self.distributaur.get_redis_connection()
+        hostnames = [hostname.decode() for hostname in redis_client.hkeys(f"affinity:{key}")]
+        if not hostnames:
+            return {}
+        queues = redis_client.mget([self._worker_key(hostname) for hostname in hostnames])
+        return {
+            hostname: queue.decode() for hostname, queue in zip(hostnames, queues) if queue is not None
+        }
+
+    def route(self, key: str, cache: dict = None) -> str:
+        """
+        Choose the affinity queue a task with an affinity key is sent to: the queue of the running worker
+        holding the key with the fewest waiting tasks.
+
+        Args:
+            key (str): The affinity key of the task.
+            cache (dict): Holders and queue lengths read by earlier calls, and the tasks they routed, so many
+                tasks can be routed with one read per key and queue. Defaults to None (read them again).
+
+        Returns:
+            str: The name of the affinity queue, or None if no running worker holds the key.
+        """
+        cache = {} if cache is None else cache
+        holders = cache.setdefault("holders", {})
+        lengths = cache.setdefault("lengths", {})
+        scheduled = cache.setdefault("scheduled", set())
+        if key not in holders:
+            holders[key] = list(self.get_holders(key).values())
+        queues = holders[key]
+        if not queues:
+            return None
+        missing = [queue for queue in queues if queue not in lengths]
+        if len(queues) > 1 and missing:
+            pipeline = self.distributaur.get_redis_connection().pipeline(transaction=False)
+            for queue in missing:
+                for list_key in self.distributaur._queue_keys(queue):
+                    pipeline.llen(list_key)
+            counts = pipeline.execute()
+            steps = len(counts) // len(missing)
+            for index, queue in enumerate(missing):
+                lengths[queue] = sum(counts[index * steps : (index + 1) * steps])
+        # tasks routed earlier with the same cache count towards the queue lengths
+        queue = min(queues, key=lambda queue: lengths.get(queue, 0))
+        lengths[queue] = lengths.get(queue, 0) + 1
+        if queue not in scheduled:
+            # the earliest deadline of the tasks waiting in a queue tells rebalance when to look at it; the
+            # first task routed with a cache has the earliest deadline of the tasks routed with it
+            self.distributaur.get_redis_connection().zadd(
+                "affinity_deadlines", {queue: time.time() + self.timeout}, nx=True
+            )
+            scheduled.add(queue)
+        self.routed = True
+        return queue
+
+    def rebalance(self, queues: Iterable[str] = None) -> int:
+        """
+        Move the tasks of an affinity queue whose deadline passed, and every task in the affinity queue of a
+        worker that stopped or missed its heartbeats, to the head of the queue they would have been sent to
+        without affinity. Only the queues whose earliest deadline passed are read, from their end, where their
+        oldest tasks wait, so each call only decodes the tasks it moves and one more per list.
+
+        Args:
+            queues (Iterable[str]): The affinity queues to check. Defaults to the queues whose earliest deadline
+                passed and the queues of stopped workers.
+
+        Returns:
+            int: The number of tasks moved.
+        """
+        redis_client = self.distributaur.get_redis_connection()
+        if self.move_script is None:
+            self.move_script = redis_client.register_script(MOVE_MESSAGES_SCRIPT)
+        now = time.time()
+        registered = [queue.decode() for queue in redis_client.smembers("affinity_queues")]
+        pipeline = redis_client.pipeline(transaction=False)
+        for queue in registered:
+            pipeline.exists(self._worker_key(queue[len("affinity.") :]))
+        live = {queue for queue, exists in zip(registered, pipeline.execute()) if exists}
+        if queues is None:
+            due = redis_client.zrangebyscore("affinity_deadlines", "-inf", now)
+            queues = {queue.decode() for queue in due} | (set(registered) - live)
+
+        moved = 0
+        for queue in queues:
+            stopped = queue not in live
+            queue_moved, next_deadline, done = self._move_expired(queue, None if stopped else now)
+            moved += queue_moved
+            # a queue whose messages were taken by a worker while they were moved is checked again next time
+            if not done:
+                continue
+            if stopped:
+                pipeline = redis_client.pipeline(transaction=False)
+                pipeline.srem("affinity_queues", queue)
+                pipeline.zrem("affinity_deadlines", queue)
+                pipeline.execute()
+            else:
+                # an empty queue is checked again after the timeout, as a driver may have routed a task to it
+                # while it was read
+                redis_client.zadd(
+                    "affinity_deadlines", {queue: next_deadline or now + self.timeout}
+                )
+        if moved:
+            logger.info(f"Moved {moved} tasks from affinity queues back to their queues")
+        return moved
+
+    def _move_expired(self, queue: str, now: float = None) -> Tuple[int, float, bool]:
+        """
+        Move the tasks at the end of an affinity queue whose deadline passed, or all of them if now is None.
+        Tasks are taken in the order workers take them, so an expired task behind one whose deadline has not
+        passed, e.g. sent by a driver with a longer timeout, waits for that one to be taken or to expire.
+
+        Returns:
+            Tuple[int, float, bool]: The number of tasks moved, the earliest deadline of the tasks left, and
+            whether the queue was read to its first task whose deadline has not passed.
+        """
+        redis_client = self.distributaur.get_redis_connection()
+        list_keys = self.distributaur._queue_keys(queue)
+        pipeline = redis_client.pipeline(transaction=False)
+        for list_key in list_keys:
+            pipeline.lrange(list_key, -MOVE_CHUNK_SIZE, -1)
+        tails = pipeline.execute()
+
+        moved = 0
+        next_deadline = None
+        for priority_index, (list_key, tail) in enumerate(zip(list_keys, tails)):
+            while tail:
+                expired = []
+                # the last message of a list is the oldest one, and the next one a worker takes
+                for raw in reversed(tail):
+                    message = json.loads(raw)
+                    deadline = float((message.get("headers") or {}).get("affinity_deadline") or 0)
+                    if now is not None and deadline > now:
+                        next_deadline = min(next_deadline or deadline, deadline)
+                        break
+                    expired.append((raw, message))
+                if not expired:
+                    break
+                count = self._move(list_key, priority_index, expired)
+                if not count:
+                    return moved, next_deadline, False
+                moved += count
+                if len(expired) < len(tail) or len(tail) < MOVE_CHUNK_SIZE:
+                    break
+                tail = redis_client.lrange(list_key, -MOVE_CHUNK_SIZE, -1)
+        return moved, next_deadline, True
+
+    def _move(self, list_key: str, priority_index: int, expired: List[Tuple[bytes, dict]]) -> int:
+        keys = [list_key]
+        raws = []
+        messages = []
+        # the script takes the messages in list order, newest first
+        for raw, message in reversed(expired):
+            queue = (message.get("headers") or {}).get(
+                "affinity_fallback"
+            ) or self.distributaur.app.conf.task_default_queue
+            # the transport restores unacknowledged messages to the queue in their delivery info
+            message["properties"]["delivery_info"].update(exchange=queue, routing_key=queue)
+            keys.append(self.distributaur._queue_keys(queue)[priority_index])
+            raws.append(raw)
+            messages.append(json.dumps(message))
+        return self.move_script(keys=keys, args=raws + messages)
+
+    def headers(self, key: str, fallback_queue: str) -> dict:
+        """
+        Return the headers of a task sent to an affinity queue.
+
+        Args:
+            key (str): The affinity key of the task.
+            fallback_queue (str): The queue the task is moved to if it waits for longer than the timeout.
+
+        Returns:
+            dict: The affinity key, the time after which any worker may run the task, and its queue.
+        """
+        return {
+            "affinity": key,
+            "affinity_deadline": time.time() + self.timeout,
+            "affinity_fallback": fallback_queue,
+        }
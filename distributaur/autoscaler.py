@@ -0,0 +1,295 @@
+import math
+import time
+from typing import Callable, Dict, List
+
+from celery.utils.log import get_task_logger
+
+
+__all__ = ["Autoscaler"]
+
+logger = get_task_logger(__name__)
+
+
+class Autoscaler:
+    """
+    Rents and destroys Vast.ai workers so the queued tasks finish by a target time. Each step reads the
+    length of the Celery queue and the average task duration recorded by the workers, computes the number
+    of nodes needed to run the remaining work before the deadline, and rents or drains nodes to match,
+    within min_nodes, max_nodes and max_price. Nodes are drained before they are destroyed: their worker
+    stops consuming from the queue and the instance is destroyed once its running tasks are done.
+    """
+
+    def __init__(
+        self,
+        distributaur,
+        image: str,
+        module_name: str,
+        max_price: float,
+        max_nodes: int,
+        target_seconds: float,
+        min_nodes: int = 0,
+        command: str = None,
+        worker_concurrency: int = None,
+        initial_task_duration: float = 60,
+        queue: str = "celery",
+        interval: float = 30,
+        cooldown: float = 120,
+        drain_timeout: float = 600,
+        evict_percentile: float = None,
+        evict_max_slowdown: float = 0.7,
+        evict_min_tasks: int = 5,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """
+        Args:
+            distributaur (Distributaur): The Distributaur instance whose queue and Vast.ai account are used.
+            image (str): The image to use for the nodes.
+            module_name (str): The name of the module to run on the nodes.
+            max_price (float): The maximum price per hour of a node.
+            max_nodes (int): The maximum number of nodes rented at the same time.
+            target_seconds (float): Seconds from now by which the queued tasks should be done.
+            min_nodes (int): Nodes kept while the queue is empty. Defaults to 0.
+            command (str): Command that starts the Celery worker on a node. Defaults to the command of
+                create_instance.
+            worker_concurrency (int): Number of tasks a node runs at the same time. Defaults to the concurrency
+                of the worker profile, or 1 if it runs one task per CPU core.
+            initial_task_duration (float): Task duration in seconds assumed until workers recorded
+                durations. Defaults to 60.
+            queue (str): Name of the Celery queue to watch, which rented nodes consume from. Defaults to
+                "celery".
+            interval (float): Seconds between steps of run. Defaults to 30.
+            cooldown (float): Minimum seconds between renting nodes, giving new nodes time to start before
+                more are rented. Defaults to 120.
+            drain_timeout (float): Seconds a draining node may keep running tasks before it is destroyed
+                anyway. Defaults to 600.
+            evict_percentile (float): If set, nodes whose throughput is below this percentile of the fleet
+                and below evict_max_slowdown times the median are drained and replaced, see
+                Distributaur.find_slow_nodes. Defaults to None (no eviction).
+            evict_max_slowdown (float): Fraction of the median throughput below which a node may be evicted.
+                Defaults to 0.7.
+            evict_min_tasks (int): Tasks a node must have completed before it may be evicted. Defaults to 5.
+            clock (Callable[[], float]): Returns the current time in seconds. Defaults to time.time.
+            sleep (Callable[[float], None]): Waits for a number of seconds. Defaults to time.sleep.
+        """
+        self.distributaur = distributaur
+        self.image = image
+        self.module_name = module_name
+        self.max_price = max_price
+        self.max_nodes = max_nodes
+        self.min_nodes = min_nodes
+        self.command = command
+        self.worker_concurrency = (
+            worker_concurrency or distributaur.worker_profile["concurrency"] or 1
+        )
+        self.initial_task_duration = initial_task_duration
+        self.queue = queue
+        self.interval = interval
+        self.cooldown = cooldown
+        self.drain_timeout = drain_timeout
+        self.evict_percentile = evict_percentile
+        self.evict_max_slowdown = evict_max_slowdown
+        self.evict_min_tasks = evict_min_tasks
+        self.clock = clock
+        self.sleep = sleep
+
+        self.deadline = clock() + target_seconds
+        self.nodes: List[Dict] = []
+        # instance ID of each draining node, mapped to the time draining started
+        self.draining: Dict[str, float] = {}
+        # instance IDs of draining nodes that were evicted for being slow, which are never resumed
+        self.evicted = set()
+        self.last_rental = None
+
+    def desired_nodes(self, queue_length: int, task_duration: float) -> int:
+        """
+        Compute the number of nodes needed to finish the queued tasks by the deadline.
+
+        Args:
+            queue_length (int): Number of tasks waiting in the queue.
+            task_duration (float): Average duration of a task in seconds.
+
+        Returns:
+            int: The number of nodes, between min_nodes and max_nodes.
+        """
+        if queue_length == 0:
+            return self.min_nodes
+        remaining = self.deadline - self.clock()
+        if remaining <= 0:
+            return self.max_nodes
+        needed = math.ceil(
+            queue_length * task_duration / (remaining * self.worker_concurrency)
+        )
+        return max(self.min_nodes, min(self.max_nodes, needed))
+
+    def step(self) -> dict:
+        """
+        Run one scaling decision: drain slow nodes if eviction is enabled, rent nodes if too few are active,
+        start draining nodes if too many are, and destroy drained nodes.
+
+        Returns:
+            dict: The queue length, task duration, desired and active node counts, and the number of nodes
+            evicted, rented and destroyed in this step.
+        """
+        queue_length = self.distributaur.get_queue_length(self.queue)
+        task_duration = self.distributaur.get_task_duration() or self.initial_task_duration
+        desired = self.desired_nodes(queue_length, task_duration)
+
+        active = [node for node in self.nodes if node["instance_id"] not in self.draining]
+        evicted = 0
+        if self.evict_percentile is not None and queue_length > 0:
+            slow = set(
+                self.distributaur.find_slow_nodes(
+                    [node["instance_id"] for node in active],
+                    percentile=self.evict_percentile,
+                    max_slowdown=self.evict_max_slowdown,
+                    min_tasks=self.evict_min_tasks,
+                )
+            )
+            for node in [node for node in active if str(node["instance_id"]) in slow]:
+                logger.info(f"Evicting slow node {node['instance_id']}")
+                self._drain(node)
+                self.evicted.add(node["instance_id"])
+                active.remove(node)
+                evicted += 1
+
+        rented = 0
+        if desired > len(active):
+            # bring draining nodes back before renting new ones, unless they were evicted
+            for node in self.nodes:
+                if len(active) >= desired:
+                    break
+                if node["instance_id"] in self.draining and node["instance_id"] not in self.evicted:
+                    self._resume(node)
+                    active.append(node)
+
+            now = self.clock()
+            in_cooldown = self.last_rental is not None and now - self.last_rental < self.cooldown
+            missing = desired - len(active)
+            if missing > 0 and not in_cooldown:
+                new_nodes = self.distributaur.rent_nodes(
+                    self.max_price,
+                    missing,
+                    self.image,
+                    self.module_name,
+                    self.command,
+                    queues=[self.queue],
+                )
+                self.nodes.extend(new_nodes)
+                rented = len(new_nodes)
+                self.last_rental = now
+        elif desired < len(active):
+            # drain the most recently rented nodes first
+            for node in active[desired:][::-1]:
+                self._drain(node)
+
+        destroyed = self._destroy_drained()
+        decision = {
+            "queue_length": queue_length,
+            "task_duration": task_duration,
+            "desired_nodes": desired,
+            "active_nodes": len(self.nodes) - len(self.draining),
+            "evicted": evicted,
+            "rented": rented,
+            "destroyed": destroyed,
+        }
+        logger.info(f"Autoscaler step: {decision}")
+        return decision
+
+    def run(self) -> None:
+        """
+        Run steps every interval seconds until the queue is empty and only min_nodes nodes are left.
+        """
+        while True:
+            decision = self.step()
+            if decision["queue_length"] == 0 and len(self.nodes) <= self.min_nodes:
+                break
+            self.sleep(self.interval)
+
+    def shutdown(self) -> None:
+        """
+        Destroy every node rented by the autoscaler without draining it.
+        """
+        self.distributaur.terminate_nodes(self.nodes)
+        self.nodes = []
+        self.draining = {}
+        self.evicted = set()
+
+    def _connection(self):
+        # control commands take a producer from the broker pool besides their connection, so they get a
+        # connection of their own instead of waiting on a pool exhausted by the threads publishing tasks
+        return self.distributaur.app.connection_for_write()
+
+    def _job_queues(self) -> List[str]:
+        # the queues of jobs whose tasks run on the nodes of this autoscaler
+        job_queues = self.distributaur.get_redis_connection().hgetall("job_queues")
+        return [queue.decode() for queue, parent in job_queues.items() if parent.decode() == self.queue]
+
+    def _get_hostname(self, node: dict) -> str:
+        hostname = self.distributaur.get_redis_connection().hget(
+            "workers", str(node["instance_id"])
+        )
+        return hostname.decode() if hostname is not None else None
+
+    def _drain(self, node: dict) -> None:
+        hostname = self._get_hostname(node)
+        if hostname is not None:
+            with self._connection() as connection:
+                self.distributaur.app.control.cancel_consumer(
+                    self.queue, destination=[hostname], connection=connection
+                )
+                for queue in [self.distributaur.affinity.queue_for(hostname), *self._job_queues()]:
+                    self.distributaur.app.control.cancel_consumer(
+                        queue, destination=[hostname], connection=connection
+                    )
+            # tasks waiting for the node because of their affinity key go back to their queue
+            self.distributaur.affinity.unregister_worker(hostname)
+        self.draining[node["instance_id"]] = self.clock()
+        logger.info(f"Draining node {node['instance_id']}")
+
+    def _resume(self, node: dict) -> None:
+        hostname = self._get_hostname(node)
+        if hostname is not None:
+            with self._connection() as connection:
+                self.distributaur.app.control.add_consumer(
+                    self.queue, destination=[hostname], connection=connection
+                )
+                for queue in [self.distributaur.affinity.queue_for(hostname), *self._job_queues()]:
+                    self.distributaur.app.control.add_consumer(
+                        queue, destination=[hostname], connection=connection
+                    )
+            self.distributaur.affinity.add_worker(hostname)
+        del self.draining[node["instance_id"]]
+        logger.info(f"Resumed draining node {node['instance_id']}")
+
+    def _is_idle(self, node: dict) -> bool:
+        hostname = self._get_hostname(node)
+        if hostname is None:
+            # the worker never registered or already shut down, so no tasks can be lost
+            return True
+        with self._connection() as connection:
+            inspect = self.distributaur.app.control.inspect(
+                destination=[hostname], timeout=1, connection=connection
+            )
+            active = inspect.active() or {}
+            reserved = inspect.reserved() or {}
+        return not active.get(hostname) and not reserved.get(hostname)
+
+    def _destroy_drained(self) -> int:
+        destroyed = 0
+        for node in list(self.nodes):
+            started = self.draining.get(node["instance_id"])
+            if started is None:
+                continue
+            if self.clock() - started < self.drain_timeout and not self._is_idle(node):
+                continue
+            try:
+                self.distributaur.destroy_instance(node["instance_id"])
+            except Exception as e:
+                logger.error(f"Error destroying node {node['instance_id']}: {e}")
+                continue
+            self.nodes.remove(node)
+            del self.draining[node["instance_id"]]
+            self.evicted.discard(node["instance_id"])
+            destroyed += 1
+        return destroyed
@@ -0,0 +1,113 @@
+import argparse
+import os
+import subprocess
+import time
+from datetime import timezone
+
+from ..distributaur import create_from_config
+from ..profiles import available_profiles, get_worker_profile, worker_command
+
+
+# The benchmark starts workers on this module, so it also defines their Celery app and tasks
+distributaur = create_from_config()
+celery = distributaur.app
+
+
+@distributaur.register_function
+def io_task(seconds: float) -> float:
+    """
+    Stand-in for a task that waits on a download or upload.
+    """
+    time.sleep(seconds)
+    return seconds
+
+
+@distributaur.register_function
+def cpu_task(iterations: int) -> int:
+    """
+    Stand-in for a short CPU-bound task.
+    """
+    return sum(i * i for i in range(iterations))
+
+
+WORKLOADS = {
+    "io": ("io_task", {"seconds": 0.05}),
+    "short-cpu": ("cpu_task", {"iterations": 2000}),
+}
+
+
+def start_worker(profile: str, timeout: float = 30) -> subprocess.Popen:
+    """
+    Start a worker with the settings of a profile and wait until it answers pings.
+    """
+    command = worker_command("distributaur.benchmark.profiles", get_worker_profile(profile)).split()
+    worker = subprocess.Popen(
+        command + ["--loglevel=warning", "--without-gossip", "--without-mingle"],
+        env=dict(os.environ, WORKER_PROFILE=profile),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with distributaur.app.connection_for_write() as connection:
+            if distributaur.app.control.ping(timeout=0.5, connection=connection):
+                return worker
+    worker.terminate()
+    raise RuntimeError(f"Worker with profile {profile} did not start within {timeout}s")
+
+
+def completed_at(async_result) -> float:
+    """
+    Return the time at which the worker stored the result of a task, as a Unix timestamp.
+    """
+    date_done = async_result.date_done
+    if date_done.tzinfo is None:
+        date_done = date_done.replace(tzinfo=timezone.utc)
+    return date_done.timestamp()
+
+
+def benchmark(profile: str, workload: str, tasks: int) -> float:
+    """
+    Run tasks of a workload on a local worker started with a profile.
+
+    Returns:
+        float: Throughput in tasks per second, from submitting the first task to the last result. The last
+            result is timed with the completion date the worker stored in the result backend, so the
+            number does not depend on how often the driver checks for results.
+    """
+    func_name, args = WORKLOADS[workload]
+    worker = start_worker(profile)
+    try:
+        start = time.time()
+        batch = distributaur.execute_many(func_name, [args] * tasks)
+        batch.results().join(timeout=600)
+        return tasks / (max(completed_at(async_result) for async_result in batch) - start)
+    finally:
+        worker.terminate()
+        worker.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the throughput of local workers started with each worker profile"
+    )
+    parser.add_argument(
+        "--tasks", type=int, default=200, help="Number of tasks per run (default: 200)"
+    )
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        default=available_profiles(),
+        choices=available_profiles(),
+        help="Worker profiles",
+    )
+    parser.add_argument(
+        "--workloads", nargs="+", default=list(WORKLOADS), choices=list(WORKLOADS), help="Workloads"
+    )
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'workload':<12}{'tasks':>8}{'tasks/s':>10}")
+    for workload in args.workloads:
+        for profile in args.profiles:
+            throughput = benchmark(profile, workload, args.tasks)
+            print(f"{profile:<12}{workload:<12}{args.tasks:>8}{throughput:>10.1f}")
@@ -0,0 +1,93 @@
+import argparse
+import os
+import tempfile
+import time
+
+from celery import states, uuid
+
+from ..distributaur import create_from_config
+
+
+MODES = ["inline", "spill-redis", "spill-file", "ignore"]
+
+
+def make_result(index: int, size: int) -> dict:
+    """
+    Build a return value like a render task's: a few scalars and a payload of the given size, different for
+    every task so nothing is deduplicated by the blob store.
+    """
+    return {"frame": index, "path": f"renders/{index:06d}.png", "payload": os.urandom(size // 2).hex()}
+
+
+def benchmark(distributaur, mode: str, tasks: int, size: int, blob_dir: str) -> tuple:
+    """
+    Store the results of tasks the way a worker does under a result mode, and measure the Redis memory they
+    take. Every mode also records the tasks' statuses, which is all that is kept when results are ignored.
+
+    Returns:
+        tuple: Redis memory used in bytes and seconds it took to store the results.
+    """
+    redis_client = distributaur.get_redis_connection()
+    backend = distributaur.app.backend
+    distributaur.settings["BLOB_STORE"] = blob_dir if mode == "spill-file" else "redis"
+    distributaur.settings["RESULT_THRESHOLD"] = 0 if mode == "inline" else 1024
+    distributaur.stored_blobs = {}
+    expires = distributaur.settings["RESULT_EXPIRES"] or None
+    status_key = f"job_status:benchmark-{mode}"
+
+    task_ids = [uuid() for _ in range(tasks)]
+    redis_client.memory_purge()
+    before = redis_client.info("memory")["used_memory"]
+    start = time.perf_counter()
+    for offset in range(0, tasks, 1000):
+        pipeline = redis_client.pipeline(transaction=False)
+        for index, task_id in enumerate(task_ids[offset : offset + 1000], offset):
+            pipeline.hset(status_key, task_id, "success")
+            if mode == "ignore":
+                continue
+            result = distributaur._offload_result(make_result(index, size))
+            meta = backend._get_result_meta(result, states.SUCCESS, None, None)
+            pipeline.set(backend.get_key_for_task(task_id), backend.encode(meta), ex=expires)
+        pipeline.execute()
+    elapsed = time.perf_counter() - start
+    used = redis_client.info("memory")["used_memory"] - before
+
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    keys += [f"blob:{digest}" for digest, _ in distributaur.stored_blobs]
+    for offset in range(0, len(keys), 1000):
+        redis_client.unlink(*keys[offset : offset + 1000])
+    redis_client.unlink(status_key)
+    return used, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the Redis memory taken by task results under each result mode"
+    )
+    parser.add_argument(
+        "--tasks", type=int, default=100000, help="Number of task results (default: 100000)"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[256, 16 * 1024],
+        help="Result payload sizes in bytes (default: 256 16KB)",
+    )
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES, help="Result modes")
+    args = parser.parse_args()
+
+    distributaur = create_from_config()
+    settings = dict(distributaur.settings)
+    print(f"{'mode':<14}{'payload':>10}{'tasks':>10}{'redis MB':>12}{'bytes/task':>12}{'store s':>10}")
+    with tempfile.TemporaryDirectory() as blob_dir:
+        try:
+            for size in args.sizes:
+                for mode in args.modes:
+                    used, elapsed = benchmark(distributaur, mode, args.tasks, size, blob_dir)
+                    print(
+                        f"{mode:<14}{size:>10}{args.tasks:>10}{used / 2 ** 20:>12.1f}"
+                        f"{used / args.tasks:>12.0f}{elapsed:>10.2f}"
+                    )
+        finally:
+            distributaur.settings.update(settings)
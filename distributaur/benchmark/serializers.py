@@ -0,0 +1,78 @@
+import argparse
+import base64
+import os
+import time
+
+from kombu.serialization import dumps, loads
+
+from ..serialization import SERIALIZERS, _numpy, available_serializers
+
+
+def make_payload(size: int, binary: bool) -> dict:
+    """
+    Build task arguments similar to a render job: a camera matrix, a buffer of the given size and some scalars.
+    Serializers without a binary type get the buffer base64 encoded, which is what users of json do today.
+    """
+    buffer = os.urandom(size)
+    camera = [[float(i * 4 + j) for j in range(4)] for i in range(4)]
+    np = _numpy(load=True)
+    if np is not None:
+        camera = np.array(camera, dtype=np.float32)
+        if not binary:
+            camera = camera.tolist()
+    return {
+        "frame": 42,
+        "camera": camera,
+        "buffer": buffer if binary else base64.b64encode(buffer).decode(),
+    }
+
+
+def benchmark(name: str, size: int, repeat: int) -> tuple:
+    """
+    Encode and decode a payload through kombu, the same path Celery messages take.
+
+    Returns:
+        tuple: Encoded size in bytes, median encode time and median decode time in milliseconds.
+    """
+    payload = make_payload(size, binary=name != "json")
+    encode_times = []
+    decode_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        content_type, content_encoding, data = dumps(payload, serializer=SERIALIZERS[name])
+        encode_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        loads(data, content_type, content_encoding, accept=[content_type])
+        decode_times.append(time.perf_counter() - start)
+
+    encode_times.sort()
+    decode_times.sort()
+    return (
+        len(data),
+        encode_times[repeat // 2] * 1000,
+        decode_times[repeat // 2] * 1000,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare task argument serializers")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024],
+        help="Payload buffer sizes in bytes (default: 1KB 64KB 1MB 16MB)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="Runs per measurement (default: 20)"
+    )
+    args = parser.parse_args()
+
+    print(f"{'serializer':<12}{'payload':>12}{'encoded':>12}{'encode ms':>12}{'decode ms':>12}")
+    for size in args.sizes:
+        for name in available_serializers():
+            encoded_size, encode_ms, decode_ms = benchmark(name, size, args.repeat)
+            print(
+                f"{name:<12}{size:>12}{encoded_size:>12}{encode_ms:>12.3f}{decode_ms:>12.3f}"
+            )
@@ -0,0 +1,60 @@
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict
+
+# Imported by distributaur only when they are used: by Hugging Face uploads, Vast.ai calls, config files,
+# progress bars and NumPy arrays in msgpack messages
+LAZY_MODULES = ["huggingface_hub", "requests", "urllib3", "omegaconf", "dotenv", "tqdm", "numpy"]
+
+
+def import_times(module: str = "distributaur.distributaur") -> Dict[str, int]:
+    """
+    Import a module in a new interpreter with -X importtime.
+
+    Returns:
+        Dict[str, int]: Cumulative import time in microseconds of every module the import loaded, including
+        the module itself.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure how long importing distributaur takes and which modules it loads"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=10, help="Number of interpreters started (default: 10)"
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of slowest modules listed (default: 10)"
+    )
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    totals = [times["distributaur.distributaur"] / 1000 for times in runs]
+    print(
+        f"import distributaur.distributaur: median {statistics.median(totals):.1f} ms, "
+        f"min {min(totals):.1f} ms"
+    )
+
+    print(f"\n{'module':<40}{'cumulative ms':>14}")
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1], reverse=True)
+    for name, cumulative in [item for item in slowest if "." not in item[0]][: args.top]:
+        print(f"{name:<40}{cumulative / 1000:>14.1f}")
+
+    loaded = [name for name in LAZY_MODULES if name in runs[-1]]
+    print(f"\nlazily imported modules loaded at import: {', '.join(loaded) or 'none'}")
@@ -0,0 +1,172 @@
+import os
+import tempfile
+
+from redis import Redis
+
+
+__all__ = [
+    "BLOB_MARKER",
+    "DEFAULT_BLOB_CACHE_SIZE",
+    "RedisBlobStore",
+    "FileBlobStore",
+    "BlobCache",
+    "is_blob_ref",
+]
+
+# Key of the dict that replaces an offloaded argument in a task message
+BLOB_MARKER = "__distributaur_blob__"
+
+# Seconds a blob stays in Redis after it was last stored
+DEFAULT_BLOB_TTL = 7 * 24 * 60 * 60
+
+# Disk space taken by the blobs a worker node caches in bytes, for the BLOB_CACHE_SIZE setting
+DEFAULT_BLOB_CACHE_SIZE = 10 * 1024 ** 3
+
+# Extends the expiry of a stored blob to ARGV[1] seconds, never shortening it, e.g. when a blob stored as a
+# task argument for 7 days is also returned as a result kept for 1 day. Returns 0 if the blob is not stored.
+REFRESH_BLOB_SCRIPT = """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl == -2 then
+    return 0
+end
+if ttl >= 0 and ttl < tonumber(ARGV[1]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+
+def is_blob_ref(value: any) -> bool:
+    """
+    Check if a task argument is a reference to an offloaded blob.
+    """
+    return isinstance(value, dict) and BLOB_MARKER in value
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    # write to a temporary file first so readers never see a partially written blob
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class RedisBlobStore:
+    """
+    Content-addressed blob store in Redis. Each blob is stored once under its digest, no matter how many
+    tasks reference it, and expires after ttl seconds.
+    """
+
+    def __init__(self, redis_client: Redis, ttl: int = DEFAULT_BLOB_TTL, prefix: str = "blob:") -> None:
+        """
+        Args:
+            redis_client (Redis): Redis connection to store blobs with.
+            ttl (int): Seconds a blob is kept after it was last stored. Defaults to 7 days.
+            prefix (str): Prefix of the Redis keys. Defaults to "blob:".
+        """
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.refresh_script = redis_client.register_script(REFRESH_BLOB_SCRIPT)
+
+    def put(self, digest: str, data: bytes) -> None:
+        key = f"{self.prefix}{digest}"
+        # only send the data if the blob is not stored yet, otherwise just refresh its expiry
+        if not self.refresh_script(keys=[key], args=[self.ttl]):
+            self.redis_client.set(key, data, ex=self.ttl)
+
+    def get(self, digest: str) -> bytes:
+        return self.redis_client.get(f"{self.prefix}{digest}")
+
+
+class FileBlobStore:
+    """
+    Content-addressed blob store in a directory, e.g. a network filesystem mounted on the driver and workers.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        Args:
+            directory (str): Directory to store blobs in. Created if it does not exist.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, digest: str, data: bytes) -> None:
+        path = os.path.join(self.directory, digest)
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+
+    def get(self, digest: str) -> bytes:
+        try:
+            with open(os.path.join(self.directory, digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class BlobCache(FileBlobStore):
+    """
+    Local cache of fetched blobs on a worker, shared by all worker processes of the node, so each blob is
+    downloaded once per node. Once the cached blobs take more than max_bytes, the least recently used ones
+    are deleted.
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = DEFAULT_BLOB_CACHE_SIZE) -> None:
+        """
+        Args:
+            directory (str): Cache directory. Defaults to distributaur-blobs in the system temp directory.
+            max_bytes (int): Disk space the cached blobs may take in bytes. Defaults to
+                DEFAULT_BLOB_CACHE_SIZE (10GB).
+        """
+        super().__init__(
+            directory or os.path.join(tempfile.gettempdir(), "distributaur-blobs")
+        )
+        self.max_bytes = max_bytes
+
+    def get(self, digest: str) -> bytes:
+        data = super().get(digest)
+        if data is not None:
+            # the modification time of a blob orders it for eviction, as access times are often not kept
+            try:
+                os.utime(os.path.join(self.directory, digest))
+            except FileNotFoundError:
+                pass
+        return data
+
+    def put(self, digest: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        super().put(digest, data)
+        self._evict()
+
+    def _evict(self) -> None:
+        # the directory is shared by the worker processes of the node, so its size is read from disk
+        blobs = []
+        size = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                blobs.append((stat.st_mtime, entry.path, stat.st_size))
+                size += stat.st_size
+        if size <= self.max_bytes:
+            return
+        for _, path, blob_size in sorted(blobs):
+            # processes reading a deleted blob keep reading it, later ones download it again
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= blob_size
+            if size <= self.max_bytes:
+                break
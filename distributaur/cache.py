@@ -0,0 +1,247 @@
+import functools
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+__all__ = ["DEFAULT_CACHE_SIZE", "AssetCache", "WarmFunction", "get_process_cache"]
+
+# memory budget of the cache of a worker process in bytes, for the WORKER_CACHE_SIZE setting
+DEFAULT_CACHE_SIZE = 1024 ** 3
+
+
+def _sizeof(value: any) -> int:
+    # arrays and buffers report the size of their data, other objects only their own size without the
+    # objects they reference, so the size of e.g. a loaded scene should be given to put or get_or_load
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class AssetCache:
+    """
+    Least recently used cache of the assets loaded by the functions of a worker process, e.g. scene files or
+    models, so tasks running on the same process reuse them instead of loading them again. Once the size of
+    the cached values exceeds max_bytes, the least recently used ones are evicted. Safe to use from the
+    threads of a thread pool worker.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_SIZE) -> None:
+        """
+        Args:
+            max_bytes (int): Memory budget of the cache in bytes. Defaults to DEFAULT_CACHE_SIZE (1GB).
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        # values and their sizes, least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # keys being loaded by get_or_load, so threads needing the same asset load it once
+        self._loading = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: Hashable, default: any = None) -> any:
+        """
+        Return a cached value, marking it as the most recently used, or default if it is not cached.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.stats["misses"] += 1
+                return default
+            self.stats["hits"] += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: Hashable, value: any, size: int = None) -> bool:
+        """
+        Cache a value, evicting the least recently used values until the cache fits its memory budget.
+
+        Args:
+            key (Hashable): The key of the value, e.g. the path of a scene file.
+            value (any): The value to cache.
+            size (int): Memory taken by the value in bytes. Defaults to the nbytes of arrays, the length of
+                bytes and strings, and the shallow size of other objects.
+
+        Returns:
+            bool: True if the value was cached, False if it is larger than the memory budget.
+        """
+        size = _sizeof(value) if size is None else size
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return False
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.stats["evictions"] += 1
+        return True
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], any], size: int = None) -> any:
+        """
+        Return a cached value, or load it with loader and cache it. Threads asking for a key that is being
+        loaded wait for it instead of loading it again.
+
+        Args:
+            key (Hashable): The key of the value, e.g. the path of a scene file.
+            loader (Callable[[], any]): Function loading the value.
+            size (int): Memory taken by the value in bytes, see put.
+
+        Returns:
+            any: The cached or loaded value.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.stats["hits"] += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            try:
+                with self._lock:
+                    # loaded by another thread while this one waited
+                    if key in self._entries:
+                        self.stats["hits"] += 1
+                        self._entries.move_to_end(key)
+                        return self._entries[key][0]
+                    self.stats["misses"] += 1
+                value = loader()
+                self.put(key, value, size)
+                return value
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+
+    def pop(self, key: Hashable, default: any = None) -> any:
+        """
+        Remove a value from the cache and return it, or default if it is not cached.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self.size -= size
+            return value
+
+    def clear(self) -> None:
+        """
+        Remove all values from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def get_stats(self) -> dict:
+        """
+        Return a snapshot of the cache's statistics.
+
+        Returns:
+            dict: The number of cached values, their size and the memory budget in bytes, and the number of
+            hits, misses and evictions.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "max_bytes": self.max_bytes,
+                **self.stats,
+            }
+
+
+# The cache and the setup hooks that ran in this process. A forked worker process starts with an empty cache
+# and runs the setup hooks again, as assets like GPU models cannot be shared with the parent process.
+_process_cache = None
+_setup_done = set()
+_process_lock = threading.RLock()
+
+
+def _reset_process_state() -> None:
+    global _process_cache, _setup_done, _process_lock
+    _process_cache = None
+    _setup_done = set()
+    _process_lock = threading.RLock()
+
+
+os.register_at_fork(after_in_child=_reset_process_state)
+
+
+def get_process_cache(max_bytes: int = DEFAULT_CACHE_SIZE) -> AssetCache:
+    """
+    Return the asset cache of this process, creating it on first use.
+
+    Args:
+        max_bytes (int): Memory budget of the cache in bytes if it is created. Defaults to DEFAULT_CACHE_SIZE.
+
+    Returns:
+        AssetCache: The cache shared by all functions run by this process.
+    """
+    global _process_cache
+    with _process_lock:
+        if _process_cache is None:
+            _process_cache = AssetCache(max_bytes)
+        return _process_cache
+
+
+class WarmFunction:
+    """
+    Registered function with a setup hook and the asset cache of the process it runs in. The setup hook runs
+    before the first call of the function in every process, and the cache is passed to the function as its
+    cache keyword argument. Picklable if the function and setup hook are, so it also runs in process pools.
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        setup: Callable[[AssetCache], None] = None,
+        cache: bool = False,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ) -> None:
+        """
+        Args:
+            func (Callable): The registered function.
+            setup (Callable[[AssetCache], None]): Function called with the asset cache of the process before
+                the first call of func in the process, e.g. to load assets every task needs. Defaults to None.
+            cache (bool): Pass the asset cache of the process to func as its cache keyword argument. Defaults
+                to False.
+            cache_size (int): Memory budget in bytes of the asset cache if it is created by this function.
+                Defaults to DEFAULT_CACHE_SIZE.
+        """
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.setup = setup
+        self.cache = cache
+        self.cache_size = cache_size
+
+    def __call__(self, *args, **kwargs) -> any:
+        cache = get_process_cache(self.cache_size)
+        if self.setup is not None:
+            self._run_setup(cache)
+        if self.cache:
+            kwargs["cache"] = cache
+        return self.func(*args, **kwargs)
+
+    def _run_setup(self, cache: AssetCache) -> None:
+        key = (self.func.__module__, self.func.__qualname__)
+        if key in _setup_done:
+            return
+        # tasks of a thread pool worker wait for the setup instead of running it again. If it raises, the
+        # task fails and the next task runs it again.
+        with _process_lock:
+            if key not in _setup_done:
+                self.setup(cache)
+                _setup_done.add(key)
@@ -0,0 +1,156 @@
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from huggingface_hub import configure_http_backend
+    from huggingface_hub.utils._http import UniqueRequestIdAdapter
+except ImportError:
+    # huggingface_hub 1.0 and later make requests with httpx instead of requests
+    configure_http_backend = None
+    UniqueRequestIdAdapter = HTTPAdapter
+
+
+__all__ = ["HttpClient"]
+
+# Only methods that are safe to repeat are retried, so a failed PUT never rents a second instance
+RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "DELETE"])
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class TimeoutSession(requests.Session):
+    """
+    Session that applies a default timeout to requests made without one.
+    """
+
+    def __init__(self, timeout: float) -> None:
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+class HttpClient:
+    """
+    Factory for HTTP sessions with keep-alive connection pools, a default timeout and a retry policy with
+    exponential backoff. Collects request counts, latencies, retries and connection reuse of every session
+    it created.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 30,
+        retries: int = 3,
+        backoff: float = 0.5,
+        pool_size: int = 32,
+    ) -> None:
+        """
+        Args:
+            timeout (float): Seconds to wait for the server when a request has no timeout. Defaults to 30.
+            retries (int): Number of retries for connection errors and 429/5xx responses to idempotent
+                requests. Defaults to 3.
+            backoff (float): Backoff factor of the retries, the n-th retry waits backoff * 2 ** (n - 1)
+                seconds. Defaults to 0.5.
+            pool_size (int): Maximum number of kept-alive connections per host. Defaults to 32.
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.metrics = {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "total_latency": 0.0,
+        }
+        self._adapters = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def new_session(self, adapter_class: type = HTTPAdapter, headers: dict = None) -> requests.Session:
+        """
+        Create a session using the client's pooling, timeout and retry settings.
+
+        Args:
+            adapter_class (type): Transport adapter class, a subclass of requests.adapters.HTTPAdapter.
+                Defaults to HTTPAdapter.
+            headers (dict): Headers sent with every request of the session. Defaults to None.
+
+        Returns:
+            requests.Session: The new session.
+        """
+        session = TimeoutSession(self.timeout)
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=RETRY_METHODS,
+            raise_on_status=False,
+        )
+        adapter = adapter_class(
+            pool_connections=10, pool_maxsize=self.pool_size, max_retries=retry
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.hooks["response"].append(self._record_response)
+        if headers:
+            session.headers.update(headers)
+        self._adapters.add(adapter)
+        return session
+
+    def configure_huggingface_hub(self) -> bool:
+        """
+        Make huggingface_hub send its requests through sessions of this client. This applies to every
+        Hugging Face request of the process, as huggingface_hub keeps one session per thread.
+
+        Returns:
+            bool: True if huggingface_hub was configured, False if its version does not use requests.
+        """
+        if configure_http_backend is None:
+            return False
+        configure_http_backend(
+            backend_factory=lambda: self.new_session(adapter_class=UniqueRequestIdAdapter)
+        )
+        return True
+
+    def get_metrics(self) -> dict:
+        """
+        Return a snapshot of the request metrics of all sessions created by this client.
+
+        Returns:
+            dict: Number of requests, error responses and retries, total and average latency in seconds until
+            the response headers arrived, and the number of connections opened and requests that reused an
+            open connection.
+        """
+        with self._lock:
+            metrics = dict(self.metrics)
+        connections = 0
+        pool_requests = 0
+        for adapter in list(self._adapters):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    pool_requests += pool.num_requests
+        metrics["connections_opened"] = connections
+        metrics["connections_reused"] = max(pool_requests - connections, 0)
+        metrics["average_latency"] = (
+            metrics["total_latency"] / metrics["requests"] if metrics["requests"] else 0.0
+        )
+        return metrics
+
+    def _record_response(self, response: requests.Response, *args, **kwargs) -> None:
+        retry = getattr(response.raw, "retries", None)
+        with self._lock:
+            self.metrics["requests"] += 1
+            self.metrics["total_latency"] += response.elapsed.total_seconds()
+            if response.status_code >= 400:
+                self.metrics["errors"] += 1
+            if retry is not None:
+                self.metrics["retries"] += len(retry.history)
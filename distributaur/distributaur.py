@@ -1,19 +1,119 @@
 import os
 import json
+import base64
 import time
-import requests
-from tqdm import tqdm
-from typing import Dict, List
+import hashlib
+import itertools
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List
+from uuid import UUID
 import atexit
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 
-from celery import Celery
-from redis import ConnectionPool, Redis
-from omegaconf import OmegaConf
-from dotenv import load_dotenv
-from huggingface_hub import HfApi, Repository
-from requests.exceptions import HTTPError
+from celery import Celery, current_task, signals, states, uuid
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from redis import Redis
 from celery.utils.log import get_task_logger
+from kombu.serialization import dumps, loads, prepare_accept_content
+from kombu.transport.redis import Channel as RedisChannel
+
+from .affinity import AffinityRouter
+from .autoscaler import Autoscaler
+from .blobstore import (
+    BLOB_MARKER,
+    DEFAULT_BLOB_CACHE_SIZE,
+    DEFAULT_BLOB_TTL,
+    BlobCache,
+    FileBlobStore,
+    RedisBlobStore,
+    is_blob_ref,
+)
+from .cache import DEFAULT_CACHE_SIZE, AssetCache, WarmFunction, get_process_cache
+from .file_index import RepoFileIndex
+from .job import Job
+from .local import EXECUTORS, LocalExecutor
+from .offers import OfferScorer
+from .profiles import get_worker_profile, worker_command
+from .redis_pool import RedisPool
+from .results import TaskBatch
+from .serialization import SERIALIZERS, available_serializers, get_serializer
+from .uploader import UploadQueue
+
+# Hugging Face, HTTP, config and progress bar libraries take most of the import time of distributaur, and
+# workers only need them once a task uploads a file or the driver rents nodes, so they are imported where
+# they are used
+if TYPE_CHECKING:
+    import requests
+    from huggingface_hub import HfApi
+
+    from .clients import HttpClient
+
+
+# job of tasks submitted without a job ID
+DEFAULT_JOB_ID = "default"
+
+# Seconds a blob stored by an instance is referenced without storing it again. Later references refresh its
+# expiry, so tasks submitted long after the first one never reference an expired blob.
+BLOB_REFRESH_INTERVAL = 60
+
+# Task priorities, 0 being the most urgent as with Celery's Redis transport. Each priority of a queue is a
+# separate Redis list, and workers empty the lists of a queue in this order.
+PRIORITY_STEPS = list(range(10))
+# priority of tasks submitted without one, so tasks can be made more or less urgent than the bulk of a run
+DEFAULT_PRIORITY = 5
+
+# Redis connections of a driver, shared by status reads, monitoring, uploads and result backend threads
+DRIVER_REDIS_POOL_SIZE = 32
+# Redis connections of a worker process beyond one per task it runs at the same time, for its heartbeat,
+# registration and task event subscriptions
+WORKER_REDIS_POOL_EXTRA = 4
+
+# Sets the status of a task in its job's status hash and moves it between the job's per-status counters,
+# so repeated updates (retries, speculative copies) are only counted once. Refreshes the TTL of both keys.
+SET_STATUS_SCRIPT = """
+local previous = redis.call('HGET', KEYS[1], ARGV[1])
+if previous ~= ARGV[2] then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    if previous then
+        redis.call('HINCRBY', KEYS[2], previous, -1)
+    end
+    redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+end
+if tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+return previous
+"""
+
+
+def to_env_value(value) -> str:
+    """
+    Serialize a setting for the environment of a worker, which the worker parses back into its settings.
+
+    Args:
+        value: The value of the setting.
+
+    Returns:
+        str: The value as a string, with booleans as "1" or "0".
+    """
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+def parse_bool(value) -> bool:
+    """
+    Parse a boolean setting given as a bool or a string from the environment or a config file.
+
+    Args:
+        value: The value of the setting, e.g. True, "1", "true" or "yes".
+
+    Returns:
+        bool: Whether the setting is enabled.
+    """
+    return str(value).strip().lower() in ["1", "true", "yes"]
 
 
 class Distributaur:
@@ -26,7 +126,7 @@ class Distributaur:
     app: Celery = None
     redis_client: Redis = None
     registered_functions: dict = {}
-    pool: ConnectionPool = None
+    pool: RedisPool = None
 
     def __init__(
         self,
@@ -37,7 +137,33 @@ class Distributaur:
         redis_password=os.getenv("REDIS_PASSWORD", ""),
         redis_port=os.getenv("REDIS_PORT", 6379),
         redis_username=os.getenv("REDIS_USER", "default"),
-        broker_pool_limit=os.getenv("BROKER_POOL_LIMIT", 1),
+        broker_pool_limit=os.getenv("BROKER_POOL_LIMIT", 10),
+        task_serializer=os.getenv("TASK_SERIALIZER", "json"),
+        blob_threshold=os.getenv("BLOB_THRESHOLD", 1048576),
+        blob_store=os.getenv("BLOB_STORE", "redis"),
+        blob_cache_dir=os.getenv("BLOB_CACHE_DIR", ""),
+        blob_cache_size=os.getenv("BLOB_CACHE_SIZE", DEFAULT_BLOB_CACHE_SIZE),
+        hf_upload_async=os.getenv("HF_UPLOAD_ASYNC", False),
+        file_index_ttl=os.getenv("FILE_INDEX_TTL", 300),
+        file_index_shared=os.getenv("FILE_INDEX_SHARED", False),
+        vast_api_url=os.getenv("VAST_API_URL", "https://console.vast.ai/api/v0"),
+        http_timeout=os.getenv("HTTP_TIMEOUT", 30),
+        http_retries=os.getenv("HTTP_RETRIES", 3),
+        http_backoff=os.getenv("HTTP_BACKOFF", 0.5),
+        speculative_execution=os.getenv("SPECULATIVE_EXECUTION", False),
+        status_ttl=os.getenv("STATUS_TTL", 604800),
+        result_threshold=os.getenv("RESULT_THRESHOLD", 65536),
+        result_expires=os.getenv("RESULT_EXPIRES", 86400),
+        ignore_result=os.getenv("IGNORE_RESULT", False),
+        worker_profile=os.getenv("WORKER_PROFILE", "long-gpu"),
+        worker_concurrency=os.getenv("WORKER_CONCURRENCY", 0),
+        executor=os.getenv("EXECUTOR", "celery"),
+        local_workers=os.getenv("LOCAL_WORKERS", 0),
+        redis_pool_size=os.getenv("REDIS_POOL_SIZE", 0),
+        redis_pool_timeout=os.getenv("REDIS_POOL_TIMEOUT", 20),
+        redis_health_check_interval=os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30),
+        worker_cache_size=os.getenv("WORKER_CACHE_SIZE", DEFAULT_CACHE_SIZE),
+        affinity_timeout=os.getenv("AFFINITY_TIMEOUT", 60),
     ) -> None:
         """
         Initialize the Distributaur object with the provided configuration parameters. Also sets some 
@@ -51,10 +177,69 @@ class Distributaur:
             redis_password (str): Redis password. Defaults to an empty string.
             redis_port (int): Redis port. Defaults to 6379.
             redis_username (str): Redis username. Defaults to "default".
-            broker_pool_limit (int): Celery broker pool limit. Defaults to 1.
+            broker_pool_limit (int): Celery broker pool limit, the number of broker connections kept open for
+                publishing tasks and sending control commands. Defaults to 10.
+            task_serializer (str): Serializer for task arguments: json, orjson, msgpack or pickle (restricted to
+                an allowlist of types). Defaults to "json".
+            blob_threshold (int): Task arguments whose encoded size is at least this many bytes are offloaded to
+                the blob store and only referenced by digest in the task message. 0 disables offloading.
+                Defaults to 1 MiB.
+            blob_store (str): Where offloaded arguments are stored: "redis", or the path of a directory shared by
+                the driver and workers. Defaults to "redis".
+            blob_cache_dir (str): Directory workers cache fetched blobs in. Defaults to distributaur-blobs in the
+                system temp directory.
+            blob_cache_size (int): Disk space in bytes the blobs cached by the workers of a node may take before
+                the least recently used ones are deleted. Defaults to 10 GiB.
+            hf_upload_async (bool): Queue uploads from upload_file and commit them to Hugging Face in batches from
+                a background thread instead of one commit per file. Defaults to False.
+            file_index_ttl (int): Seconds the cached index of repository files used by file_exists, files_exist
+                and list_files is kept before the repository is listed again. 0 disables caching. Defaults to 300.
+            file_index_shared (bool): Keep the repository file index in Redis, shared by all drivers and workers,
+                instead of in the memory of each process. Defaults to False.
+            vast_api_url (str): Base URL of the Vast.ai API. Defaults to "https://console.vast.ai/api/v0".
+            http_timeout (float): Timeout in seconds of Vast.ai and Hugging Face requests made without their own
+                timeout. Defaults to 30.
+            http_retries (int): Number of retries of idempotent Vast.ai and Hugging Face requests after connection
+                errors or 429/5xx responses. Defaults to 3.
+            http_backoff (float): Backoff factor in seconds between the retries, doubled for each retry.
+                Defaults to 0.5.
+            speculative_execution (bool): Workers publish the arguments of the tasks they start, so monitor_tasks
+                can run a second copy of tasks that take far longer than usual. Must be set for the workers as
+                well as the driver. Defaults to False.
+            status_ttl (int): Seconds the task statuses and counters of a job are kept after its latest update.
+                0 keeps them until the job is deleted. Defaults to 7 days.
+            result_threshold (int): Return values whose encoded size is at least this many bytes are stored in
+                the blob store, and the result backend only keeps a reference to them. 0 stores every result
+                inline. Defaults to 64 KiB.
+            result_expires (int): Seconds task results, and results stored in the Redis blob store, are kept.
+                0 keeps them until they are deleted. Defaults to 1 day.
+            ignore_result (bool): Do not store the return values of tasks, for tasks that only upload files.
+                Their progress is still counted by get_job_progress. Defaults to False.
+            worker_profile (str): Pool, concurrency, prefetch and acknowledgement settings of the workers:
+                long-gpu, short-cpu, io or io-gevent, see profiles.WORKER_PROFILES. Defaults to "long-gpu".
+            worker_concurrency (int): Number of tasks a worker runs at the same time, instead of the profile's.
+                0 keeps the profile's. Defaults to 0.
+            executor (str): Where registered functions run: "celery" sends them to workers through the broker,
+                "threads" and "processes" run them in a pool of this process, without a broker or workers.
+                Defaults to "celery".
+            local_workers (int): Number of functions the "threads" and "processes" executors run at the same
+                time. 0 runs one per CPU core. Defaults to 0.
+            redis_pool_size (int): Maximum number of connections of the Redis pool shared by this process and its
+                Celery result backend. 0 sizes it by role: 32 for a driver, and 4 more than the number of tasks
+                a worker process runs at the same time. Defaults to 0.
+            redis_pool_timeout (float): Seconds to wait for a free connection when all connections of the pool
+                are in use, before raising a ConnectionError. Defaults to 20.
+            redis_health_check_interval (int): Seconds a Redis connection may be idle before it is checked with a
+                PING when it is used again, so dropped connections are reopened instead of failing a command.
+                0 disables the checks. Defaults to 30.
+            worker_cache_size (int): Memory budget in bytes of the asset cache of each worker process, passed to
+                functions registered with cache=True. Defaults to DEFAULT_CACHE_SIZE (1GB).
+            affinity_timeout (float): Seconds a task submitted with an affinity key waits for a worker that
+                holds the key before it is moved back to its queue for any worker to run. Defaults to 60.
 
         Raises:
-            ValueError: If any of the required parameters (hf_repo_id, hf_token, vast_api_key) are not provided.
+            ValueError: If any of the required parameters (hf_repo_id, hf_token, vast_api_key) are not provided,
+                or if the task serializer, worker profile or executor is not available.
         """
         if hf_repo_id is None:
             raise ValueError(
@@ -83,43 +268,146 @@ class Distributaur:
             "REDIS_PORT": redis_port,
             "REDIS_USER": redis_username,
             "BROKER_POOL_LIMIT": broker_pool_limit,
+            "TASK_SERIALIZER": task_serializer,
+            "BLOB_THRESHOLD": int(blob_threshold),
+            "BLOB_STORE": blob_store,
+            "BLOB_CACHE_DIR": blob_cache_dir,
+            "BLOB_CACHE_SIZE": int(blob_cache_size),
+            "HF_UPLOAD_ASYNC": parse_bool(hf_upload_async),
+            "FILE_INDEX_TTL": int(file_index_ttl),
+            "FILE_INDEX_SHARED": parse_bool(file_index_shared),
+            "VAST_API_URL": vast_api_url.rstrip("/"),
+            "HTTP_TIMEOUT": float(http_timeout),
+            "HTTP_RETRIES": int(http_retries),
+            "HTTP_BACKOFF": float(http_backoff),
+            "SPECULATIVE_EXECUTION": parse_bool(speculative_execution),
+            "STATUS_TTL": int(status_ttl),
+            "RESULT_THRESHOLD": int(result_threshold),
+            "RESULT_EXPIRES": int(result_expires),
+            "IGNORE_RESULT": parse_bool(ignore_result),
+            "WORKER_PROFILE": worker_profile,
+            "WORKER_CONCURRENCY": int(worker_concurrency),
+            "EXECUTOR": executor,
+            "LOCAL_WORKERS": int(local_workers),
+            "REDIS_POOL_SIZE": int(redis_pool_size),
+            "REDIS_POOL_TIMEOUT": float(redis_pool_timeout),
+            "REDIS_HEALTH_CHECK_INTERVAL": int(redis_health_check_interval),
+            "WORKER_CACHE_SIZE": int(worker_cache_size),
+            "AFFINITY_TIMEOUT": float(affinity_timeout),
         }
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor '{executor}'. Choose one of {EXECUTORS}")
+        # digests and TTLs of the blobs this instance stored, mapped to the time until which they are
+        # referenced without storing them again, so shared arguments are only uploaded once
+        self.stored_blobs = {}
+        self.blob_cache = None
+        self.upload_queue = None
+        self.file_indexes = {}
+        self.vast_session = None
+        self.hf_api = None
+        # shared connection pools, timeouts and retries for all Vast.ai and Hugging Face requests, created
+        # by get_http_client on first use
+        self.http_client = None
+        self.status_script = None
+        # jobs this instance submitted tasks to, cleaned up on exit
+        self.jobs: Dict[str, Job] = {}
+        # instances rented by rent_nodes that were not terminated yet, destroyed on exit
+        self.rented_instances = set()
+        # sizes the Redis pool, set to "worker" when the process starts a Celery worker
+        self.role = "driver"
+        # runs registered functions in this process instead of sending them to Celery workers
+        self.executor = None
+        if executor != "celery":
+            self.executor = LocalExecutor(executor, self.settings["LOCAL_WORKERS"])
 
         redis_url = self.get_redis_url()
         # start Celery app instance
         self.app = Celery("distributaur", broker=redis_url, backend=redis_url)
         self.app.conf.broker_pool_limit = self.settings["BROKER_POOL_LIMIT"]
-
-        def cleanup_redis():
-            """
-            Deletes keys in redis related to Celery tasks and closes the Redis connection on exit
-            """
-            patterns = ["celery-task*", "task_status*"]
-            redis_connection = self.get_redis_connection()
-            for pattern in patterns:
-                for key in redis_connection.scan_iter(match=pattern):
-                    redis_connection.delete(key)
-            print("Redis server cleared")
-
-        def cleanup_celery():
-            """
-            Clears Celery task queue on exit
-            """
-            self.app.control.purge()
-            print("Celery queue cleared")
-
-        # At exit, close Celery instance, delete all previous task info from queue and Redis, and close Redis
+        # the result backend takes its connections from the Redis pool of this instance
+        self.app.loader.override_backends = {"redis": "distributaur.redis_pool:SharedPoolRedisBackend"}
+        self.app.distributaur_redis_pool = self.get_redis_pool
+        # Messages name their serializer in the content type, so workers accept every installed serializer
+        # and decode whichever one the driver was configured with
+        self.app.conf.task_serializer = get_serializer(task_serializer)
+        self.app.conf.accept_content = [
+            SERIALIZERS[name] for name in available_serializers()
+        ]
+        self.app.conf.result_expires = self.settings["RESULT_EXPIRES"] or None
+        self.app.conf.task_ignore_result = self.settings["IGNORE_RESULT"]
+
+        # At exit, close Celery instance, delete the queued tasks and task info of this instance's jobs from
+        # Redis, and close Redis. Jobs of other drivers sharing the Redis server are left alone.
         atexit.register(self.app.close)
-        atexit.register(cleanup_redis)
-        atexit.register(cleanup_celery)
+        atexit.register(self._cleanup_jobs)
+        atexit.register(self._destroy_rented_instances)
+
+        # registered functions are routed to their queue and priority by _route_function
+        self.function_routes: Dict[str, dict] = {}
+        # registered functions with a setup hook or the asset cache, see register_function
+        self.warm_functions: Dict[str, WarmFunction] = {}
+        # sends tasks with an affinity key to the workers that already ran tasks with that key
+        self.affinity = AffinityRouter(self, self.settings["AFFINITY_TIMEOUT"])
+        self.app.conf.task_routes = (self._route_function,)
+
+        self.worker_profile = get_worker_profile(worker_profile, self.settings["WORKER_CONCURRENCY"])
+        # workers consuming several queues empty them in the order they were given, e.g. with -Q
+        self.app.conf.broker_transport_options = {
+            "priority_steps": PRIORITY_STEPS,
+            "queue_order_strategy": "priority",
+            "visibility_timeout": self.worker_profile["visibility_timeout"],
+            "health_check_interval": self.settings["REDIS_HEALTH_CHECK_INTERVAL"],
+        }
 
-        # Tasks are acknowledged after they have been executed
-        self.app.task_acks_late = True
-        # Worker only fetches one task at a time
-        self.app.worker_prefetch_multiplier = 1
+        # Pool, concurrency, prefetching and acknowledgement of the workers come from the worker profile.
+        # The default long-gpu profile acknowledges tasks after they have been executed and only fetches
+        # one task at a time.
+        self.app.conf.worker_pool = self.worker_profile["pool"]
+        self.app.conf.worker_concurrency = self.worker_profile["concurrency"]
+        self.app.conf.worker_prefetch_multiplier = self.worker_profile["prefetch_multiplier"]
+        self.app.conf.task_acks_late = self.worker_profile["acks_late"]
         self.call_function_task = self.app.task(
             bind=True, name="call_function_task", max_retries=3, default_retry_delay=30
         )(self.call_function_task)
+        self.call_function_batch_task = self.app.task(
+            bind=True, name="call_function_batch_task"
+        )(self.call_function_batch_task)
+
+        # Workers on Vast.ai instances register their hostname under their instance ID, so the autoscaler
+        # can drain a worker before destroying its instance, and start consuming from the queues of jobs
+        signals.worker_init.connect(self._set_worker_role, weak=False)
+        signals.worker_ready.connect(self._register_worker, weak=False)
+        signals.worker_shutdown.connect(self._unregister_worker, weak=False)
+
+    def _set_worker_role(self, sender=None, **kwargs) -> None:
+        self.role = "worker"
+        # a pool opened while the worker module was imported was sized for a driver. It is resized rather
+        # than replaced, as the result backend may already hold a client on it
+        if self.pool is not None:
+            self.pool.resize(self._redis_pool_size())
+
+    def _register_worker(self, sender=None, **kwargs) -> None:
+        if sender is None:
+            return
+        redis_client = self.get_redis_connection()
+        instance_id = os.getenv("CONTAINER_ID")
+        if instance_id:
+            redis_client.hset("workers", instance_id, sender.hostname)
+        self.affinity.register_worker(sender)
+        # consume from the queues of jobs created before the worker started, if it consumes from their parent
+        # queue, so workers dedicated to other queues do not take their tasks
+        consumed = {queue.name for queue in sender.task_consumer.queues}
+        for queue, parent in redis_client.hgetall("job_queues").items():
+            if parent.decode() in consumed:
+                sender.add_task_queue(queue.decode())
+
+    def _unregister_worker(self, sender=None, **kwargs) -> None:
+        instance_id = os.getenv("CONTAINER_ID")
+        if instance_id:
+            self.get_redis_connection().hdel("workers", instance_id)
+        hostname = getattr(sender, "hostname", None)
+        if hostname:
+            self.affinity.unregister_worker(hostname)
 
     def __del__(self):
         """Destructor to clean up resources."""
@@ -171,106 +459,1266 @@ class Distributaur:
     def get_redis_connection(self, force_new: bool = False) -> Redis:
         """
         Returns Redis connection. If it already exists, returns current connection.
-        If it does not exist, its create a new Redis connection using a connection pool.
+        If it does not exist, its create a new Redis connection using the shared connection pool.
 
         Args:
-            force_new (bool): Force the creation of a new connection if set to True. Defaults to False.
+            force_new (bool): Force the creation of a new connection if set to True, e.g. after the Redis
+                server restarted. Idle connections of the pool are closed, so the next commands open new
+                ones. Defaults to False.
 
         Returns:
             Redis: A Redis connection object.
         """
         if self.redis_client is not None and not force_new:
             return self.redis_client
-        else:
-            redis_url = self.get_redis_url()
-            self.pool = ConnectionPool.from_url(redis_url)
-            self.redis_client = Redis(connection_pool=self.pool)
+        if force_new and self.pool is not None:
+            self.pool.disconnect(inuse_connections=False)
+        self.redis_client = Redis(connection_pool=self.get_redis_pool())
+        return self.redis_client
+
+    def get_redis_pool(self) -> RedisPool:
+        """
+        Return the Redis connection pool of this process, shared by every Redis client of this instance and
+        by the Celery result backend. Created on first use, with REDIS_POOL_SIZE connections at most.
+
+        Returns:
+            RedisPool: The connection pool.
+        """
+        if self.pool is None:
+            self.pool = RedisPool.from_url(
+                self.get_redis_url(),
+                max_connections=self._redis_pool_size(),
+                timeout=self.settings["REDIS_POOL_TIMEOUT"],
+                health_check_interval=self.settings["REDIS_HEALTH_CHECK_INTERVAL"],
+            )
             atexit.register(self.pool.disconnect)
+        return self.pool
 
-        return self.redis_client
+    def get_redis_pool_stats(self) -> dict:
+        """
+        Return statistics of the Redis connection pool, to tune REDIS_POOL_SIZE.
+
+        Returns:
+            dict: The role of the process, the pool size, the number of connections in use and idle, the
+            number of connections opened and reconnects, and the number of times a caller waited for a free
+            connection, the total seconds waited and the number of waits that timed out.
+        """
+        return {"role": self.role, **self.get_redis_pool().get_stats()}
+
+    def _redis_pool_size(self) -> int:
+        if self.settings["REDIS_POOL_SIZE"]:
+            return self.settings["REDIS_POOL_SIZE"]
+        if self.role == "driver":
+            return DRIVER_REDIS_POOL_SIZE
+        # a prefork child runs one task at a time, thread and greenlet pools run all tasks in one process
+        concurrency = 1
+        if self.worker_profile["pool"] in ("threads", "gevent"):
+            concurrency = self.worker_profile["concurrency"] or 1
+        return concurrency + WORKER_REDIS_POOL_EXTRA
+
+    def get_env(self, key: str, default: any = None) -> any:
+        """
+        Retrieve a value from the configuration or .env file, with an optional default if the key is not found.
+
+        Args:
+            key (str): The key to look for in the settings.
+            default (any): The default value to return if the key is not found. Defaults to None.
+
+        Returns:
+            any: The value from the settings if the key exists, otherwise the default value.
+        """
+        return self.settings.get(key, default)
+
+    def call_function_task(self, func_name: str, args: dict) -> any:
+        """
+        Creates Celery task that executes a registered function with provided arguments.
+
+        Args:
+            func_name (str): The name of the registered function to execute.
+            args (dict): Arguments for the function, decoded by the serializer the message was sent with.
+                A JSON string is also accepted for messages sent by older versions of distributaur.
+
+        Returns:
+            any: Celery.app.task object, represents result of the registered function. Results of at least
+            RESULT_THRESHOLD bytes are replaced by a reference to the blob store, see resolve_result.
+
+        Raises:
+            ValueError: If the function name is not registered.
+            Exception: If an error occurs during the execution of the function. The task will retry in this case.
+        """
+        try:
+            func = self._get_function(func_name)
+            if isinstance(args, str):
+                args = json.loads(args)
+            request = self.call_function_task.request
+            # identifies this execution among speculative copies of the task, which share its task ID
+            request.execution_token = uuid()
+            if (
+                self.settings.get("SPECULATIVE_EXECUTION")
+                and request.id
+                and not request.ignore_result
+            ):
+                self._publish_started(func_name, args)
+            start_time = time.time()
+            result = func(**self._resolve_args(args))
+            self.update_function_status(
+                request.id, "success", time.time() - start_time, getattr(request, "job_id", None)
+            )
+            self._record_affinity(request)
+
+            return self._offload_result(result)
+        except Exception as e:
+            self.log(f"Error in call_function_task: {str(e)}", "error")
+            self._release_upload_claims()
+            request = self.call_function_task.request
+            if request.id and request.retries >= self.call_function_task.max_retries:
+                self.update_function_status(
+                    request.id, "failure", job_id=getattr(request, "job_id", None)
+                )
+            self.call_function_task.retry(exc=e)
+
+        return result
+
+    def call_function_batch_task(self, func_name: str, args_batch: List[dict]) -> list:
+        """
+        Creates Celery task that executes a registered function once for every set of arguments in a batch.
+        Reduces broker and serialization overhead for small functions. Progress is reported through the
+        PROGRESS task state so monitor_tasks can count finished items while the batch is running.
+
+        Args:
+            func_name (str): The name of the registered function to execute.
+            args_batch (List[dict]): Argument dicts for the function, one per call.
+
+        Returns:
+            list: One dict per item, either {"result": value} or {"error": message} if the call raised. If the
+            list is at least RESULT_THRESHOLD bytes, a reference to it in the blob store, see resolve_result.
+
+        Raises:
+            ValueError: If the function name is not registered.
+        """
+        func = self._get_function(func_name)
+        results = []
+        start_time = last_update = time.time()
+        for index, args in enumerate(args_batch):
+            try:
+                results.append({"result": func(**self._resolve_args(args))})
+            except Exception as e:
+                self.log(f"Error in call_function_batch_task item {index}: {str(e)}", "error")
+                results.append({"error": str(e)})
+
+            # limit progress updates to one per second to keep the per-item overhead low
+            if time.time() - last_update >= 1 and index + 1 < len(args_batch):
+                last_update = time.time()
+                self.call_function_batch_task.update_state(
+                    state="PROGRESS", meta={"done": index + 1, "total": len(args_batch)}
+                )
+
+        request = self.call_function_batch_task.request
+        self.update_function_status(
+            request.id,
+            "success",
+            (time.time() - start_time) / len(args_batch) if args_batch else None,
+            getattr(request, "job_id", None),
+        )
+        self._record_affinity(request)
+        return self._offload_result(results)
+
+    def _publish_started(self, func_name: str, args: dict) -> None:
+        """
+        Store the STARTED state of the current task with its encoded arguments and routing options, so
+        monitor_tasks can submit a speculative copy of it to the same queue, with the same priority and job.
+        """
+        content_type, content_encoding, data = dumps(
+            [func_name, args], serializer=self.app.conf.task_serializer
+        )
+        if isinstance(data, str):
+            data = data.encode()
+        request = self.call_function_task.request
+        delivery_info = request.delivery_info or {}
+        headers = {"job_id": getattr(request, "job_id", None) or DEFAULT_JOB_ID}
+        affinity = getattr(request, "affinity", None)
+        if affinity:
+            # the copy keeps the affinity key, so its worker records it, but is sent to the queue the task
+            # would have had without affinity instead of the queue of the worker it is stuck on
+            headers["affinity"] = affinity
+        self.call_function_task.update_state(
+            state=states.STARTED,
+            meta={
+                "message": base64.b64encode(data).decode(),
+                "content_type": content_type,
+                "content_encoding": content_encoding,
+                "options": {
+                    "queue": getattr(request, "affinity_fallback", None)
+                    or delivery_info.get("routing_key"),
+                    "priority": delivery_info.get("priority"),
+                    "headers": headers,
+                    "ignore_result": bool(request.ignore_result),
+                },
+            },
+        )
+
+    def register_function(
+        self,
+        func: callable = None,
+        *,
+        queue: str = None,
+        priority: int = None,
+        setup: callable = None,
+        cache: bool = False,
+    ) -> callable:
+        """
+        Decorator to register a function so that it can be invoked as a Celery task. Used as
+        @register_function, or as @register_function(queue=..., priority=..., setup=..., cache=...) to route
+        the function's tasks or keep loaded assets between them.
+
+        Args:
+            func (callable): The function to register.
+            queue (str): The Celery queue the function's tasks are sent to, so they can be run by nodes
+                dedicated to that queue. Defaults to the default queue.
+            priority (int): The priority of the function's tasks in their queue, from 0 (most urgent) to 9.
+                Defaults to DEFAULT_PRIORITY.
+            setup (callable): Function called once in every worker process before the function's first task
+                runs there, with the process's AssetCache as its only argument, e.g. to load a model every task
+                needs. Defaults to None.
+            cache (bool): Pass the AssetCache of the worker process to the function as its cache keyword
+                argument, so tasks running on the same process reuse assets loaded by earlier tasks. Defaults
+                to False.
+
+        Returns:
+            callable: The original function, now registered as a callable task, or a decorator registering
+            the function if func is not given.
+        """
+        if func is None:
+            return lambda func: self.register_function(
+                func, queue=queue, priority=priority, setup=setup, cache=cache
+            )
+        self.registered_functions[func.__name__] = func
+        self.function_routes[func.__name__] = {"queue": queue, "priority": priority}
+        if setup is not None or cache:
+            self.warm_functions[func.__name__] = WarmFunction(
+                func, setup, cache, self.settings["WORKER_CACHE_SIZE"]
+            )
+        else:
+            self.warm_functions.pop(func.__name__, None)
+        return func
+
+    def get_function_cache(self) -> AssetCache:
+        """
+        Get the asset cache of this process, shared by the functions registered with cache=True that run in it.
+
+        Returns:
+            AssetCache: The cache, with a memory budget of WORKER_CACHE_SIZE bytes.
+        """
+        return get_process_cache(self.settings["WORKER_CACHE_SIZE"])
+
+    def _route_function(self, name, args, kwargs, options, task=None, **kw) -> dict:
+        """
+        Celery router sending the tasks of registered functions to the queue and priority they were
+        registered with. Queues and priorities given when submitting a task take precedence.
+        """
+        if name not in (self.call_function_task.name, self.call_function_batch_task.name):
+            return None
+        route = self.function_routes.get(args[0], {}) if args else {}
+        priority = route.get("priority")
+        return {
+            "queue": route.get("queue") or self.app.conf.task_default_queue,
+            "priority": DEFAULT_PRIORITY if priority is None else priority,
+        }
+
+    def _route_affinity(
+        self, func_name: str, affinity: str, queue: str = None, cache: dict = None
+    ) -> tuple:
+        """
+        Get the queue and headers of a task with an affinity key: the affinity queue of a running worker that
+        holds the key, or the task's queue if none does. The key is sent along either way, so the worker
+        running the task records that it holds it.
+
+        Returns:
+            tuple: The queue, or None for the function's queue, and the affinity headers.
+        """
+        if affinity is None:
+            return queue, {}
+        affinity_queue = self.affinity.route(affinity, cache)
+        if affinity_queue is None:
+            return queue, {"affinity": affinity}
+        fallback_queue = (
+            queue
+            or self.function_routes.get(func_name, {}).get("queue")
+            or self.app.conf.task_default_queue
+        )
+        return affinity_queue, self.affinity.headers(affinity, fallback_queue)
+
+    def _record_affinity(self, request) -> None:
+        affinity = getattr(request, "affinity", None)
+        if affinity and request.hostname:
+            self.affinity.record(affinity, request.hostname)
+
+    def _queue_keys(self, queue: str) -> List[str]:
+        """
+        Get the Redis lists holding the messages of a queue, one per priority, most urgent first.
+        """
+        return [queue] + [f"{queue}{RedisChannel.sep}{priority}" for priority in PRIORITY_STEPS[1:]]
+
+    def get_queue_length(self, queue: str = None) -> int:
+        """
+        Get the number of tasks waiting in a queue, over all priorities.
+
+        Args:
+            queue (str): The name of the queue. Defaults to the default queue.
+
+        Returns:
+            int: The number of waiting tasks.
+        """
+        pipeline = self.get_redis_connection().pipeline(transaction=False)
+        for key in self._queue_keys(queue or self.app.conf.task_default_queue):
+            pipeline.llen(key)
+        return sum(pipeline.execute())
+
+    def execute_function(
+        self,
+        func_name: str,
+        args: dict,
+        job_id: str = None,
+        queue: str = None,
+        priority: int = None,
+        ignore_result: bool = None,
+        affinity: str = None,
+    ) -> Celery.AsyncResult:
+        """
+        Execute a registered function as a Celery task with provided arguments.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            args (dict): Arguments to pass to the function.
+            job_id (str): The job whose status hash and counters track the task. Defaults to "default".
+            queue (str): The Celery queue to send the task to. Defaults to the queue the function was
+                registered with, or the default queue.
+            priority (int): The priority of the task in its queue, from 0 (most urgent) to 9. Defaults to the
+                priority the function was registered with, or DEFAULT_PRIORITY.
+            ignore_result (bool): Do not store the task's return value. Defaults to the IGNORE_RESULT setting.
+            affinity (str): Affinity key of the task, e.g. the digest of the asset it loads. The task is sent
+                to a worker that already ran a task with the same key if one is running, see AffinityRouter.
+                Defaults to None.
+
+        Returns:
+            celery.result.AsyncResult: An object representing the asynchronous result of the task, or a
+            LocalResult if the function runs in a local executor.
+        """
+        if self.executor is not None:
+            return self.executor.submit(self._get_function(func_name), self._resolve_args(args))
+
+        job_id = job_id or DEFAULT_JOB_ID
+        queue, affinity_headers = self._route_affinity(func_name, affinity, queue)
+        async_result = self.call_function_task.apply_async(
+            (func_name, self._offload_args(args)),
+            headers={"job_id": job_id, **affinity_headers},
+            queue=queue,
+            priority=priority,
+            ignore_result=self._ignore_result(ignore_result),
+        )
+        async_result.job_id = job_id
+        self._count_submitted(job_id, 1)
+        return async_result
+
+    def execute_batch(
+        self,
+        func_name: str,
+        args_list: List[dict],
+        job_id: str = None,
+        queue: str = None,
+        priority: int = None,
+        ignore_result: bool = None,
+        affinity: str = None,
+    ) -> Celery.AsyncResult:
+        """
+        Execute a registered function once for every item of args_list, all inside a single Celery task.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            args_list (List[dict]): Arguments to pass to the function, one dict per call.
+            job_id (str): The job whose status hash and counters track the task. Defaults to "default".
+            queue (str): The Celery queue to send the task to. Defaults to the queue the function was
+                registered with, or the default queue.
+            priority (int): The priority of the task in its queue, from 0 (most urgent) to 9. Defaults to the
+                priority the function was registered with, or DEFAULT_PRIORITY.
+            ignore_result (bool): Do not store the task's return value. Defaults to the IGNORE_RESULT setting.
+            affinity (str): Affinity key of the task, see execute_function. Defaults to None.
+
+        Returns:
+            celery.result.AsyncResult: The result of the batch task, with an item_count attribute that
+            monitor_tasks uses to report progress per item. Its value is a list of per-item results.
+        """
+        if self.executor is not None:
+            return self.executor.submit_batch(
+                self._get_function(func_name), [self._resolve_args(args) for args in args_list]
+            )
+
+        job_id = job_id or DEFAULT_JOB_ID
+        args_list = [self._offload_args(args) for args in args_list]
+        queue, affinity_headers = self._route_affinity(func_name, affinity, queue)
+        async_result = self.call_function_batch_task.apply_async(
+            (func_name, args_list),
+            headers={"job_id": job_id, **affinity_headers},
+            queue=queue,
+            priority=priority,
+            ignore_result=self._ignore_result(ignore_result),
+        )
+        async_result.item_count = len(args_list)
+        async_result.job_id = job_id
+        self._count_submitted(job_id, 1)
+        return async_result
+
+    def execute_many(
+        self,
+        func_name: str,
+        iterable_of_args: Iterable[dict],
+        chunk_size: int = 1000,
+        batch_size: int = None,
+        task_ids: Iterable[str] = None,
+        job_id: str = None,
+        queue: str = None,
+        priority: int = None,
+        ignore_result: bool = None,
+        affinity: Callable[[dict], str] = None,
+    ) -> TaskBatch:
+        """
+        Execute a registered function as many Celery tasks, one per item of iterable_of_args. Messages are
+        published through a single broker connection and, on Redis, each chunk is sent in one pipelined
+        round-trip. The iterable is consumed lazily, so a generator can be passed for very large jobs.
+
+        Args:
+            func_name (str): The name of the function to execute.
+            iterable_of_args (Iterable[dict]): Arguments to pass to the function, one dict per call.
+            chunk_size (int): Number of messages sent to the broker per round-trip. Defaults to 1000.
+            batch_size (int): If set, pack this many calls into each message and run them with
+                call_function_batch_task, as in execute_batch. Defaults to None (one call per message).
+            task_ids (Iterable[str]): IDs to give the tasks, one per message. Defaults to None (random IDs).
+            job_id (str): The job whose status hash and counters track the tasks. Defaults to "default".
+            queue (str): The Celery queue to send the tasks to. Defaults to the queue the function was
+                registered with, or the default queue.
+            priority (int): The priority of the tasks in their queue, from 0 (most urgent) to 9. Defaults to
+                the priority the function was registered with, or DEFAULT_PRIORITY.
+            ignore_result (bool): Do not store the tasks' return values. Defaults to the IGNORE_RESULT setting.
+            affinity (Callable[[dict], str]): Function returning the affinity key of a call from its
+                arguments, see execute_function. With batch_size, the key of a batch is the key of its first
+                call. Defaults to None.
+
+        Returns:
+            TaskBatch: A lightweight handle holding the IDs of the submitted tasks.
+        """
+        if self.executor is not None:
+            return self._execute_many_locally(func_name, iterable_of_args, batch_size, task_ids)
+
+        job_id = job_id or DEFAULT_JOB_ID
+        iterator = iter(iterable_of_args)
+        if batch_size is None:
+            task = self.call_function_task
+            messages = (
+                ((func_name, self._offload_args(args)), affinity and affinity(args))
+                for args in iterator
+            )
+        else:
+            task = self.call_function_batch_task
+            item_counts = []
+
+            def batch_messages():
+                while args_list := list(itertools.islice(iterator, batch_size)):
+                    item_counts.append(len(args_list))
+                    yield (
+                        (func_name, [self._offload_args(args) for args in args_list]),
+                        affinity and affinity(args_list[0]),
+                    )
+
+            messages = batch_messages()
+
+        router = self.app.amqp.router
+        options = router.route({"queue": queue, "priority": priority}, task.name, args=(func_name,))
+        options["headers"] = {"job_id": job_id}
+        # routing options of each affinity queue, and the holders and queue lengths read to route the tasks
+        affinity_options = {}
+        affinity_cache = {}
+
+        def message_options(key: str) -> dict:
+            if key is None:
+                return options
+            message_queue, headers = self._route_affinity(func_name, key, queue, affinity_cache)
+            if message_queue not in affinity_options:
+                affinity_options[message_queue] = router.route(
+                    {"queue": message_queue, "priority": priority}, task.name, args=(func_name,)
+                )
+            return {**affinity_options[message_queue], "headers": {"job_id": job_id, **headers}}
+
+        ignore_result = self._ignore_result(ignore_result)
+        id_iterator = iter(task_ids) if task_ids is not None else itertools.repeat(None)
+        task_ids = []
+
+        start_time = time.time()
+        with self.app.producer_or_acquire() as producer:
+            while True:
+                chunk = list(itertools.islice(messages, chunk_size))
+                if not chunk:
+                    break
+                # the first message is published normally so the queue gets declared on the broker
+                if not task_ids:
+                    task_args, key = chunk.pop(0)
+                    task_ids.append(
+                        self._publish_task(
+                            producer,
+                            task,
+                            task_args,
+                            message_options(key),
+                            next(id_iterator),
+                            ignore_result,
+                        )
+                    )
+                with self._pipelined_publish(producer):
+                    for task_args, key in chunk:
+                        task_ids.append(
+                            self._publish_task(
+                                producer,
+                                task,
+                                task_args,
+                                message_options(key),
+                                next(id_iterator),
+                                ignore_result,
+                            )
+                        )
+        elapsed = time.time() - start_time
+        self._count_submitted(job_id, len(task_ids))
+
+        batch = TaskBatch(
+            self.app,
+            task_ids,
+            elapsed,
+            None if batch_size is None else item_counts,
+            job_id,
+            ignore_result,
+        )
+        self.log(
+            f"Enqueued {len(batch)} tasks in {elapsed:.2f}s ({batch.throughput:.0f} tasks/s)"
+        )
+        return batch
+
+    def _execute_many_locally(
+        self,
+        func_name: str,
+        iterable_of_args: Iterable[dict],
+        batch_size: int = None,
+        task_ids: Iterable[str] = None,
+    ) -> TaskBatch:
+        """
+        Submit the calls of execute_many to the local executor.
+        """
+        func = self._get_function(func_name)
+        iterator = (self._resolve_args(args) for args in iterable_of_args)
+        id_iterator = iter(task_ids) if task_ids is not None else itertools.repeat(None)
+        results = []
+        start_time = time.time()
+        if batch_size is None:
+            for args in iterator:
+                results.append(self.executor.submit(func, args, next(id_iterator)))
+        else:
+            while args_list := list(itertools.islice(iterator, batch_size)):
+                results.append(self.executor.submit_batch(func, args_list, next(id_iterator)))
+        elapsed = time.time() - start_time
+
+        return TaskBatch(
+            self.executor,
+            [result.id for result in results],
+            elapsed,
+            None if batch_size is None else [result.item_count for result in results],
+        )
+
+    def _get_function(self, func_name: str) -> callable:
+        if func_name not in self.registered_functions:
+            raise ValueError(f"Function '{func_name}' is not registered.")
+        # functions with a setup hook or the asset cache are called through their WarmFunction
+        return self.warm_functions.get(func_name) or self.registered_functions[func_name]
+
+    def plan_jobs(
+        self, func_name: str, job_configs: List[dict], repo_id: str = None, job_id: str = None
+    ) -> dict:
+        """
+        Find the jobs of a run that still have to be executed, e.g. to resume an interrupted run. A job is
+        done if all of its outputs exist in the repository, or if its task already reported success. Every
+        job gets a task ID derived from its function, parameters and outputs, so the same job keeps the same
+        ID across restarts. The repository is listed once and task statuses are read with batched HMGETs.
+
+        Args:
+            func_name (str): The name of the registered function that runs the jobs.
+            job_configs (List[dict]): Jobs as dicts with "task_params" (the function arguments) and optionally
+                "outputs" (paths of the files the job uploads to the repository).
+            repo_id (str): The ID of the repository holding the outputs. Defaults to HF_REPO_ID.
+            job_id (str): The job whose status hash holds the task statuses. Defaults to "default".
+
+        Returns:
+            dict: "pending" (job configs still to run), "task_ids" (their task IDs) and "done" (number of
+            jobs skipped).
+        """
+        repo_id = repo_id or self.settings.get("HF_REPO_ID")
+        task_ids = [
+            self.get_job_task_id(func_name, job_config) for job_config in job_configs
+        ]
+
+        outputs = {
+            output for job_config in job_configs for output in job_config.get("outputs", [])
+        }
+        existing_outputs = set()
+        if outputs:
+            # take one fresh snapshot of the repository instead of a possibly stale cached index
+            file_index = self.get_file_index(repo_id)
+            file_index.invalidate()
+            existing_outputs = {
+                output
+                for output, found in zip(outputs, file_index.contains(outputs))
+                if found
+            }
+
+        statuses = self.get_task_statuses(task_ids, job_id)
+
+        plan = {"pending": [], "task_ids": [], "done": 0}
+        for job_config, task_id, status in zip(job_configs, task_ids, statuses):
+            job_outputs = job_config.get("outputs", [])
+            outputs_exist = bool(job_outputs) and all(
+                output in existing_outputs for output in job_outputs
+            )
+            if outputs_exist or status == "success":
+                plan["done"] += 1
+            else:
+                plan["pending"].append(job_config)
+                plan["task_ids"].append(task_id)
+
+        self.log(
+            f"Planned {len(job_configs)} jobs: {plan['done']} done, {len(plan['pending'])} to execute"
+        )
+        return plan
+
+    def execute_jobs(
+        self,
+        func_name: str,
+        job_configs: List[dict],
+        repo_id: str = None,
+        chunk_size: int = 1000,
+        job_id: str = None,
+        queue: str = None,
+        priority: int = None,
+        ignore_result: bool = None,
+        affinity: Callable[[dict], str] = None,
+    ) -> TaskBatch:
+        """
+        Execute only the jobs of a run that are not done yet, as found by plan_jobs, with execute_many.
+
+        Args:
+            func_name (str): The name of the registered function that runs the jobs.
+            job_configs (List[dict]): Jobs as dicts with "task_params" and optionally "outputs".
+            repo_id (str): The ID of the repository holding the outputs. Defaults to HF_REPO_ID.
+            chunk_size (int): Number of messages sent to the broker per round-trip. Defaults to 1000.
+            job_id (str): The job whose status hash and counters track the tasks. Defaults to "default".
+            queue (str): The Celery queue to send the tasks to. Defaults to the queue the function was
+                registered with, or the default queue.
+            priority (int): The priority of the tasks in their queue, from 0 (most urgent) to 9. Defaults to
+                the priority the function was registered with, or DEFAULT_PRIORITY.
+            ignore_result (bool): Do not store the tasks' return values. Defaults to the IGNORE_RESULT setting.
+            affinity (Callable[[dict], str]): Function returning the affinity key of a job from its
+                task_params, see execute_many. Defaults to None.
+
+        Returns:
+            TaskBatch: Handle for the submitted tasks, empty if every job is done.
+        """
+        plan = self.plan_jobs(func_name, job_configs, repo_id, job_id)
+
+        # a resubmitted job reuses its task ID, so drop the result of its previous attempt
+        backend = self.app.backend
+        redis_client = self.get_redis_connection()
+        for start in range(0, len(plan["task_ids"]), 1000):
+            chunk = plan["task_ids"][start : start + 1000]
+            redis_client.delete(*[backend.get_key_for_task(t) for t in chunk])
+
+        return self.execute_many(
+            func_name,
+            (job_config["task_params"] for job_config in plan["pending"]),
+            chunk_size=chunk_size,
+            task_ids=plan["task_ids"],
+            job_id=job_id,
+            queue=queue,
+            priority=priority,
+            ignore_result=ignore_result,
+            affinity=affinity,
+        )
+
+    def get_job_task_id(self, func_name: str, job_config: dict) -> str:
+        """
+        Derive a stable task ID for a job from its function, parameters and outputs.
+
+        Args:
+            func_name (str): The name of the registered function that runs the job.
+            job_config (dict): The job, with "task_params" and optionally "outputs".
+
+        Returns:
+            str: The task ID, formatted as a UUID.
+        """
+        key = json.dumps(
+            [func_name, job_config.get("task_params"), job_config.get("outputs", [])],
+            sort_keys=True,
+            default=repr,
+        )
+        return str(UUID(bytes=hashlib.sha256(key.encode()).digest()[:16]))
+
+    def _publish_task(
+        self,
+        producer,
+        task,
+        task_args: tuple,
+        options: dict,
+        task_id: str = None,
+        ignore_result: bool = False,
+    ) -> str:
+        """
+        Publish a single task message without creating an AsyncResult for it.
+
+        Returns:
+            str: The ID of the published task.
+        """
+        amqp = self.app.amqp
+        task_id = task_id or uuid()
+        # the message always carries ignore_result, which overrides the task's default on the worker
+        message = amqp.create_task_message(
+            task_id, task.name, task_args, {}, ignore_result=ignore_result
+        )
+        amqp.send_task_message(producer, task.name, message, **options)
+        return task_id
+
+    @contextmanager
+    def _pipelined_publish(self, producer):
+        """
+        Buffer every message published on the producer's channel in a Redis pipeline and send them all
+        in a single round-trip on exit. Does nothing for brokers other than Redis.
+        """
+        channel = producer.channel
+        if not hasattr(channel, "conn_or_acquire"):
+            yield
+            return
+
+        pipe = channel.client.pipeline(transaction=False)
+        channel.conn_or_acquire = lambda client=None: nullcontext(pipe)
+        try:
+            yield
+        finally:
+            del channel.conn_or_acquire
+        pipe.execute()
+
+    def get_blob_store(self, ttl: int = DEFAULT_BLOB_TTL):
+        """
+        Return the blob store configured by the BLOB_STORE setting.
+
+        Args:
+            ttl (int): Seconds blobs stored in Redis are kept. Defaults to 7 days.
+
+        Returns:
+            RedisBlobStore | FileBlobStore: The store offloaded task arguments are kept in.
+        """
+        blob_store = self.settings.get("BLOB_STORE")
+        if blob_store in (None, "", "redis"):
+            return RedisBlobStore(self.get_redis_connection(), ttl)
+        return FileBlobStore(blob_store)
+
+    def offload(self, value: any, ttl: int = DEFAULT_BLOB_TTL) -> dict:
+        """
+        Store a value in the blob store and return a reference that can be passed as a task argument in its place.
+        Workers replace the reference with the value before calling the registered function. Passing the same
+        reference to many tasks avoids encoding and hashing a large shared argument for every task.
+
+        Args:
+            value (any): The value to offload. Must be supported by the task serializer.
+            ttl (int): Seconds the value is kept if the blob store is Redis. Defaults to 7 days.
+
+        Returns:
+            dict: Reference to the stored value.
+        """
+        content_type, content_encoding, data = dumps(
+            value, serializer=self.app.conf.task_serializer
+        )
+        if isinstance(data, str):
+            data = data.encode()
+        return self._offload_data(data, content_type, content_encoding, ttl)
+
+    def _offload_data(
+        self, data: bytes, content_type: str, content_encoding: str, ttl: int = DEFAULT_BLOB_TTL
+    ) -> dict:
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        # arguments and results are kept for different TTLs, so the same blob is tracked once per TTL
+        if self.stored_blobs.get((digest, ttl), 0) <= now:
+            # only refreshes the expiry of a blob that is still stored
+            self.get_blob_store(ttl).put(digest, data)
+            if len(self.stored_blobs) >= 10000:
+                self.stored_blobs = {
+                    key: until for key, until in self.stored_blobs.items() if until > now
+                }
+            self.stored_blobs[(digest, ttl)] = now + min(BLOB_REFRESH_INTERVAL, ttl / 10)
+
+        return {
+            BLOB_MARKER: digest,
+            "content_type": content_type,
+            "content_encoding": content_encoding,
+        }
+
+    def _offload_args(self, args: dict) -> dict:
+        """
+        Offload every argument whose encoded size is at least the BLOB_THRESHOLD setting.
+
+        Args:
+            args (dict): Arguments of a task.
+
+        Returns:
+            dict: The arguments, with large values replaced by references to the blob store.
+        """
+        threshold = self.settings.get("BLOB_THRESHOLD")
+        if not threshold:
+            return args
+
+        offloaded = {}
+        for key, value in args.items():
+            # scalars and short strings are never large enough, skip encoding them
+            if (
+                value is None
+                or isinstance(value, (bool, int, float))
+                or (isinstance(value, (str, bytes)) and len(value) < threshold // 4)
+                or is_blob_ref(value)
+            ):
+                offloaded[key] = value
+                continue
+
+            _, _, data = dumps(value, serializer=self.app.conf.task_serializer)
+            offloaded[key] = self.offload(value) if len(data) >= threshold else value
+        return offloaded
+
+    def _resolve_args(self, args: dict) -> dict:
+        """
+        Replace references to offloaded arguments with their values. Fetched blobs are cached on the local disk,
+        so a blob shared by many tasks is only downloaded once per node.
+
+        Args:
+            args (dict): Arguments of a task, as received by the worker.
+
+        Returns:
+            dict: The arguments with every blob reference resolved.
+
+        Raises:
+            ValueError: If a referenced blob is missing from the blob store.
+        """
+        if not any(is_blob_ref(value) for value in args.values()):
+            return args
+
+        if self.blob_cache is None:
+            self.blob_cache = BlobCache(
+                self.settings.get("BLOB_CACHE_DIR"), self.settings["BLOB_CACHE_SIZE"]
+            )
+
+        resolved = {}
+        for key, value in args.items():
+            if not is_blob_ref(value):
+                resolved[key] = value
+                continue
+
+            digest = value[BLOB_MARKER]
+            data = self.blob_cache.get(digest)
+            if data is None:
+                data = self.get_blob_store().get(digest)
+                if data is None:
+                    raise ValueError(f"Blob {digest} for argument '{key}' not found in the blob store")
+                self.blob_cache.put(digest, data)
+            resolved[key] = self._load_blob(data, value)
+        return resolved
+
+    def _load_blob(self, data: bytes, ref: dict) -> any:
+        return loads(
+            data,
+            ref["content_type"],
+            ref["content_encoding"],
+            accept=prepare_accept_content(self.app.conf.accept_content),
+        )
+
+    def _offload_result(self, result: any) -> any:
+        """
+        Store a task's return value in the blob store if its encoded size is at least the RESULT_THRESHOLD
+        setting, so the result backend only keeps a small reference.
+
+        Args:
+            result (any): The return value of the task.
+
+        Returns:
+            any: The return value, or a reference to it in the blob store.
+        """
+        threshold = self.settings.get("RESULT_THRESHOLD")
+        request = current_task.request if current_task else None
+        if (
+            not threshold
+            or result is None
+            or isinstance(result, (bool, int, float))
+            or (isinstance(result, (str, bytes)) and len(result) < threshold // 4)
+            or (request is not None and request.ignore_result)
+        ):
+            return result
+
+        content_type, content_encoding, data = dumps(
+            result, serializer=self.app.conf.result_serializer
+        )
+        if isinstance(data, str):
+            data = data.encode()
+        if len(data) < threshold:
+            return result
+        return self._offload_data(
+            data,
+            content_type,
+            content_encoding,
+            self.settings["RESULT_EXPIRES"] or DEFAULT_BLOB_TTL,
+        )
+
+    def resolve_result(self, result: any) -> any:
+        """
+        Return the value of a task result, fetching it from the blob store if the worker stored it there
+        because it was larger than RESULT_THRESHOLD. Other results are returned unchanged.
+
+        Args:
+            result (any): The result of a task, e.g. from AsyncResult.get().
+
+        Returns:
+            any: The return value of the task's function.
+
+        Raises:
+            ValueError: If the referenced blob expired or is missing from the blob store.
+        """
+        if not is_blob_ref(result):
+            return result
+        digest = result[BLOB_MARKER]
+        data = self.get_blob_store().get(digest)
+        if data is None:
+            raise ValueError(f"Result blob {digest} not found in the blob store")
+        return self._load_blob(data, result)
+
+    def get_result(self, task, timeout: float = None) -> any:
+        """
+        Wait for a task and return its result, resolved with resolve_result.
+
+        Args:
+            task (celery.result.AsyncResult): The task.
+            timeout (float): Seconds to wait for the task. Defaults to None (no limit).
+
+        Returns:
+            any: The return value of the task's function.
+        """
+        return self.resolve_result(task.get(timeout=timeout))
+
+    def record_task_duration(self, duration: float) -> None:
+        """
+        Record how long a function call took, keeping the latest 1000 durations in Redis. On Vast.ai workers
+        the duration is also added to the totals of the machine, see get_machine_durations.
+
+        Args:
+            duration (float): Duration of the call in seconds.
+        """
+        pipeline = self.get_redis_connection().pipeline(transaction=False)
+        self._record_task_duration(pipeline, duration)
+        pipeline.execute()
+
+    def _record_task_duration(self, pipeline, duration: float, task_id: str = None) -> None:
+        pipeline.lpush("task_durations", duration)
+        pipeline.ltrim("task_durations", 0, 999)
+        # workers on Vast.ai also keep totals per machine, used to rank offers of machines rented before
+        machine_id = os.getenv("VAST_MACHINE_ID")
+        if machine_id:
+            pipeline.hincrbyfloat("machine_durations", f"{machine_id}:total", duration)
+            pipeline.hincrby("machine_durations", f"{machine_id}:count", 1)
+        # and the latest completions of their instance, used to find slow nodes
+        instance_id = os.getenv("CONTAINER_ID")
+        if instance_id:
+            key = f"node_tasks:{instance_id}"
+            pipeline.lpush(key, json.dumps([task_id, duration, time.time()]))
+            pipeline.ltrim(key, 0, 99)
+            pipeline.sadd("nodes", instance_id)
+
+    def get_task_duration(self) -> float:
+        """
+        Get the average duration of the recently executed function calls.
+
+        Returns:
+            float: Average duration in seconds, or None if no durations were recorded.
+        """
+        durations = self.get_redis_connection().lrange("task_durations", 0, 999)
+        if not durations:
+            return None
+        return sum(float(duration) for duration in durations) / len(durations)
+
+    def get_machine_durations(self) -> Dict[str, float]:
+        """
+        Get the average task duration measured on each Vast.ai machine that ran tasks.
+
+        Returns:
+            Dict[str, float]: Average duration in seconds, keyed by Vast.ai machine ID.
+        """
+        totals = self.get_redis_connection().hgetall("machine_durations")
+        durations = {}
+        for field, value in totals.items():
+            machine_id, kind = field.decode().rsplit(":", 1)
+            if kind == "count" and int(value) > 0:
+                total = totals.get(f"{machine_id}:total".encode())
+                if total is not None:
+                    durations[machine_id] = float(total) / int(value)
+        return durations
+
+    def get_node_stats(self) -> Dict[str, dict]:
+        """
+        Get the throughput of each Vast.ai node over its latest 100 completed tasks.
+
+        Returns:
+            Dict[str, dict]: Keyed by instance ID, the number of tasks in the window ("tasks"), their
+            average duration in seconds ("average_duration"), the tasks per hour of one worker slot at that
+            duration ("throughput"), and when the latest task finished ("last_seen", a Unix timestamp).
+        """
+        redis_client = self.get_redis_connection()
+        instance_ids = sorted(instance_id.decode() for instance_id in redis_client.smembers("nodes"))
+        pipeline = redis_client.pipeline(transaction=False)
+        for instance_id in instance_ids:
+            pipeline.lrange(f"node_tasks:{instance_id}", 0, 99)
+
+        stats = {}
+        for instance_id, entries in zip(instance_ids, pipeline.execute()):
+            if not entries:
+                continue
+            completions = [json.loads(entry) for entry in entries]
+            average_duration = sum(c[1] for c in completions) / len(completions)
+            stats[instance_id] = {
+                "tasks": len(completions),
+                "average_duration": average_duration,
+                "throughput": 3600 / average_duration if average_duration > 0 else float("inf"),
+                "last_seen": max(c[2] for c in completions),
+            }
+        return stats
+
+    def find_slow_nodes(
+        self,
+        instance_ids: Iterable[str] = None,
+        percentile: float = 10,
+        max_slowdown: float = 0.7,
+        min_tasks: int = 5,
+    ) -> List[str]:
+        """
+        Find nodes whose throughput is below the given percentile of the fleet and below max_slowdown times
+        the fleet median, e.g. throttled or overloaded machines that would drag out the tail of a job.
+
+        Args:
+            instance_ids (Iterable[str]): Instance IDs of the fleet to compare. Defaults to None (every node
+                with recorded tasks).
+            percentile (float): Percentile of the fleet's throughputs below which a node may be slow.
+                Defaults to 10.
+            max_slowdown (float): Fraction of the median throughput below which a node may be slow.
+                Defaults to 0.7.
+            min_tasks (int): Tasks a node must have completed to be judged. Defaults to 5.
+
+        Returns:
+            List[str]: The instance IDs of the slow nodes, slowest first.
+        """
+        stats = self.get_node_stats()
+        if instance_ids is not None:
+            wanted = {str(instance_id) for instance_id in instance_ids}
+            stats = {key: value for key, value in stats.items() if key in wanted}
+        stats = {key: value for key, value in stats.items() if value["tasks"] >= min_tasks}
+        # a percentile of fewer than three nodes says nothing about the fleet
+        if len(stats) < 3:
+            return []
+
+        throughputs = sorted(value["throughput"] for value in stats.values())
+
+        def interpolate(q):
+            position = (len(throughputs) - 1) * q / 100
+            lower = int(position)
+            upper = min(lower + 1, len(throughputs) - 1)
+            return throughputs[lower] + (throughputs[upper] - throughputs[lower]) * (position - lower)
+
+        threshold = min(interpolate(percentile), interpolate(50) * max_slowdown)
+        slow = [key for key, value in stats.items() if value["throughput"] < threshold]
+        return sorted(slow, key=lambda key: stats[key]["throughput"])
+
+    def update_function_status(
+        self, task_id: str, status: str, duration: float = None, job_id: str = None
+    ) -> None:
+        """
+        Update the status of a function task in the status hash of its job, and the job's count of tasks per
+        status. Both expire STATUS_TTL seconds after the job's latest update. With a duration, the completion
+        is also recorded for get_task_duration, get_machine_durations and, tagged with the task ID and the
+        worker's instance ID, for get_node_stats, all in the same round-trip.
+
+        Args:
+            task_id (str): The ID of the task.
+            status (str): The new status to set.
+            duration (float): Seconds the task's function call took. Defaults to None.
+            job_id (str): The job of the task. Defaults to "default".
+        """
+        job_id = job_id or DEFAULT_JOB_ID
+        redis_client = self.get_redis_connection()
+        if self.status_script is None:
+            self.status_script = redis_client.register_script(SET_STATUS_SCRIPT)
+        pipeline = redis_client.pipeline(transaction=False)
+        # functions called outside of a worker have no task ID to record a status for
+        if task_id is not None:
+            self.status_script(
+                keys=[f"job_status:{job_id}", f"job_counts:{job_id}"],
+                args=[task_id, status, self.settings["STATUS_TTL"]],
+                client=pipeline,
+            )
+        if duration is not None:
+            self._record_task_duration(pipeline, duration, task_id)
+        pipeline.execute()
 
-    def get_env(self, key: str, default: any = None) -> any:
+    def get_task_statuses(self, task_ids: Iterable[str], job_id: str = None) -> List[str]:
         """
-        Retrieve a value from the configuration or .env file, with an optional default if the key is not found.
+        Get the statuses of many tasks of a job with batched HMGET calls.
 
         Args:
-            key (str): The key to look for in the settings.
-            default (any): The default value to return if the key is not found. Defaults to None.
+            task_ids (Iterable[str]): The IDs of the tasks.
+            job_id (str): The job of the tasks. Defaults to "default".
 
         Returns:
-            any: The value from the settings if the key exists, otherwise the default value.
+            List[str]: The status of each task, or None for tasks without a status.
         """
-        return self.settings.get(key, default)
+        key = f"job_status:{job_id or DEFAULT_JOB_ID}"
+        redis_client = self.get_redis_connection()
+        iterator = iter(task_ids)
+        statuses = []
+        while chunk := list(itertools.islice(iterator, 1000)):
+            statuses.extend(
+                status.decode() if status is not None else None
+                for status in redis_client.hmget(key, chunk)
+            )
+        return statuses
 
-    def call_function_task(self, func_name: str, args_json: str) -> any:
+    def get_job_progress(self, job_id: str = None) -> Dict[str, int]:
         """
-        Creates Celery task that executes a registered function with provided JSON arguments.
+        Get the number of tasks of a job per status, read from the job's counters in a single command
+        regardless of the number of tasks.
 
         Args:
-            func_name (str): The name of the registered function to execute.
-            args_json (str): JSON string representation of the arguments for the function.
+            job_id (str): The job. Defaults to "default".
 
         Returns:
-            any: Celery.app.task object, represents result of the registered function
-
-        Raises:
-            ValueError: If the function name is not registered.
-            Exception: If an error occurs during the execution of the function. The task will retry in this case.
+            Dict[str, int]: Number of tasks per status (e.g. "success", "failure"), and the number of tasks
+            submitted to the job under "submitted".
         """
-        try:
-            if func_name not in self.registered_functions:
-                raise ValueError(f"Function '{func_name}' is not registered.")
-
-            func = self.registered_functions[func_name]
-            args = json.loads(args_json)
-            result = func(**args)
-            self.update_function_status(self.call_function_task.request.id, "success")
+        counts = self.get_redis_connection().hgetall(f"job_counts:{job_id or DEFAULT_JOB_ID}")
+        return {status.decode(): int(count) for status, count in counts.items()}
 
-            return result
-        except Exception as e:
-            self.log(f"Error in call_function_task: {str(e)}", "error")
-            self.call_function_task.retry(exc=e)
+    def delete_job_status(self, job_id: str = None) -> None:
+        """
+        Delete the task statuses and counters of a job with a single command.
 
-        return result
+        Args:
+            job_id (str): The job. Defaults to "default".
+        """
+        job_id = job_id or DEFAULT_JOB_ID
+        self.get_redis_connection().unlink(f"job_status:{job_id}", f"job_counts:{job_id}")
 
-    def register_function(self, func: callable) -> callable:
+    def create_job(
+        self,
+        job_id: str = None,
+        queue: str = None,
+        cleanup_on_exit: bool = True,
+        parent_queue: str = None,
+    ) -> Job:
         """
-        Decorator to register a function so that it can be invoked as a Celery task.
+        Create a job with its own queue, task statuses and results, so its progress, purging and cleanup do
+        not touch the tasks of other jobs sharing the Redis server. Running workers consuming from the job's
+        parent queue start consuming from the job's queue right away.
 
         Args:
-            func (callable): The function to register.
+            job_id (str): The ID of the job. Defaults to a random ID.
+            queue (str): The Celery queue of the job's tasks. Defaults to "job.<job_id>".
+            cleanup_on_exit (bool): Delete the job's queue, statuses and results when this process exits.
+                Set to False to resume the job from another process. Defaults to True.
+            parent_queue (str): Only workers consuming from this queue, e.g. the queue of an autoscaler, run
+                the job's tasks. Defaults to the default queue.
 
         Returns:
-            callable: The original function, now registered as a callable task.
+            Job: The job.
         """
-        self.registered_functions[func.__name__] = func
-        return func
+        job = Job(self, job_id or uuid(), queue, cleanup_on_exit, parent_queue)
+        job.start()
+        self.jobs[job.job_id] = job
+        return job
 
-    def execute_function(self, func_name: str, args: dict) -> Celery.AsyncResult:
+    def _cleanup_jobs(self) -> None:
         """
-        Execute a registered function as a Celery task with provided arguments.
+        Clean up the jobs this instance created with cleanup_on_exit and stop workers consuming from their
+        queues, called on exit. Jobs kept for another process keep their queue and consumers, and tasks
+        submitted without a job are left alone, as the default job is shared by every driver.
+        """
+        cleaned = 0
+        for job in list(self.jobs.values()):
+            if not job.cleanup_on_exit:
+                continue
+            try:
+                job.cleanup()
+                job.close()
+                cleaned += 1
+            except Exception as e:
+                self.log(f"Error cleaning up job {job.job_id}: {e}", "error")
+        if cleaned:
+            print(f"Cleared {cleaned} jobs from the Celery queue and Redis server")
+        self.jobs = {}
+
+    def _ignore_result(self, ignore_result: bool = None) -> bool:
+        return self.settings["IGNORE_RESULT"] if ignore_result is None else ignore_result
+
+    def _count_submitted(self, job_id: str, count: int) -> None:
+        key = f"job_counts:{job_id}"
+        pipeline = self.get_redis_connection().pipeline(transaction=False)
+        pipeline.hincrby(key, "submitted", count)
+        if self.settings["STATUS_TTL"] > 0:
+            pipeline.expire(key, self.settings["STATUS_TTL"])
+        pipeline.execute()
+
+    def get_http_client(self) -> "HttpClient":
+        """
+        Get the HTTP client whose sessions make all Vast.ai and Hugging Face requests, creating it on first use.
 
-        Args:
-            func_name (str): The name of the function to execute.
-            args (dict): Arguments to pass to the function.
+        Returns:
+            HttpClient: The client, with the timeout, retries and backoff of the HTTP settings.
+        """
+        if self.http_client is None:
+            from .clients import HttpClient
+
+            self.http_client = HttpClient(
+                timeout=self.settings["HTTP_TIMEOUT"],
+                retries=self.settings["HTTP_RETRIES"],
+                backoff=self.settings["HTTP_BACKOFF"],
+            )
+        return self.http_client
+
+    def get_hf_api(self) -> "HfApi":
+        """
+        Get the Hugging Face API client shared by all Hugging Face calls, creating it on first use. Hugging
+        Face requests of the process go through sessions of the shared HTTP client, so they keep connections
+        alive and are counted in get_http_metrics.
 
         Returns:
-            celery.result.AsyncResult: An object representing the asynchronous result of the task.
+            HfApi: The client, authenticated with HF_TOKEN.
         """
-        args_json = json.dumps(args)
-        async_result = self.call_function_task.delay(func_name, args_json)
-        return async_result
+        if self.hf_api is None:
+            from huggingface_hub import HfApi
+
+            self.get_http_client().configure_huggingface_hub()
+            self.hf_api = HfApi(token=self.settings.get("HF_TOKEN"))
+        return self.hf_api
 
-    def update_function_status(self, task_id: str, status: str) -> None:
+    def get_http_metrics(self) -> dict:
         """
-        Update the status of a function task as a new Redis key.
+        Return the metrics of the Vast.ai and Hugging Face requests made by this instance.
 
-        Args:
-            task_id (str): The ID of the task.
-            status (str): The new status to set.
+        Returns:
+            dict: Number of requests, error responses and retries, total and average latency in seconds, and
+            the number of connections opened and requests that reused an open connection.
         """
-        redis_client = self.get_redis_connection()
-        redis_client.set(f"task_status:{task_id}", status)
+        return self.get_http_client().get_metrics()
 
     def initialize_dataset(self, **kwargs) -> None:
         """
@@ -282,9 +1730,12 @@ class Distributaur:
         Raises:
             HTTPError: If repo cannot be created due to connection error other than repo not existing
         """
+        from huggingface_hub import Repository
+        from requests.exceptions import HTTPError
+
         repo_id = self.settings.get("HF_REPO_ID")
         hf_token = self.settings.get("HF_TOKEN")
-        api = HfApi(token=hf_token)
+        api = self.get_hf_api()
 
         # creates new repo if desired repo is not found
         try:
@@ -322,12 +1773,95 @@ class Distributaur:
                 with open(os.path.join(temp_dir, "config.json"), "w") as f:
                     json.dump(config, f, indent=2)
 
+        self.get_file_index(repo_id).invalidate()
         self.log(f"Initialized repository {repo_id}.")
 
+    def get_upload_queue(self) -> UploadQueue:
+        """
+        Get the background upload queue, starting it on first use. The queue is flushed when the process
+        exits and when a Celery worker process shuts down.
+
+        Returns:
+            UploadQueue: The upload queue for the configured Hugging Face repository.
+        """
+        if self.upload_queue is None:
+            repo_id = self.settings.get("HF_REPO_ID")
+            self.upload_queue = UploadQueue(
+                self.get_hf_api(),
+                repo_id,
+                on_commit=self.get_file_index(repo_id).add,
+            )
+            atexit.register(self.upload_queue.close)
+
+            def close_upload_queue(**kwargs):
+                self.upload_queue.close()
+
+            signals.worker_process_shutdown.connect(close_upload_queue, weak=False)
+        return self.upload_queue
+
+    def flush_uploads(self, timeout: float = None) -> bool:
+        """
+        Block until every file queued by upload_file is committed to Hugging Face or dropped after retries.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait. Defaults to None (wait until done).
+
+        Returns:
+            bool: True if all queued uploads were handled, False if the timeout expired first.
+        """
+        if self.upload_queue is None:
+            return True
+        return self.upload_queue.flush(timeout)
+
+    def get_upload_metrics(self) -> dict:
+        """
+        Return the metrics of the background upload queue.
+
+        Returns:
+            dict: Queue depth, uploaded and failed file counts, commits, retries and commit latencies.
+        """
+        return self.get_upload_queue().get_metrics()
+
+    def _claim_upload(self, path_in_repo: str) -> bool:
+        """
+        Claim an output path for the current execution of a task, so of two speculative copies of the same
+        task only one uploads each output. Always succeeds outside of tasks.
+
+        Returns:
+            bool: True if this execution may upload the file.
+        """
+        request = current_task.request if current_task else None
+        token = getattr(request, "execution_token", None) if request is not None else None
+        if token is None:
+            return True
+
+        key = f"upload_claim:{request.id}:{path_in_repo}"
+        redis_client = self.get_redis_connection()
+        if redis_client.set(key, token, nx=True, ex=24 * 60 * 60):
+            request.upload_claims = getattr(request, "upload_claims", []) + [key]
+            return True
+        return redis_client.get(key) == token.encode()
+
+    def _release_upload_claims(self) -> None:
+        """
+        Release the output paths claimed by the current execution of a task, so a retry can upload them.
+        """
+        request = current_task.request if current_task else None
+        claims = getattr(request, "upload_claims", []) if request is not None else []
+        if not claims:
+            return
+        redis_client = self.get_redis_connection()
+        token = request.execution_token.encode()
+        for key, value in zip(claims, redis_client.mget(claims)):
+            if value == token:
+                redis_client.delete(key)
+        request.upload_claims = []
+
     # upload a single file to the Hugging Face repository
     def upload_file(self, file_path: str) -> None:
         """
-        Upload a file to a Hugging Face repository.
+        Upload a file to a Hugging Face repository. If HF_UPLOAD_ASYNC is enabled, the file is queued and
+        committed together with other queued files by a background thread; call flush_uploads to wait for it.
 
         Args:
             file_path (str): The path of the file to upload.
@@ -339,7 +1873,16 @@ class Distributaur:
         hf_token = self.settings.get("HF_TOKEN")
         repo_id = self.settings.get("HF_REPO_ID")
 
-        api = HfApi(token=hf_token)
+        if not self._claim_upload(os.path.basename(file_path)):
+            self.log(f"Skipping upload of {file_path}, another copy of this task uploads it")
+            return
+
+        if self.settings.get("HF_UPLOAD_ASYNC"):
+            self.get_upload_queue().put(file_path, os.path.basename(file_path))
+            self.log(f"Queued {file_path} for upload to Hugging Face repo {repo_id}")
+            return
+
+        api = self.get_hf_api()
 
         try:
             self.log(f"Uploading {file_path} to Hugging Face repo {repo_id}")
@@ -350,6 +1893,7 @@ class Distributaur:
                 token=hf_token,
                 repo_type="dataset",
             )
+            self.get_file_index(repo_id).add([os.path.basename(file_path)])
             self.log(f"Uploaded {file_path} to Hugging Face repo {repo_id}")
         except Exception as e:
             self.log(
@@ -375,12 +1919,17 @@ class Distributaur:
         try:
             self.log(f"Uploading {dir_path} to Hugging Face repo {repo_id}")
 
-            api = HfApi(token=hf_token)
+            api = self.get_hf_api()
             api.upload_folder(
                 folder_path=dir_path,
                 repo_id=repo_id,
                 repo_type="dataset",
             )
+            self.get_file_index(repo_id).add(
+                os.path.relpath(os.path.join(root, file), dir_path).replace(os.sep, "/")
+                for root, _, files in os.walk(dir_path)
+                for file in files
+            )
             self.log(f"Uploaded {dir_path} to Hugging Face repo {repo_id}")
         except Exception as e:
             self.log(
@@ -401,7 +1950,7 @@ class Distributaur:
 
         """
         hf_token = self.settings.get("HF_TOKEN")
-        api = HfApi(token=hf_token)
+        api = self.get_hf_api()
 
         try:
             api.delete_file(
@@ -410,6 +1959,7 @@ class Distributaur:
                 repo_type="dataset",
                 token=hf_token,
             )
+            self.get_file_index(repo_id).discard([path_in_repo])
             self.log(f"Deleted {path_in_repo} from Hugging Face repo {repo_id}")
         except Exception as e:
             self.log(
@@ -417,9 +1967,37 @@ class Distributaur:
                 "error",
             )
 
+    def get_file_index(self, repo_id: str) -> RepoFileIndex:
+        """
+        Get the cached index of the files in a Hugging Face repository.
+
+        Args:
+            repo_id (str): The ID of the repository.
+
+        Returns:
+            RepoFileIndex: The file index of the repository.
+        """
+        if repo_id not in self.file_indexes:
+            hf_token = self.settings.get("HF_TOKEN")
+
+            def list_repo_files():
+                return self.get_hf_api().list_repo_files(
+                    repo_id=repo_id, repo_type="dataset", token=hf_token
+                )
+
+            shared = self.settings.get("FILE_INDEX_SHARED")
+            self.file_indexes[repo_id] = RepoFileIndex(
+                list_repo_files,
+                ttl=self.settings.get("FILE_INDEX_TTL"),
+                redis_client=self.get_redis_connection() if shared else None,
+                key=f"repo_files:{repo_id}",
+            )
+        return self.file_indexes[repo_id]
+
     def file_exists(self, repo_id: str, path_in_repo: str) -> bool:
         """
-        Check if a file exists in a Hugging Face repository.
+        Check if a file exists in a Hugging Face repository. Uses the cached file index of the repository;
+        use files_exist to check many files at once.
 
         Args:
             repo_id (str): The ID of the repository.
@@ -431,24 +2009,34 @@ class Distributaur:
         Raises:
             Exception: If an error occurs while checking the existence of the file.
         """
-        hf_token = self.settings.get("HF_TOKEN")
-        api = HfApi(token=hf_token)
+        return self.files_exist(repo_id, [path_in_repo])[path_in_repo]
+
+    def files_exist(self, repo_id: str, paths_in_repo: Iterable[str]) -> Dict[str, bool]:
+        """
+        Check which of many files exist in a Hugging Face repository, with at most one listing of the
+        repository.
+
+        Args:
+            repo_id (str): The ID of the repository.
+            paths_in_repo (Iterable[str]): The paths of the files to check within the repository.
 
+        Returns:
+            Dict[str, bool]: Maps each path to True if the file exists in the repository, False otherwise.
+        """
+        paths_in_repo = list(paths_in_repo)
         try:
-            repo_files = api.list_repo_files(
-                repo_id=repo_id, repo_type="dataset", token=hf_token
-            )
-            return path_in_repo in repo_files
+            found = self.get_file_index(repo_id).contains(paths_in_repo)
+            return dict(zip(paths_in_repo, found))
         except Exception as e:
             self.log(
-                f"Failed to check if {path_in_repo} exists in Hugging Face repo {repo_id}: {e}",
+                f"Failed to check if {len(paths_in_repo)} files exist in Hugging Face repo {repo_id}: {e}",
                 "error",
             )
-            return False
+            return {path: False for path in paths_in_repo}
 
     def list_files(self, repo_id: str) -> list:
         """
-        Get a list of files from a Hugging Face repository.
+        Get a list of files from a Hugging Face repository. Uses the cached file index of the repository.
 
         Args:
             repo_id (str): The ID of the repository.
@@ -459,14 +2047,8 @@ class Distributaur:
         Raises:
             Exception: If an error occurs while retrieving the list of files.
         """
-        hf_token = self.settings.get("HF_TOKEN")
-        api = HfApi(token=hf_token)
-
         try:
-            repo_files = api.list_repo_files(
-                repo_id=repo_id, repo_type="dataset", token=hf_token
-            )
-            return repo_files
+            return self.get_file_index(repo_id).paths()
         except Exception as e:
             self.log(
                 f"Failed to get the list of files from Hugging Face repo {repo_id}: {e}",
@@ -474,47 +2056,93 @@ class Distributaur:
             )
             return []
 
-    def search_offers(self, max_price: float) -> List[Dict]:
+    def get_vast_session(self) -> "requests.Session":
+        """
+        Get the HTTP session shared by all Vast.ai API requests, creating it on first use. Reusing it keeps
+        connections to the API open between requests, including requests made from several threads.
+        Requests time out and are retried as configured by HTTP_TIMEOUT, HTTP_RETRIES and HTTP_BACKOFF.
+
+        Returns:
+            requests.Session: The session, with the Vast.ai API key set in its headers.
+        """
+        if self.vast_session is None:
+            self.vast_session = self.get_http_client().new_session(
+                headers={"Authorization": f"Bearer {self.get_env('VAST_API_KEY')}"}
+            )
+        return self.vast_session
+
+    def search_offers(self, max_price: float, query: dict = None) -> List[Dict]:
         """
         Search for available offers to rent a node as an instance on the Vast.ai platform.
 
         Args:
             max_price (float): The maximum price per hour for the instance.
+            query (dict): Conditions added to or replacing the default search query, in the Vast.ai search
+                syntax, e.g. {"gpu_ram": {"gte": 16}}. Defaults to None.
 
         Returns:
-            List[Dict]: A list of dictionaries representing the available offers.
+            List[Dict]: A list of dictionaries representing the available offers. Use rank_offers to order
+            them by expected throughput per dollar.
 
         Raises:
             requests.exceptions.RequestException: If there is an error while making the API request.
         """
-        api_key = self.get_env("VAST_API_KEY")
-        base_url = "https://console.vast.ai/api/v0/bundles/"
+        base_url = f"{self.settings['VAST_API_URL']}/bundles/"
         headers = {
             "Accept": "application/json",
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
         }
-        url = (
-            base_url
-            + '?q={"gpu_ram":">=4","rentable":{"eq":true},"dph_total":{"lte":'
-            + str(max_price)
-            + '},"sort_option":{"0":["dph_total","asc"],"1":["total_flops","asc"]}}'
-        )
+        search_query = {
+            "gpu_ram": ">=4",
+            "rentable": {"eq": True},
+            "dph_total": {"lte": max_price},
+            "sort_option": {"0": ["dph_total", "asc"], "1": ["total_flops", "desc"]},
+        }
+        search_query.update(query or {})
+        url = base_url + "?q=" + json.dumps(search_query, separators=(",", ":"))
+
+        from requests.exceptions import RequestException
 
+        response = None
         try:
-            response = requests.get(url, headers=headers)
+            response = self.get_vast_session().get(
+                url, headers=headers
+            )
             response.raise_for_status()
             json_response = response.json()
             return json_response["offers"]
 
-        except requests.exceptions.RequestException as e:
+        except RequestException as e:
             self.log(
-                f"Error: {e}\nResponse: {response.text if response else 'No response'}"
+                f"Error: {e}\nResponse: {response.text if response is not None else 'No response'}"
             )
             raise
 
+    def rank_offers(self, offers: List[Dict], scorer: OfferScorer = None) -> List[Dict]:
+        """
+        Order offers by expected task throughput per dollar, best first, using the task durations measured
+        on each machine by earlier workers.
+
+        Args:
+            offers (List[Dict]): Offers returned by search_offers.
+            scorer (OfferScorer): Scorer to rank with, e.g. with filters. Defaults to an OfferScorer using the
+                measured machine durations.
+
+        Returns:
+            List[Dict]: The offers that pass the scorer's filters, best first, each with its "score".
+        """
+        if scorer is None:
+            scorer = OfferScorer(machine_durations=self.get_machine_durations())
+        return scorer.rank(offers)
+
     def create_instance(
-        self, offer_id: str, image: str, module_name: str, command: str = None
+        self,
+        offer_id: str,
+        image: str,
+        module_name: str,
+        command: str = None,
+        machine_id: str = None,
+        queues: List[str] = None,
     ) -> Dict:
         """
         Create an instance on the Vast.ai platform.
@@ -523,7 +2151,12 @@ class Distributaur:
             offer_id (str): The ID of the offer to create the instance from.
             image (str): The image to use for the instance. (example: RaccoonResearch/distributaur-test-worker)
             module_name (str): The name of the module to run on the instance, configured to be a docker file (example: distributaur.example.worker)
-            command (str): command that initializes celery worker. Has default command if not passed in.
+            command (str): command that initializes celery worker. Defaults to a worker started with the
+                settings of the worker profile.
+            machine_id (str): Vast.ai machine ID of the offer, passed to the worker as VAST_MACHINE_ID so task
+                durations are recorded per machine. Defaults to None.
+            queues (List[str]): Queues the worker of the default command consumes from, in order of
+                precedence. Defaults to None (the default queue).
 
         Returns:
             Dict: A dictionary representing the created instance.
@@ -537,19 +2170,23 @@ class Distributaur:
             raise ValueError("VAST_API_KEY is not set in the environment")
 
         if command is None:
-            command = f"celery -A {module_name} worker --loglevel=info --concurrency=1"
+            command = worker_command(module_name, self.worker_profile, queues)
+
+        # settings are serialized explicitly so workers parse them back to the same values
+        env = {key: to_env_value(value) for key, value in self.settings.items() if value is not None}
+        if machine_id is not None:
+            env["VAST_MACHINE_ID"] = str(machine_id)
 
         json_blob = {
             "client_id": "me",
             "image": image,
-            "env": self.settings,
+            "env": env,
             "disk": 32,  # Set a non-zero value for disk
             "onstart": f"export PATH=$PATH:/ && cd ../ && {command}",
             "runtype": "ssh ssh_proxy",
         }
-        url = f"https://console.vast.ai/api/v0/asks/{offer_id}/?api_key={self.get_env('VAST_API_KEY')}"
-        headers = {"Authorization": f"Bearer {self.get_env('VAST_API_KEY')}"}
-        response = requests.put(url, headers=headers, json=json_blob)
+        url = f"{self.settings['VAST_API_URL']}/asks/{offer_id}/?api_key={self.get_env('VAST_API_KEY')}"
+        response = self.get_vast_session().put(url, json=json_blob)
 
         if response.status_code != 200:
             self.log(f"Failed to create instance: {response.text}", "error")
@@ -568,11 +2205,18 @@ class Distributaur:
             Dict: A dictionary representing the result of the destroy operation.
         """
         api_key = self.get_env("VAST_API_KEY")
-        headers = {"Authorization": f"Bearer {api_key}"}
-        url = (
-            f"https://console.vast.ai/api/v0/instances/{instance_id}/?api_key={api_key}"
-        )
-        response = requests.delete(url, headers=headers)
+        url = f"{self.settings['VAST_API_URL']}/instances/{instance_id}/?api_key={api_key}"
+        response = self.get_vast_session().delete(url)
+        response.raise_for_status()
+        self.rented_instances.discard(instance_id)
+        # the instance is gone, so a Redis error while forgetting it must not report the destroy as failed
+        try:
+            pipeline = self.get_redis_connection().pipeline(transaction=False)
+            pipeline.srem("nodes", str(instance_id))
+            pipeline.delete(f"node_tasks:{instance_id}")
+            pipeline.execute()
+        except Exception as e:
+            self.log(f"Failed to remove destroyed instance {instance_id} from Redis: {e}", "warn")
         return response.json()
 
     def rent_nodes(
@@ -582,109 +2226,259 @@ class Distributaur:
         image: str,
         module_name: str,
         command: str = None,
+        max_workers: int = 16,
+        scorer: OfferScorer = None,
+        queues: List[str] = None,
     ) -> List[Dict]:
         """
-        Rent nodes as an instance on the Vast.ai platform. 
+        Rent nodes as an instance on the Vast.ai platform. Offers are rented concurrently, highest expected
+        throughput per dollar first (see rank_offers); offers that fail are skipped and replaced by the next ones. Rented instances that were not terminated
+        are destroyed on exit.
 
         Args:
             max_price (float): The maximum price per hour for the nodes.
             max_nodes (int): The maximum number of nodes to rent.
             image (str): The image to use for the nodes.
             module_name (str): The name of the module to run on the nodes.
+            command (str): command that initializes celery worker. Has default command if not passed in.
+            max_workers (int): Maximum number of instances created at the same time. Defaults to 16.
+            scorer (OfferScorer): Scorer that filters and ranks the offers. Defaults to the scorer of
+                rank_offers.
+            queues (List[str]): Queues the workers of the default command consume from, in order of
+                precedence, e.g. to dedicate nodes to latency-sensitive tasks. Defaults to None (the default
+                queue).
 
         Returns:
-            List[Dict]: A list of dictionaries representing the rented nodes. If error is encountered
-            trying to rent, it will retry every 5 seconds.
+            List[Dict]: A list of dictionaries representing the rented nodes. If searching for offers fails,
+            it will retry every 5 seconds.
         """
         rented_nodes: List[Dict] = []
-        while len(rented_nodes) < max_nodes:
-            search_retries = 10
-            while search_retries > 0:
-                try:
-                    offers = self.search_offers(max_price)
+        tried_offers = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while len(rented_nodes) < max_nodes:
+                offers = None
+                search_retries = 10
+                while search_retries > 0:
+                    try:
+                        offers = self.search_offers(max_price)
+                        break
+                    except Exception as e:
+                        self.log(
+                            f"Error searching for offers: {str(e)} - retrying in 5 seconds...",
+                            "error",
+                        )
+                        search_retries -= 1
+                        # sleep for 5 seconds before retrying
+                        time.sleep(5)
+                        continue
+                if offers is None:
+                    self.log("Could not search for offers - stopping node rental", "error")
                     break
-                except Exception as e:
-                    self.log(
-                        f"Error searching for offers: {str(e)} - retrying in 5 seconds...",
-                        "error",
-                    )
-                    search_retries -= 1
-                    # sleep for 5 seconds before retrying
-                    time.sleep(5)
-                    continue
 
-            offers = sorted(
-                offers, key=lambda offer: offer["dph_total"]
-            )  # Sort offers by price, lowest to highest
-            for offer in offers:
-                if len(rented_nodes) >= max_nodes:
+                offers = self.rank_offers(
+                    [offer for offer in offers if offer["id"] not in tried_offers], scorer
+                )
+                offers = offers[: max_nodes - len(rented_nodes)]
+                if not offers:
+                    # all offers have been tried
+                    self.log("No more offers available - stopping node rental", "warning")
                     break
-                try:
-                    instance = self.create_instance(
-                        offer["id"], image, module_name, command
+
+                futures = [
+                    executor.submit(
+                        self.create_instance,
+                        offer["id"],
+                        image,
+                        module_name,
+                        command,
+                        offer.get("machine_id"),
+                        queues,
                     )
-                    atexit.register(self.destroy_instance, instance["new_contract"])
+                    for offer in offers
+                ]
+                for offer, future in zip(offers, futures):
+                    tried_offers.add(offer["id"])
+                    try:
+                        instance = future.result()
+                    except Exception as e:
+                        self.log(
+                            f"Error renting node from offer {offer['id']}: {str(e)} - trying other offers",
+                            "error",
+                        )
+                        continue
+                    self.rented_instances.add(instance["new_contract"])
                     rented_nodes.append(
                         {
                             "offer_id": offer["id"],
                             "instance_id": instance["new_contract"],
                         }
                     )
+
+        self.log(f"Rented {len(rented_nodes)} of {max_nodes} nodes")
+        return rented_nodes
+
+    def terminate_nodes(self, nodes: List[Dict], max_workers: int = 16) -> Dict[str, List]:
+        """
+        Terminate the instances of rented nodes on Vast.ai concurrently.
+
+        Args:
+            nodes (List[Dict]): A list of dictionaries representing the rented nodes.
+            max_workers (int): Maximum number of instances destroyed at the same time. Defaults to 16.
+
+        Returns:
+            Dict[str, List]: "terminated" and "failed" lists of instance IDs. Errors are logged, not raised.
+        """
+        instance_ids = [node["instance_id"] for node in nodes]
+        result = {"terminated": [], "failed": []}
+        if not instance_ids:
+            return result
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(instance_ids))) as executor:
+            futures = [
+                executor.submit(self.destroy_instance, instance_id)
+                for instance_id in instance_ids
+            ]
+            for instance_id, future in zip(instance_ids, futures):
+                try:
+                    future.result()
+                    result["terminated"].append(instance_id)
                 except Exception as e:
                     self.log(
-                        f"Error renting node: {str(e)} - searching for new offers",
-                        "error",
+                        f"Error terminating node: {instance_id}, {str(e)}", "error"
                     )
-                    break  # Break out of the current offer iteration
-            else:
-                # If the loop completes without breaking, all offers have been tried
-                self.log("No more offers available - stopping node rental", "warning")
-                break
-        return rented_nodes
+                    result["failed"].append(instance_id)
+        return result
 
-    def terminate_nodes(self, nodes: List[Dict]) -> None:
+    def create_autoscaler(
+        self,
+        image: str,
+        module_name: str,
+        max_price: float,
+        max_nodes: int,
+        target_seconds: float,
+        **kwargs,
+    ) -> Autoscaler:
         """
-        Terminate the instances of rented nodes on Vast.ai.
+        Create an autoscaler that rents and drains Vast.ai nodes to finish the queued tasks within
+        target_seconds. Call its run method, e.g. in a thread, or its step method from your own loop.
 
         Args:
-            nodes (List[Dict]): A list of dictionaries representing the rented nodes.
+            image (str): The image to use for the nodes.
+            module_name (str): The name of the module to run on the nodes.
+            max_price (float): The maximum price per hour of a node.
+            max_nodes (int): The maximum number of nodes rented at the same time.
+            target_seconds (float): Seconds from now by which the queued tasks should be done.
+            kwargs: Further options of Autoscaler, e.g. min_nodes, worker_concurrency or interval.
 
-        Raises:
-            Exception: If error in destroying instances.
+        Returns:
+            Autoscaler: The autoscaler.
         """
-        for node in nodes:
-            try:
-                self.destroy_instance(node["instance_id"])
-            except Exception as e:
-                self.log(
-                    f"Error terminating node: {node['instance_id']}, {str(e)}", "error"
-                )
+        return Autoscaler(
+            self, image, module_name, max_price, max_nodes, target_seconds, **kwargs
+        )
+
+    def _destroy_rented_instances(self) -> None:
+        """
+        Destroy every instance rented by rent_nodes that was not terminated, called on exit.
+        """
+        if self.rented_instances:
+            self.terminate_nodes(
+                [{"instance_id": instance_id} for instance_id in list(self.rented_instances)]
+            )
 
-    def monitor_tasks(self, tasks, update_interval = 1, show_time_left=True, print_statements=True):
+    def monitor_tasks(
+        self,
+        tasks,
+        update_interval=1,
+        show_time_left=True,
+        print_statements=True,
+        use_events=True,
+        speculative=None,
+        speculative_factor=2.0,
+    ):
         """
         Monitor the status of the tasks on the Vast.ai nodes.
 
         Args:
             tasks (List): A list of the tasks to monitor. Should be a list of the results of execute_function.
+                Results of execute_batch are counted per item. Tasks sent with ignore_result are followed
+                through the status hash of their job, as they store no state in the result backend.
             update_interval (bool): Number of seconds the status of tasks are updated.
             show_time_left (bool): Show the estimated time left to complete tasks using the tqdm progress bar
             print_statments (bool): Allow printing of status of task queue
-            
+            use_events (bool): Follow task completions through Redis pub/sub instead of polling the status
+                of every outstanding task each update. Falls back to polling if the subscription fails.
+            speculative (bool): Submit a second copy of tasks that run longer than speculative_factor times the
+                95th percentile of recent task durations, keep whichever copy finishes first and revoke the
+                other. Requires SPECULATIVE_EXECUTION on the workers. Tasks of execute_batch and tasks sent with
+                ignore_result are never copied. Defaults to the SPECULATIVE_EXECUTION setting.
+            speculative_factor (float): How many times the 95th percentile duration a task may run before it is
+                copied. Defaults to 2.
+
         Raises:
             Exception: If error in the process of executing the tasks
         """
+        from tqdm import tqdm
+
+        item_counts = {}
+        ignored = {}
+        for task in tasks:
+            item_counts[task.id] = getattr(task, "item_count", 1)
+            if getattr(task, "ignored", False):
+                ignored[task.id] = getattr(task, "job_id", None)
+        total = sum(item_counts.values())
+        items_done = {}
+        finished_tasks = set()
+        completed = 0
+        if speculative is None:
+            speculative = self.settings.get("SPECULATIVE_EXECUTION")
+        # running tasks, mapped to the time they were seen starting and their encoded arguments
+        running = {}
+        speculated = set()
 
         try:
             first_task_done = False
             # Wait for the tasks to complete
             if print_statements:
                 print("Tasks submitted to queue. Initializing queue...")
-            with tqdm(total=len(tasks), unit="task") as pbar:
-                while not all(task.ready() for task in tasks):
-                    current_tasks = sum([task.ready() for task in tasks])
-                    pbar.update(current_tasks - pbar.n)
-
-                    if current_tasks > 0:
+            with tqdm(total=total, unit="task") as pbar:
+                for updates in self._watch_tasks(
+                    list(item_counts), update_interval, use_events, ignored
+                ):
+                    for task_id, meta in updates:
+                        if meta["status"] in states.READY_STATES:
+                            finished_tasks.add(task_id)
+                            running.pop(task_id, None)
+                            if task_id in speculated and meta["status"] == states.SUCCESS:
+                                # the first copy to succeed wins; the backend ignores later states of a
+                                # successful task, so the revoked copy cannot overwrite the result.
+                                # The broadcast gets its own connection, as it also takes a producer from
+                                # the broker pool and could wait forever once the pool is exhausted
+                                with self.app.connection_for_write() as connection:
+                                    self.app.control.revoke(
+                                        task_id, terminate=True, connection=connection
+                                    )
+                            done = item_counts[task_id]
+                        elif meta["status"] == "PROGRESS":
+                            done = meta["result"]["done"]
+                        else:
+                            if (
+                                speculative
+                                and meta["status"] == states.STARTED
+                                and task_id not in running
+                                and isinstance(meta.get("result"), dict)
+                                and "message" in meta["result"]
+                            ):
+                                running[task_id] = (time.time(), meta["result"])
+                            continue
+                        completed += done - items_done.get(task_id, 0)
+                        items_done[task_id] = done
+                    pbar.update(completed - pbar.n)
+
+                    if speculative and running:
+                        self._speculate(running, speculated, speculative_factor)
+
+                    if completed > 0:
                         # begin estimation from time of first task
                         if not first_task_done:
                             first_task_done = True
@@ -695,8 +2489,8 @@ class Distributaur:
                         # calculate and print total elapsed time and estimated time left
                         end_time = time.time()
                         elapsed_time = end_time - first_task_start_time
-                        time_per_tasks = elapsed_time / current_tasks
-                        time_left = time_per_tasks * (len(tasks) - current_tasks)
+                        time_per_tasks = elapsed_time / completed
+                        time_left = time_per_tasks * (total - completed)
 
                         if show_time_left:
                             pbar.set_postfix(
@@ -705,17 +2499,278 @@ class Distributaur:
                         else:
                             pbar.set_postfix(
                                 elapsed=f"{elapsed_time:.2f}s"
-                            )                        
-
-                    time.sleep(update_interval)
+                            )
         except Exception as e:
             self.log(
                 f"Error in executing tasks on nodes, {str(e)}"
             )
-            
-        if all(task.ready() for task in tasks):
+
+        if len(finished_tasks) == len(item_counts):
             print("All tasks completed.")
 
+    def as_completed(
+        self,
+        tasks: Iterable,
+        timeout: float = None,
+        propagate: bool = True,
+        update_interval: float = 1,
+        use_events: bool = True,
+    ):
+        """
+        Yield tasks with their results in the order they complete, so results can be processed while the
+        other tasks are still running. Completions are followed through one Redis pub/sub subscription for
+        all tasks, as in monitor_tasks, rather than by waiting on each task in turn. Tasks sent with
+        ignore_result are yielded with a None result once their job's status hash records them as finished;
+        a failed one raises, or yields, a RuntimeError as its exception was not stored.
+
+        Args:
+            tasks (Iterable): The tasks, e.g. results of execute_function or a TaskBatch.
+            timeout (float): Seconds to wait for all tasks to complete. Defaults to None (no limit).
+            propagate (bool): Raise the exception of a failed or revoked task. If False, the exception is
+                yielded as the task's result instead. Defaults to True.
+            update_interval (float): Maximum seconds between checks of the timeout. Defaults to 1.
+            use_events (bool): Follow task completions through Redis pub/sub instead of polling.
+
+        Yields:
+            Tuple[celery.result.AsyncResult, any]: Each task and its result, in completion order.
+
+        Raises:
+            celery.exceptions.TimeoutError: If the tasks did not all complete within timeout seconds.
+            Exception: The exception of a failed task, if propagate is True.
+        """
+        tasks_by_id = {task.id: task for task in tasks}
+        ignored = {
+            task.id: getattr(task, "job_id", None)
+            for task in tasks_by_id.values()
+            if getattr(task, "ignored", False)
+        }
+        deadline = time.time() + timeout if timeout is not None else None
+        completed = set()
+        for updates in self._watch_tasks(list(tasks_by_id), update_interval, use_events, ignored):
+            for task_id, meta in updates:
+                if meta["status"] not in states.READY_STATES or task_id in completed:
+                    continue
+                completed.add(task_id)
+                result = meta["result"]
+                if propagate and meta["status"] in states.PROPAGATE_STATES:
+                    raise result
+                yield tasks_by_id[task_id], self.resolve_result(result)
+            if deadline is not None and time.time() > deadline and len(completed) < len(tasks_by_id):
+                raise CeleryTimeoutError(
+                    f"{len(tasks_by_id) - len(completed)} tasks did not complete within {timeout}s"
+                )
+
+    def get_task_duration_percentile(self, percentile: float = 95, min_samples: int = 20) -> float:
+        """
+        Get a percentile of the durations of the recently executed function calls.
+
+        Args:
+            percentile (float): The percentile, between 0 and 100. Defaults to 95.
+            min_samples (int): Minimum number of recorded durations. Defaults to 20.
+
+        Returns:
+            float: The duration in seconds, or None if fewer than min_samples durations were recorded.
+        """
+        durations = self.get_redis_connection().lrange("task_durations", 0, 999)
+        if len(durations) < min_samples:
+            return None
+        durations = sorted(float(duration) for duration in durations)
+        index = min(len(durations) - 1, int(len(durations) * percentile / 100))
+        return durations[index]
+
+    def _speculate(self, running: dict, speculated: set, factor: float) -> None:
+        """
+        Submit a copy of every running task that has run longer than factor times the 95th percentile task
+        duration, with the queue, priority, job and affinity key of the original. The copy has the same task
+        ID, so the caller's AsyncResult resolves with whichever copy succeeds first.
+        """
+        p95 = self.get_task_duration_percentile(95)
+        if p95 is None:
+            return
+        now = time.time()
+        for task_id, (started, message) in running.items():
+            if task_id in speculated or now - started < factor * p95:
+                continue
+            func_name, args = loads(
+                base64.b64decode(message["message"]),
+                message["content_type"],
+                message["content_encoding"],
+                accept=prepare_accept_content(self.app.conf.accept_content),
+            )
+            options = message.get("options") or {"headers": {"job_id": DEFAULT_JOB_ID}}
+            self.call_function_task.apply_async((func_name, args), task_id=task_id, **options)
+            speculated.add(task_id)
+            self.log(
+                f"Task {task_id} has run for {now - started:.0f}s, over {factor} x p95 ({p95:.1f}s); "
+                "submitted a speculative copy"
+            )
+
+    def _watch_tasks(
+        self,
+        task_ids: List[str],
+        update_interval: float = 1,
+        use_events: bool = True,
+        ignored: Dict[str, str] = None,
+    ):
+        """
+        Follow a set of tasks until all of them reach a ready state (success, failure or revoked).
+
+        Yields lists of (task_id, meta) tuples with the stored state of tasks that changed since the previous
+        yield; a list may be empty. With use_events, states are read from the messages the Celery Redis
+        backend publishes when it stores a task state, so each update only does work for the tasks that
+        changed, and a list is yielded as soon as a task completes, or after update_interval seconds
+        otherwise. Without events, or if the subscription fails, the outstanding tasks are polled with
+        batched MGET calls once per update_interval. Tasks sent with ignore_result never store a ready
+        state, so the status hash of their jobs is polled for them once per update_interval.
+
+        Args:
+            task_ids (List[str]): IDs of the tasks to follow.
+            update_interval (float): Maximum number of seconds between yields.
+            use_events (bool): Subscribe to task state events instead of polling.
+            ignored (Dict[str, str]): IDs of the tasks sent with ignore_result, mapped to their job IDs.
+                Defaults to None.
+
+        Yields:
+            List[Tuple[str, dict]]: Task ID and result metadata of the updated tasks.
+        """
+        if self.executor is not None:
+            yield from self.executor.watch(task_ids, update_interval)
+            return
+
+        pending = set(task_ids)
+        ignored = {task_id: job_id for task_id, job_id in (ignored or {}).items() if task_id in pending}
+        pubsub = None
+        if use_events:
+            try:
+                pubsub = self._subscribe_task_events()
+            except Exception as e:
+                self.log(f"Could not subscribe to task events, polling instead: {e}", "warning")
+
+        try:
+            # tasks that finished before the subscription was made never produce an event
+            updates = self._get_task_states(pending) + self._get_ignored_states(ignored)
+            next_poll = time.time() + update_interval
+            while True:
+                for task_id, meta in updates:
+                    if meta["status"] in states.READY_STATES:
+                        pending.discard(task_id)
+                        ignored.pop(task_id, None)
+                yield updates
+                if not pending:
+                    break
+
+                if pubsub is not None:
+                    try:
+                        updates = self._read_task_events(pubsub, pending, next_poll - time.time())
+                    except Exception as e:
+                        self.log(f"Lost task event subscription, polling instead: {e}", "warning")
+                        pubsub.close()
+                        pubsub = None
+                    else:
+                        # completions are yielded right away, the polls below only once per update_interval
+                        if time.time() < next_poll:
+                            continue
+                        updates += self._get_ignored_states(ignored)
+                else:
+                    time.sleep(update_interval)
+                    updates = self._get_task_states(pending) + self._get_ignored_states(ignored)
+                next_poll = time.time() + update_interval
+                if self.affinity.routed:
+                    # tasks that waited too long for the worker holding their affinity key go to any worker
+                    try:
+                        self.affinity.rebalance()
+                    except Exception as e:
+                        self.log(f"Could not move tasks out of affinity queues: {e}", "warning")
+        finally:
+            # also reached when the caller stops iterating early
+            if pubsub is not None:
+                pubsub.close()
+
+    def _subscribe_task_events(self):
+        """
+        Subscribe to the channels the Celery Redis backend publishes task states on.
+
+        Returns:
+            redis.client.PubSub: The subscribed PubSub object.
+        """
+        prefix = self.app.backend.task_keyprefix.decode()
+        pubsub = self.get_redis_connection().pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(f"{prefix}*")
+        return pubsub
+
+    def _read_task_events(self, pubsub, pending: set, timeout: float) -> list:
+        """
+        Read task state events until a pending task reaches a ready state, or for up to timeout seconds.
+        Events already received when a task completes are read too, so a burst of completions is returned
+        at once.
+
+        Returns:
+            list: (task_id, meta) tuples for the pending tasks whose state was stored.
+        """
+        backend = self.app.backend
+        prefix_length = len(backend.task_keyprefix)
+        updates = []
+        completed = False
+        deadline = time.time() + timeout
+        while True:
+            remaining = 0 if completed else max(deadline - time.time(), 0)
+            message = pubsub.get_message(timeout=remaining)
+            if message is None:
+                if completed or remaining <= 0:
+                    break
+                continue
+            task_id = message["channel"][prefix_length:].decode()
+            if task_id in pending:
+                meta = backend.decode_result(message["data"])
+                updates.append((task_id, meta))
+                completed = completed or meta["status"] in states.READY_STATES
+        return updates
+
+    def _get_ignored_states(self, ignored: Dict[str, str]) -> list:
+        """
+        Read whether tasks sent with ignore_result finished from the status hashes of their jobs, with
+        batched HMGET calls.
+
+        Args:
+            ignored (Dict[str, str]): IDs of the tasks, mapped to their job IDs.
+
+        Returns:
+            list: (task_id, meta) tuples for the tasks that finished, with a None result for successful
+            tasks and a RuntimeError for failed ones.
+        """
+        task_ids_by_job = {}
+        for task_id, job_id in ignored.items():
+            task_ids_by_job.setdefault(job_id, []).append(task_id)
+        updates = []
+        for job_id, task_ids in task_ids_by_job.items():
+            for task_id, status in zip(task_ids, self.get_task_statuses(task_ids, job_id)):
+                if status == "success":
+                    updates.append((task_id, {"status": states.SUCCESS, "result": None}))
+                elif status == "failure":
+                    error = RuntimeError(
+                        f"Task {task_id} failed; its exception was not stored as it ignores its result"
+                    )
+                    updates.append((task_id, {"status": states.FAILURE, "result": error}))
+        return updates
+
+    def _get_task_states(self, task_ids: Iterable[str], chunk_size: int = 1000) -> list:
+        """
+        Read the stored state of many tasks from the result backend with batched MGET calls.
+
+        Returns:
+            list: (task_id, meta) tuples for the tasks that have a stored state.
+        """
+        backend = self.app.backend
+        redis_client = self.get_redis_connection()
+        iterator = iter(task_ids)
+        updates = []
+        while chunk := list(itertools.islice(iterator, chunk_size)):
+            values = redis_client.mget([backend.get_key_for_task(t) for t in chunk])
+            for task_id, value in zip(chunk, values):
+                if value is not None:
+                    updates.append((task_id, backend.decode_result(value)))
+        return updates
+
 
 
 distributaur = None
@@ -738,24 +2793,34 @@ def create_from_config(config_path="config.json", env_path=".env") -> Distributa
     if distributaur is not None:
         return distributaur
     # Load environment variables from .env file
-    try:
+    if os.path.exists(env_path):
+        from dotenv import load_dotenv
+
         load_dotenv(env_path)
-    except:
+    else:
         print("No .env file found. Using system environment variables only.")
 
-    # Load configuration from JSON file
-    try:
-        settings = OmegaConf.load(config_path)
-        if not all(settings.values()):
-            print(f"Configuration file is missing necessary values.")
-    except:
+    env_dict = {key: value for key, value in os.environ.items()}
+    # Load configuration from JSON file. Without one, OmegaConf is not imported and the settings are the
+    # environment variables.
+    if not os.path.exists(config_path):
         print(
             "Configuration file not found. Falling back to system environment variables."
         )
-        settings = {}
+        settings = env_dict
+    else:
+        from omegaconf import OmegaConf
 
-    env_dict = {key: value for key, value in os.environ.items()}
-    settings = OmegaConf.merge(settings, OmegaConf.create(env_dict))
+        try:
+            settings = OmegaConf.load(config_path)
+            if not all(settings.values()):
+                print(f"Configuration file is missing necessary values.")
+        except:
+            print(
+                f"Configuration file {config_path} could not be read. Falling back to system environment variables."
+            )
+            settings = {}
+        settings = OmegaConf.merge(settings, OmegaConf.create(env_dict))
 
     distributaur = Distributaur(
         hf_repo_id=settings.get("HF_REPO_ID"),
@@ -765,7 +2830,33 @@ def create_from_config(config_path="config.json", env_path=".env") -> Distributa
         redis_password=settings.get("REDIS_PASSWORD"),
         redis_port=settings.get("REDIS_PORT"),
         redis_username=settings.get("REDIS_USER"),
-        broker_pool_limit=int(settings.get("BROKER_POOL_LIMIT", 1)),
+        broker_pool_limit=int(settings.get("BROKER_POOL_LIMIT", 10)),
+        task_serializer=settings.get("TASK_SERIALIZER", "json"),
+        blob_threshold=int(settings.get("BLOB_THRESHOLD", 1048576)),
+        blob_store=settings.get("BLOB_STORE", "redis"),
+        blob_cache_dir=settings.get("BLOB_CACHE_DIR", ""),
+        blob_cache_size=settings.get("BLOB_CACHE_SIZE", DEFAULT_BLOB_CACHE_SIZE),
+        hf_upload_async=settings.get("HF_UPLOAD_ASYNC", False),
+        file_index_ttl=int(settings.get("FILE_INDEX_TTL", 300)),
+        file_index_shared=settings.get("FILE_INDEX_SHARED", False),
+        vast_api_url=settings.get("VAST_API_URL", "https://console.vast.ai/api/v0"),
+        http_timeout=float(settings.get("HTTP_TIMEOUT", 30)),
+        http_retries=int(settings.get("HTTP_RETRIES", 3)),
+        http_backoff=float(settings.get("HTTP_BACKOFF", 0.5)),
+        speculative_execution=settings.get("SPECULATIVE_EXECUTION", False),
+        status_ttl=settings.get("STATUS_TTL", 604800),
+        result_threshold=settings.get("RESULT_THRESHOLD", 65536),
+        result_expires=settings.get("RESULT_EXPIRES", 86400),
+        ignore_result=settings.get("IGNORE_RESULT", False),
+        worker_profile=settings.get("WORKER_PROFILE", "long-gpu"),
+        worker_concurrency=settings.get("WORKER_CONCURRENCY", 0),
+        executor=settings.get("EXECUTOR", "celery"),
+        local_workers=settings.get("LOCAL_WORKERS", 0),
+        redis_pool_size=settings.get("REDIS_POOL_SIZE", 0),
+        redis_pool_timeout=settings.get("REDIS_POOL_TIMEOUT", 20),
+        redis_health_check_interval=settings.get("REDIS_HEALTH_CHECK_INTERVAL", 30),
+        worker_cache_size=settings.get("WORKER_CACHE_SIZE", DEFAULT_CACHE_SIZE),
+        affinity_timeout=settings.get("AFFINITY_TIMEOUT", 60),
     )
 
     return distributaur
@@ -45,6 +45,11 @@ if __name__ == "__main__":
 
     repo_id = distributaur.get_env("HF_REPO_ID")
 
+    # check which output files already exist in the dataset, with one listing of the repository
+    existing_outputs = distributaur.files_exist(
+        repo_id, [output for job_config in job_configs for output in job_config["outputs"]]
+    )
+
     # Submit the tasks
     # For each task, check if the output files already exist
     for i in range(number_of_tasks):
@@ -55,11 +60,8 @@ if __name__ == "__main__":
 
         # for each file in job_config["outputs"]
         for output in job_config["outputs"]:
-            # check if the file exists in the dataset already
-            file_exists = distributaur.file_exists(repo_id, output)
-
             # if the file exists, ask the user if they want to overwrite it
-            if file_exists:
+            if existing_outputs[output]:
                 print("Files already exist. Do you want to overwrite them? (y/n): ")
 
         print("Submitting tasks...")
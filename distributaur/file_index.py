@@ -0,0 +1,150 @@
+import threading
+import time
+from typing import Callable, Iterable, List
+
+from redis import Redis
+
+
+__all__ = ["RepoFileIndex"]
+
+
+class RepoFileIndex:
+    """
+    Cached index of the files in a Hugging Face repository, so existence checks do not list the whole
+    repository every time. The index is loaded with one listing, kept for ttl seconds, and updated in place
+    when files are uploaded or deleted through Distributaur. With a Redis client the index is stored in
+    Redis and shared by every driver and worker using the same repository.
+    """
+
+    def __init__(
+        self,
+        list_files: Callable[[], List[str]],
+        ttl: float = 300,
+        redis_client: Redis = None,
+        key: str = None,
+    ) -> None:
+        """
+        Args:
+            list_files (Callable[[], List[str]]): Function returning every file path in the repository.
+            ttl (float): Seconds the index is used before the repository is listed again. 0 disables caching.
+                Defaults to 300.
+            redis_client (Redis): Redis connection to share the index through. Defaults to None (in memory).
+            key (str): Redis key of the index, required with redis_client.
+        """
+        self.list_files = list_files
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.key = key
+        self._files = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def contains(self, paths: Iterable[str]) -> List[bool]:
+        """
+        Check which paths exist in the repository, loading the index first if it is missing or expired.
+
+        Args:
+            paths (Iterable[str]): Paths of the files within the repository.
+
+        Returns:
+            List[bool]: For each path, whether it exists in the repository.
+        """
+        paths = list(paths)
+        if self.redis_client is not None:
+            if not self.redis_client.exists(f"{self.key}:loaded"):
+                self.refresh()
+            if not paths:
+                return []
+            return [bool(found) for found in self.redis_client.smismember(self.key, paths)]
+
+        files = self._get_files()
+        return [path in files for path in paths]
+
+    def paths(self) -> List[str]:
+        """
+        Return every file path in the repository, loading the index first if it is missing or expired.
+
+        Returns:
+            List[str]: The file paths in the repository.
+        """
+        if self.redis_client is not None:
+            if not self.redis_client.exists(f"{self.key}:loaded"):
+                self.refresh()
+            return [path.decode() for path in self.redis_client.smembers(self.key)]
+        return list(self._get_files())
+
+    def refresh(self) -> set:
+        """
+        List the repository and replace the index with the result.
+
+        Returns:
+            set: The file paths in the repository.
+        """
+        files = set(self.list_files())
+        if self.redis_client is not None:
+            pipeline = self.redis_client.pipeline()
+            pipeline.delete(self.key)
+            files_list = list(files)
+            for start in range(0, len(files_list), 10000):
+                pipeline.sadd(self.key, *files_list[start : start + 10000])
+            if self.ttl:
+                pipeline.expire(self.key, int(self.ttl))
+                pipeline.set(f"{self.key}:loaded", 1, ex=int(self.ttl))
+            pipeline.execute()
+            return files
+
+        with self._lock:
+            self._files = files
+            self._loaded_at = time.time()
+        return files
+
+    def add(self, paths: Iterable[str]) -> None:
+        """
+        Record files that were uploaded to the repository. Does nothing if the index is not loaded.
+
+        Args:
+            paths (Iterable[str]): Paths of the uploaded files within the repository.
+        """
+        paths = list(paths)
+        if not paths:
+            return
+        if self.redis_client is not None:
+            # only add to a loaded index, a partial index would hide files that were never listed
+            if self.redis_client.exists(f"{self.key}:loaded"):
+                self.redis_client.sadd(self.key, *paths)
+            return
+        with self._lock:
+            if self._files is not None:
+                self._files.update(paths)
+
+    def discard(self, paths: Iterable[str]) -> None:
+        """
+        Record files that were deleted from the repository.
+
+        Args:
+            paths (Iterable[str]): Paths of the deleted files within the repository.
+        """
+        paths = list(paths)
+        if not paths:
+            return
+        if self.redis_client is not None:
+            self.redis_client.srem(self.key, *paths)
+            return
+        with self._lock:
+            if self._files is not None:
+                self._files.difference_update(paths)
+
+    def invalidate(self) -> None:
+        """
+        Drop the index, so the next lookup lists the repository again.
+        """
+        if self.redis_client is not None:
+            self.redis_client.delete(self.key, f"{self.key}:loaded")
+        with self._lock:
+            self._files = None
+
+    def _get_files(self) -> set:
+        with self._lock:
+            if self._files is not None and time.time() - self._loaded_at < self.ttl:
+                return self._files
+        return self.refresh()
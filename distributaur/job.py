@@ -0,0 +1,163 @@
+import itertools
+from typing import Dict, Iterable, List
+
+from celery.utils.log import get_task_logger
+from celery.worker.control import control_command, ok
+
+
+__all__ = ["Job"]
+
+logger = get_task_logger(__name__)
+
+
+@control_command(args=[("queue", str), ("parent", str)], signature="<queue> <parent>")
+def add_job_consumer(state, queue: str, parent: str, **kwargs) -> dict:
+    """
+    Tell the workers consuming from the parent queue of a job to consume from the job's queue too, so
+    workers dedicated to other queues and draining workers do not take the job's tasks.
+    """
+    consumer = state.consumer
+    if parent not in {q.name for q in consumer.task_consumer.queues}:
+        return ok(f"not consuming from {parent}")
+    consumer.call_soon(consumer.add_task_queue, queue)
+    return ok(f"add consumer {queue}")
+
+
+class Job:
+    """
+    A group of tasks submitted by one driver, with its own Redis namespace: a Celery queue, a status hash
+    and counters (job_status:<id> and job_counts:<id>) and the results of its tasks. Progress, purging and
+    cleanup only touch that namespace, so several drivers can run jobs on the same Redis and workers without
+    wiping each other's work. Workers consuming from the job's parent queue are told to consume from the
+    job's queue when the job is created, and workers that start later pick it up from the job_queues hash.
+    """
+
+    def __init__(
+        self,
+        distributaur,
+        job_id: str,
+        queue: str = None,
+        cleanup_on_exit: bool = True,
+        parent_queue: str = None,
+    ) -> None:
+        """
+        Args:
+            distributaur (Distributaur): The Distributaur instance the tasks are submitted through.
+            job_id (str): The ID of the job, used in its Redis keys.
+            queue (str): The Celery queue of the job's tasks. Defaults to "job.<job_id>".
+            cleanup_on_exit (bool): Delete the job's queue, statuses and results when the driver exits.
+                Defaults to True.
+            parent_queue (str): Only workers consuming from this queue run the job's tasks. Defaults to the
+                default queue.
+        """
+        self.distributaur = distributaur
+        self.job_id = job_id
+        self.queue = queue or f"job.{job_id}"
+        self.cleanup_on_exit = cleanup_on_exit
+        self.parent_queue = parent_queue or distributaur.app.conf.task_default_queue
+
+    @property
+    def status_key(self) -> str:
+        return f"job_status:{self.job_id}"
+
+    @property
+    def counts_key(self) -> str:
+        return f"job_counts:{self.job_id}"
+
+    def start(self) -> None:
+        """
+        Make the running workers that consume from the job's parent queue consume from the job's queue, and
+        register the queue for workers that start later.
+        """
+        self.distributaur.get_redis_connection().hset("job_queues", self.queue, self.parent_queue)
+        with self.distributaur.app.connection_for_write() as connection:
+            self.distributaur.app.control.broadcast(
+                "add_job_consumer",
+                arguments={"queue": self.queue, "parent": self.parent_queue},
+                connection=connection,
+            )
+
+    def submit(self, func_name: str, args: dict, **kwargs):
+        """
+        Submit a single call of a registered function to the job, see Distributaur.execute_function.
+
+        Returns:
+            celery.result.AsyncResult: The result of the task.
+        """
+        return self.distributaur.execute_function(
+            func_name, args, job_id=self.job_id, queue=self.queue, **kwargs
+        )
+
+    def submit_many(self, func_name: str, iterable_of_args: Iterable[dict], **kwargs):
+        """
+        Submit one call of a registered function per item of iterable_of_args to the job, see
+        Distributaur.execute_many.
+
+        Returns:
+            TaskBatch: Handle for the submitted tasks.
+        """
+        return self.distributaur.execute_many(
+            func_name, iterable_of_args, job_id=self.job_id, queue=self.queue, **kwargs
+        )
+
+    def submit_jobs(self, func_name: str, job_configs: List[dict], **kwargs):
+        """
+        Submit the jobs of a run that are not done yet to the job, see Distributaur.execute_jobs.
+
+        Returns:
+            TaskBatch: Handle for the submitted tasks.
+        """
+        return self.distributaur.execute_jobs(
+            func_name, job_configs, job_id=self.job_id, queue=self.queue, **kwargs
+        )
+
+    @property
+    def submitted(self) -> int:
+        """
+        Number of tasks submitted to the job.
+        """
+        return self.progress().get("submitted", 0)
+
+    def progress(self) -> Dict[str, int]:
+        """
+        Get the number of tasks of the job per status, see Distributaur.get_job_progress.
+
+        Returns:
+            Dict[str, int]: Number of tasks per status, and the number of tasks submitted under "submitted".
+        """
+        return self.distributaur.get_job_progress(self.job_id)
+
+    def purge(self) -> int:
+        """
+        Remove the job's tasks that are still waiting in its queue.
+
+        Returns:
+            int: The number of removed tasks.
+        """
+        with self.distributaur.app.connection_for_write() as connection:
+            return connection.default_channel.queue_purge(self.queue) or 0
+
+    def close(self) -> None:
+        """
+        Stop workers consuming from the job's queue. Tasks already queued stay queued.
+        """
+        self.distributaur.get_redis_connection().hdel("job_queues", self.queue)
+        with self.distributaur.app.connection_for_write() as connection:
+            self.distributaur.app.control.cancel_consumer(self.queue, connection=connection)
+
+    def cleanup(self) -> None:
+        """
+        Purge the job's queue and delete the results, statuses and counters of its tasks. Only tasks that
+        recorded a status are found, so results stored by tasks that never finished expire with the
+        result backend's expiry instead.
+        """
+        purged = self.purge()
+        redis_client = self.distributaur.get_redis_connection()
+        backend = self.distributaur.app.backend
+        task_ids = redis_client.hscan_iter(self.status_key, count=1000)
+        while chunk := list(itertools.islice(task_ids, 1000)):
+            redis_client.unlink(
+                *[backend.get_key_for_task(task_id.decode()) for task_id, _ in chunk]
+            )
+        self.distributaur.delete_job_status(self.job_id)
+        logger.info(f"Cleaned up job {self.job_id}, purged {purged} queued tasks")
@@ -0,0 +1,218 @@
+import os
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures import wait as wait_for
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, Iterable, List
+
+from celery import states, uuid
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from celery.result import ResultSet
+from celery.utils.log import get_task_logger
+
+
+__all__ = ["EXECUTORS", "LocalExecutor", "LocalResult"]
+
+# Values of the EXECUTOR setting. "celery" sends tasks to workers through the broker, the others run them
+# in a pool of the driver process.
+EXECUTORS = ["celery", "threads", "processes"]
+
+logger = get_task_logger(__name__)
+
+
+def _run_batch(func: callable, args_list: List[dict]) -> list:
+    # same per-item results as call_function_batch_task, so code reading them works with either executor
+    results = []
+    for index, args in enumerate(args_list):
+        try:
+            results.append({"result": func(**args)})
+        except Exception as e:
+            logger.error(f"Error in batch item {index}: {str(e)}")
+            results.append({"error": str(e)})
+    return results
+
+
+class LocalResult:
+    """
+    Result of a task run by a LocalExecutor, with the parts of Celery's AsyncResult interface that
+    distributaur uses: id, state, ready, successful, failed, result and get.
+    """
+
+    def __init__(self, task_id: str, future: Future) -> None:
+        self.id = task_id
+        self.future = future
+
+    def __repr__(self) -> str:
+        return f"<LocalResult: {self.id}>"
+
+    @property
+    def state(self) -> str:
+        if not self.future.done():
+            return states.STARTED if self.future.running() else states.PENDING
+        return states.FAILURE if self.future.exception() is not None else states.SUCCESS
+
+    status = state
+
+    @property
+    def result(self) -> any:
+        """
+        The return value of the function, its exception if it failed, or None if it is not done yet.
+        """
+        if not self.future.done():
+            return None
+        return self.future.exception() or self.future.result()
+
+    def ready(self) -> bool:
+        return self.future.done()
+
+    def successful(self) -> bool:
+        return self.state == states.SUCCESS
+
+    def failed(self) -> bool:
+        return self.state == states.FAILURE
+
+    def get(self, timeout: float = None, propagate: bool = True, **kwargs) -> any:
+        """
+        Wait for the task and return its result.
+
+        Args:
+            timeout (float): Seconds to wait for the task. Defaults to None (no limit).
+            propagate (bool): Raise the exception of a failed task. If False, it is returned instead.
+                Defaults to True.
+
+        Returns:
+            any: The return value of the function.
+
+        Raises:
+            celery.exceptions.TimeoutError: If the task did not complete within timeout seconds.
+        """
+        try:
+            exception = self.future.exception(timeout=timeout)
+        except FutureTimeoutError:
+            raise CeleryTimeoutError(f"Task {self.id} did not complete within {timeout}s")
+        if exception is not None:
+            if propagate:
+                raise exception
+            return exception
+        return self.future.result()
+
+    def then(self, callback: callable, on_error: callable = None) -> None:
+        # lets Celery's ResultSet, returned by TaskBatch.results, wait on local results
+        self.future.add_done_callback(lambda future: callback(self))
+
+
+class LocalExecutor:
+    """
+    Runs registered functions in a thread or process pool of the driver instead of on Celery workers, so
+    functions can be developed and profiled without a broker or worker processes. Results are kept in
+    memory instead of the result backend, and tasks are not retried. With the process pool, functions,
+    arguments and return values must be picklable.
+    """
+
+    def __init__(self, pool: str = "threads", max_workers: int = None) -> None:
+        """
+        Args:
+            pool (str): "threads" or "processes". Defaults to "threads".
+            max_workers (int): Number of functions run at the same time. Defaults to the number of CPU cores.
+
+        Raises:
+            ValueError: If the pool is unknown.
+        """
+        if pool not in ("threads", "processes"):
+            raise ValueError(f"Unknown pool '{pool}'. Choose one of ['threads', 'processes']")
+        self.pool = pool
+        self.max_workers = max_workers or os.cpu_count()
+        self.executor = None
+        self.results: Dict[str, LocalResult] = {}
+
+    def get_executor(self):
+        """
+        Return the pool of the executor, started on first use.
+        """
+        if self.executor is None:
+            if self.pool == "threads":
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="distributaur"
+                )
+            else:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    def submit(self, func: callable, args: dict, task_id: str = None) -> LocalResult:
+        """
+        Run a function with keyword arguments in the pool.
+
+        Returns:
+            LocalResult: The result of the call.
+        """
+        task_id = task_id or uuid()
+        result = LocalResult(task_id, self.get_executor().submit(func, **args))
+        self.results[task_id] = result
+        return result
+
+    def submit_batch(self, func: callable, args_list: List[dict], task_id: str = None) -> LocalResult:
+        """
+        Run a function once for every item of args_list, all in one call in the pool, as
+        call_function_batch_task does on a worker.
+
+        Returns:
+            LocalResult: The result of the batch, a list of {"result": value} or {"error": message} per item.
+        """
+        task_id = task_id or uuid()
+        result = LocalResult(task_id, self.get_executor().submit(_run_batch, func, list(args_list)))
+        result.item_count = len(args_list)
+        self.results[task_id] = result
+        return result
+
+    def AsyncResult(self, task_id: str) -> LocalResult:
+        """
+        Return the result of a task submitted to the executor, like Celery's app.AsyncResult.
+
+        Raises:
+            KeyError: If no task with this ID was submitted to the executor.
+        """
+        return self.results[task_id]
+
+    def ResultSet(self, results: List[LocalResult]) -> ResultSet:
+        """
+        Return a Celery ResultSet of local results, like Celery's app.ResultSet, e.g. to call join() on them.
+        """
+        return ResultSet(results)
+
+    def watch(self, task_ids: Iterable[str], update_interval: float = 1):
+        """
+        Follow tasks until all of them are done, yielding what Distributaur._watch_tasks yields for tasks
+        run by Celery workers: once per update_interval at most, a list of (task_id, meta) tuples of the
+        tasks that completed since the previous yield, which may be empty.
+        """
+        pending = {self.results[task_id].future: task_id for task_id in task_ids}
+        yield []
+        while pending:
+            done, _ = wait_for(pending, timeout=update_interval, return_when=FIRST_COMPLETED)
+            updates = []
+            for future in done:
+                result = self.results[pending.pop(future)]
+                updates.append((result.id, {"status": result.state, "result": result.result}))
+            yield updates
+
+    def forget(self, task_ids: Iterable[str] = None) -> None:
+        """
+        Drop the results of tasks from memory, or of every task if task_ids is not given.
+        """
+        if task_ids is None:
+            self.results.clear()
+            return
+        for task_id in task_ids:
+            self.results.pop(task_id, None)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the pool, waiting for the running functions to finish if wait is True.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
@@ -0,0 +1,154 @@
+from typing import Callable, Dict, List
+
+
+__all__ = [
+    "DEFAULT_FLOPS_SECONDS",
+    "OfferScorer",
+    "min_gpu_ram",
+    "min_reliability",
+    "min_bandwidth",
+    "max_price",
+]
+
+
+# Task duration in seconds multiplied by the TFLOPS of the machine, used to estimate durations from FLOPS
+# before any machine measured one: a task of 1 minute on a 10 TFLOPS GPU
+DEFAULT_FLOPS_SECONDS = 600
+
+
+def min_gpu_ram(gb: float) -> Callable[[dict], bool]:
+    """
+    Filter for offers whose GPUs have at least gb gigabytes of memory each.
+    """
+    return lambda offer: offer.get("gpu_ram", 0) >= gb * 1024
+
+
+def min_reliability(reliability: float) -> Callable[[dict], bool]:
+    """
+    Filter for offers whose machine has at least the given reliability score, between 0 and 1.
+    """
+    return lambda offer: _reliability(offer) >= reliability
+
+
+def min_bandwidth(mbps: float) -> Callable[[dict], bool]:
+    """
+    Filter for offers with at least mbps megabits per second of download bandwidth.
+    """
+    return lambda offer: offer.get("inet_down", 0) >= mbps
+
+
+def max_price(dph: float) -> Callable[[dict], bool]:
+    """
+    Filter for offers costing at most dph dollars per hour.
+    """
+    return lambda offer: offer.get("dph_total", 0) <= dph
+
+
+def _reliability(offer: dict) -> float:
+    return offer.get("reliability2", offer.get("reliability", 1.0)) or 0.0
+
+
+class OfferScorer:
+    """
+    Ranks Vast.ai offers by expected task throughput per dollar. Throughput comes from the task durations
+    measured on an offer's machine if there are any, otherwise it is estimated from the offer's FLOPS,
+    calibrated against the machines that do have measurements, or with default_flops_seconds if none do, so
+    every offer is scored in tasks per hour per dollar. It is then discounted by the machine's reliability
+    and by download bandwidth below bandwidth_target.
+    """
+
+    def __init__(
+        self,
+        filters: List[Callable[[dict], bool]] = None,
+        machine_durations: Dict[str, float] = None,
+        bandwidth_target: float = 100,
+        default_flops_seconds: float = DEFAULT_FLOPS_SECONDS,
+    ) -> None:
+        """
+        Args:
+            filters (List[Callable[[dict], bool]]): Functions that return True for offers that may be rented,
+                e.g. min_gpu_ram(8). Defaults to None (all offers).
+            machine_durations (Dict[str, float]): Average task duration in seconds measured on each machine,
+                keyed by Vast.ai machine ID. Defaults to None (no measurements).
+            bandwidth_target (float): Download bandwidth in Mbps from which bandwidth no longer limits
+                throughput. Defaults to 100.
+            default_flops_seconds (float): Task duration in seconds multiplied by TFLOPS, used to estimate
+                durations from FLOPS while no offered machine has measurements. Defaults to
+                DEFAULT_FLOPS_SECONDS (600).
+        """
+        self.filters = filters or []
+        self.machine_durations = {
+            str(machine_id): duration
+            for machine_id, duration in (machine_durations or {}).items()
+        }
+        self.bandwidth_target = bandwidth_target
+        self.default_flops_seconds = default_flops_seconds
+
+    def expected_duration(self, offer: dict, flops_seconds: float = None) -> float:
+        """
+        Estimate the duration of a task on the offer's machine.
+
+        Args:
+            offer (dict): The offer.
+            flops_seconds (float): Measured task duration multiplied by FLOPS, averaged over machines with
+                measurements. Defaults to None (default_flops_seconds).
+
+        Returns:
+            float: The duration in seconds. Offers without FLOPS are estimated as 1 TFLOPS machines.
+        """
+        measured = self.machine_durations.get(str(offer.get("machine_id")))
+        if measured:
+            return measured
+        return (flops_seconds or self.default_flops_seconds) / (offer.get("total_flops") or 1.0)
+
+    def score(self, offer: dict, flops_seconds: float = None) -> float:
+        """
+        Score an offer by expected throughput per dollar; higher is better.
+
+        Args:
+            offer (dict): The offer.
+            flops_seconds (float): Calibration from measured durations, see expected_duration.
+
+        Returns:
+            float: Expected tasks per hour per dollar, including the reliability and bandwidth discounts.
+        """
+        throughput = 3600 / self.expected_duration(offer, flops_seconds)
+
+        bandwidth = offer.get("inet_down")
+        bandwidth_factor = (
+            min(1.0, bandwidth / self.bandwidth_target)
+            if bandwidth is not None and self.bandwidth_target
+            else 1.0
+        )
+        price = offer.get("dph_total") or 1e-6
+        return throughput * _reliability(offer) * bandwidth_factor / price
+
+    def rank(self, offers: List[dict]) -> List[dict]:
+        """
+        Filter offers and sort them by score, best first. Each returned offer gets its score in "score".
+
+        Args:
+            offers (List[dict]): Offers returned by search_offers.
+
+        Returns:
+            List[dict]: The offers passing every filter, best first.
+        """
+        offers = [
+            offer for offer in offers if all(check(offer) for check in self.filters)
+        ]
+
+        # calibrate FLOPS-based estimates against machines with measured durations, so measured and
+        # estimated offers are compared in the same unit
+        calibration = [
+            self.machine_durations[str(offer.get("machine_id"))] * offer["total_flops"]
+            for offer in offers
+            if offer.get("total_flops") and self.machine_durations.get(str(offer.get("machine_id")))
+        ]
+        flops_seconds = sum(calibration) / len(calibration) if calibration else None
+
+        ranked = []
+        for offer in offers:
+            offer = dict(offer)
+            offer["score"] = self.score(offer, flops_seconds)
+            ranked.append(offer)
+        return sorted(ranked, key=lambda offer: offer["score"], reverse=True)
@@ -0,0 +1,109 @@
+import importlib.util
+from typing import List
+
+
+__all__ = ["WORKER_PROFILES", "available_profiles", "get_worker_profile", "worker_command"]
+
+# Worker settings for each kind of task, applied to the Celery app of the driver and workers and to the
+# command rented nodes start their worker with. A concurrency of None runs one process per CPU core.
+WORKER_PROFILES = {
+    # renders that take minutes on one GPU: one task at a time, acknowledged once done so a lost node's
+    # task is redelivered, with a visibility timeout longer than any task so it is not redelivered early
+    "long-gpu": {
+        "pool": "prefork",
+        "concurrency": 1,
+        "prefetch_multiplier": 1,
+        "acks_late": True,
+        "visibility_timeout": 43200,
+    },
+    # CPU tasks of a few seconds or less: one process per core, each prefetching tasks so the next one is
+    # already there when a task finishes, acknowledged when received
+    "short-cpu": {
+        "pool": "prefork",
+        "concurrency": None,
+        "prefetch_multiplier": 16,
+        "acks_late": False,
+        "visibility_timeout": 3600,
+    },
+    # tasks that mostly wait on downloads, uploads or remote APIs: many threads in one process
+    "io": {
+        "pool": "threads",
+        "concurrency": 32,
+        "prefetch_multiplier": 4,
+        "acks_late": True,
+        "visibility_timeout": 3600,
+    },
+    # like io, with greenlets instead of threads for hundreds of concurrent tasks
+    "io-gevent": {
+        "pool": "gevent",
+        "concurrency": 256,
+        "prefetch_multiplier": 4,
+        "acks_late": True,
+        "visibility_timeout": 3600,
+    },
+}
+
+
+def available_profiles() -> List[str]:
+    """
+    Return the names of the worker profiles whose pool is installed.
+
+    Returns:
+        List[str]: Names that can be used for the WORKER_PROFILE setting.
+    """
+    return [
+        name
+        for name, profile in WORKER_PROFILES.items()
+        if profile["pool"] != "gevent" or importlib.util.find_spec("gevent") is not None
+    ]
+
+
+def get_worker_profile(name: str, concurrency: int = None) -> dict:
+    """
+    Return the settings of a worker profile.
+
+    Args:
+        name (str): Name of the profile (long-gpu, short-cpu, io or io-gevent).
+        concurrency (int): Number of tasks a worker runs at the same time, instead of the profile's.
+            Defaults to None (the profile's).
+
+    Returns:
+        dict: The pool, concurrency, prefetch_multiplier, acks_late and visibility_timeout of the profile.
+
+    Raises:
+        ValueError: If the profile is unknown or its pool is not installed.
+    """
+    if name not in WORKER_PROFILES:
+        raise ValueError(
+            f"Unknown worker profile '{name}'. Choose one of {list(WORKER_PROFILES)}"
+        )
+    if name not in available_profiles():
+        raise ValueError(
+            f"Worker profile '{name}' requires the '{WORKER_PROFILES[name]['pool']}' package"
+        )
+    profile = dict(WORKER_PROFILES[name])
+    if concurrency:
+        profile["concurrency"] = concurrency
+    return profile
+
+
+def worker_command(module_name: str, profile: dict, queues: List[str] = None) -> str:
+    """
+    Build the command that starts a Celery worker with the settings of a profile.
+
+    Args:
+        module_name (str): The module defining the Celery app of the worker.
+        profile (dict): The worker profile, see get_worker_profile.
+        queues (List[str]): Queues the worker consumes from, in order of precedence. Defaults to None (the
+            default queue).
+
+    Returns:
+        str: The command.
+    """
+    command = f"celery -A {module_name} worker --loglevel=info --pool={profile['pool']}"
+    if profile["concurrency"]:
+        command += f" --concurrency={profile['concurrency']}"
+    command += f" --prefetch-multiplier={profile['prefetch_multiplier']}"
+    if queues:
+        command += f" -Q {','.join(queues)}"
+    return command
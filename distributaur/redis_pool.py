@@ -0,0 +1,97 @@
+import threading
+import time
+
+from celery.backends.redis import RedisBackend
+from redis import BlockingConnectionPool
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+
+__all__ = ["RedisPool", "SharedPoolRedisBackend"]
+
+
+class RedisPool(BlockingConnectionPool):
+    """
+    Bounded Redis connection pool: once max_connections connections are in use, callers wait up to timeout
+    seconds for one to be released instead of opening more. Counts the connections opened, the callers that
+    had to wait and for how long, and how often connections were reopened after they were closed or dropped.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = {
+            "connections_opened": 0,
+            "connects": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+        }
+        self._stats_lock = threading.Lock()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        connection.register_connect_callback(self._on_connect)
+        with self._stats_lock:
+            self.stats["connections_opened"] += 1
+        return connection
+
+    def get_connection(self, *args, **kwargs):
+        # the queue holds a connection or a placeholder for every free slot, so it is only empty when all
+        # max_connections connections are in use and the caller is about to wait
+        if not self.pool.empty():
+            return super().get_connection(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().get_connection(*args, **kwargs)
+        except RedisConnectionError:
+            with self._stats_lock:
+                self.stats["timeouts"] += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.stats["waits"] += 1
+                self.stats["wait_time"] += time.perf_counter() - start
+
+    def get_stats(self) -> dict:
+        """
+        Return a snapshot of the pool's statistics.
+
+        Returns:
+            dict: The pool size, the number of connections in use and idle, the number of connections opened
+            and reconnects, and the number of callers that waited for a connection, how long they waited in
+            total and how many gave up after timeout seconds.
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        connects = stats.pop("connects")
+        stats["reconnects"] = max(connects - stats["connections_opened"], 0)
+        stats["max_connections"] = self.max_connections
+        stats["in_use"] = len(self._get_in_use_connections())
+        stats["idle"] = len(self._get_free_connections())
+        return stats
+
+    def resize(self, max_connections: int) -> None:
+        """
+        Change the size of the pool, closing its connections. Clients and backends using the pool keep using
+        it, so a process still has a single pool.
+        """
+        self.disconnect()
+        self.max_connections = max_connections
+        self.reset()
+
+    def _on_connect(self, connection) -> None:
+        with self._stats_lock:
+            self.stats["connects"] += 1
+
+
+class SharedPoolRedisBackend(RedisBackend):
+    """
+    Celery Redis result backend taking its connections from the pool returned by the app's
+    distributaur_redis_pool function, so results and task states share the Redis pool of the Distributaur
+    instance instead of opening a pool per thread.
+    """
+
+    def _get_pool(self, **params):
+        get_pool = getattr(self.app, "distributaur_redis_pool", None)
+        if get_pool is None:
+            return super()._get_pool(**params)
+        return get_pool()
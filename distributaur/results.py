@@ -0,0 +1,72 @@
+from typing import List
+
+from celery import Celery
+
+
+class TaskBatch:
+    """
+    Lightweight handle for a group of tasks submitted with Distributaur.execute_many. Only the task IDs
+    are kept in memory; AsyncResult objects are created on demand when the batch is iterated or indexed.
+    """
+
+    def __init__(
+        self,
+        app: Celery,
+        task_ids: List[str],
+        elapsed: float,
+        item_counts: List[int] = None,
+        job_id: str = None,
+        ignore_result: bool = False,
+    ) -> None:
+        """
+        Initialize the batch handle.
+
+        Args:
+            app (Celery): The Celery app the tasks were submitted to, or the LocalExecutor running them.
+            task_ids (List[str]): IDs of the submitted tasks, in submission order.
+            elapsed (float): Number of seconds it took to enqueue the tasks.
+            item_counts (List[int]): Number of function calls packed into each task, if the tasks were
+                submitted as batches. Defaults to None (one call per task).
+            job_id (str): The job whose status hash tracks the tasks. Defaults to None.
+            ignore_result (bool): Whether the tasks were sent without storing their results, so their
+                completion is only recorded in the status hash of their job. Defaults to False.
+        """
+        self.app = app
+        self.task_ids = task_ids
+        self.elapsed = elapsed
+        self.item_counts = item_counts
+        self.job_id = job_id
+        self.ignore_result = ignore_result
+
+    def __len__(self) -> int:
+        return len(self.task_ids)
+
+    def __iter__(self):
+        for index in range(len(self.task_ids)):
+            yield self[index]
+
+    def __getitem__(self, index: int):
+        async_result = self.app.AsyncResult(self.task_ids[index])
+        if self.item_counts is not None:
+            async_result.item_count = self.item_counts[index]
+        async_result.job_id = self.job_id
+        async_result.ignored = self.ignore_result
+        return async_result
+
+    @property
+    def throughput(self) -> float:
+        """
+        Number of tasks enqueued per second.
+        """
+        if self.elapsed <= 0:
+            return float(len(self.task_ids))
+        return len(self.task_ids) / self.elapsed
+
+    def results(self):
+        """
+        Return a Celery ResultSet for the batch, e.g. to call join() on all tasks.
+
+        Returns:
+            celery.result.ResultSet: ResultSet containing an AsyncResult for every task in the batch.
+        """
+        return self.app.ResultSet(list(self))
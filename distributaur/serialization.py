@@ -0,0 +1,231 @@
+import base64
+import io
+import pickle
+import sys
+
+from kombu.serialization import register
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+__all__ = ["SERIALIZERS", "available_serializers", "get_serializer", "allow_pickle_global"]
+
+# Names accepted for the TASK_SERIALIZER setting, mapped to the name they are registered under in kombu
+SERIALIZERS = {
+    "json": "json",
+    "orjson": "distributaur-orjson",
+    "msgpack": "distributaur-msgpack",
+    "pickle": "distributaur-pickle",
+}
+
+# msgpack extension type used for NumPy arrays
+NDARRAY_EXT_TYPE = 42
+
+# Globals the pickle serializer is allowed to load. Extend with allow_pickle_global.
+PICKLE_ALLOWLIST = {
+    ("builtins", name)
+    for name in [
+        "bool",
+        "bytearray",
+        "bytes",
+        "complex",
+        "dict",
+        "float",
+        "frozenset",
+        "int",
+        "list",
+        "range",
+        "set",
+        "slice",
+        "str",
+        "tuple",
+    ]
+} | {
+    ("collections", "OrderedDict"),
+    ("datetime", "date"),
+    ("datetime", "datetime"),
+    ("datetime", "timedelta"),
+    ("numpy", "dtype"),
+    ("numpy", "ndarray"),
+    ("numpy.core.multiarray", "_reconstruct"),
+    ("numpy.core.multiarray", "scalar"),
+    ("numpy.core.numeric", "_frombuffer"),
+    ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy._core.multiarray", "scalar"),
+    ("numpy._core.numeric", "_frombuffer"),
+}
+
+
+def allow_pickle_global(module: str, name: str) -> None:
+    """
+    Allow the pickle serializer to load a global, e.g. a custom class used in task arguments.
+
+    Args:
+        module (str): The module the global is defined in.
+        name (str): The name of the global.
+    """
+    PICKLE_ALLOWLIST.add((module, name))
+
+
+def available_serializers() -> list:
+    """
+    Return the names of the serializers whose dependencies are installed.
+
+    Returns:
+        list: Names that can be used for the TASK_SERIALIZER setting.
+    """
+    available = ["json", "pickle"]
+    if orjson is not None:
+        available.append("orjson")
+    if msgpack is not None:
+        available.append("msgpack")
+    return available
+
+
+def get_serializer(name: str) -> str:
+    """
+    Return the kombu name of a serializer, to pass as the serializer of a Celery message.
+
+    Args:
+        name (str): Name of the serializer (json, orjson, msgpack or pickle).
+
+    Returns:
+        str: The name the serializer is registered under in kombu.
+
+    Raises:
+        ValueError: If the serializer is unknown or its dependency is not installed.
+    """
+    if name not in SERIALIZERS:
+        raise ValueError(
+            f"Unknown serializer '{name}'. Choose one of {list(SERIALIZERS)}"
+        )
+    if name not in available_serializers():
+        raise ValueError(f"Serializer '{name}' requires the '{name}' package")
+    return SERIALIZERS[name]
+
+
+def _orjson_default(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(obj).decode()}
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _restore_bytes(obj):
+    if isinstance(obj, dict):
+        if len(obj) == 1 and "__bytes__" in obj:
+            return base64.b64decode(obj["__bytes__"])
+        return {key: _restore_bytes(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_restore_bytes(value) for value in obj]
+    return obj
+
+
+def orjson_dumps(obj) -> bytes:
+    # NumPy arrays are encoded as nested lists, bytes are base64 encoded as JSON has no binary type
+    return orjson.dumps(
+        obj,
+        default=_orjson_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+    )
+
+
+def orjson_loads(data) -> any:
+    return _restore_bytes(orjson.loads(data))
+
+
+def _numpy(load: bool = False):
+    # NumPy takes longer to import than the rest of distributaur, so it is only imported to decode an array.
+    # An object being encoded can only be an array if NumPy was already imported.
+    if load and "numpy" not in sys.modules:
+        try:
+            import numpy
+        except ImportError:
+            return None
+    return sys.modules.get("numpy")
+
+
+def _msgpack_default(obj):
+    np = _numpy()
+    if np is not None and isinstance(obj, np.ndarray):
+        array = np.ascontiguousarray(obj)
+        header = msgpack.packb([array.dtype.str, array.shape])
+        return msgpack.ExtType(NDARRAY_EXT_TYPE, header + array.tobytes())
+    if np is not None and isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Type is not msgpack serializable: {type(obj).__name__}")
+
+
+def _msgpack_ext_hook(code, data):
+    np = _numpy(load=code == NDARRAY_EXT_TYPE)
+    if code == NDARRAY_EXT_TYPE and np is not None:
+        unpacker = msgpack.Unpacker(use_list=False)
+        unpacker.feed(data)
+        dtype, shape = unpacker.unpack()
+        offset = unpacker.tell()
+        return np.frombuffer(data, dtype=dtype, offset=offset).reshape(shape)
+    return msgpack.ExtType(code, data)
+
+
+def msgpack_dumps(obj) -> bytes:
+    # bytes are stored as msgpack binary and NumPy arrays as raw buffers, so neither is base64 encoded
+    return msgpack.packb(obj, default=_msgpack_default, use_bin_type=True)
+
+
+def msgpack_loads(data) -> any:
+    return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, raw=False)
+
+
+class AllowlistUnpickler(pickle.Unpickler):
+    """
+    Unpickler that only loads globals listed in PICKLE_ALLOWLIST, so task messages cannot run arbitrary code.
+    """
+
+    def find_class(self, module: str, name: str):
+        if (module, name) not in PICKLE_ALLOWLIST:
+            raise pickle.UnpicklingError(
+                f"Global '{module}.{name}' is not allowed by the pickle serializer"
+            )
+        return super().find_class(module, name)
+
+
+def pickle_dumps(obj) -> bytes:
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def pickle_loads(data) -> any:
+    return AllowlistUnpickler(io.BytesIO(data)).load()
+
+
+register(
+    SERIALIZERS["pickle"],
+    pickle_dumps,
+    pickle_loads,
+    content_type="application/x-distributaur-pickle",
+    content_encoding="binary",
+)
+
+if orjson is not None:
+    register(
+        SERIALIZERS["orjson"],
+        orjson_dumps,
+        orjson_loads,
+        content_type="application/x-distributaur-orjson",
+        content_encoding="binary",
+    )
+
+if msgpack is not None:
+    register(
+        SERIALIZERS["msgpack"],
+        msgpack_dumps,
+        msgpack_loads,
+        content_type="application/x-distributaur-msgpack",
+        content_encoding="binary",
+    )
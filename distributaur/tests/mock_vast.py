@@ -0,0 +1,134 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockVastServer:
+    """
+    Local HTTP server that simulates the Vast.ai endpoints used by Distributaur: searching offers, creating
+    instances from offers and destroying instances. Every request takes latency seconds, so tests can tell
+    concurrent requests from serial ones.
+    """
+
+    def __init__(
+        self,
+        offers: list,
+        latency: float = 0.2,
+        failing_offers: set = (),
+        search_failures: int = 0,
+    ) -> None:
+        """
+        Args:
+            offers (list): Offers returned by the search endpoint, dicts with "id" and "dph_total".
+            latency (float): Seconds each request takes. Defaults to 0.2.
+            failing_offers (set): IDs of offers that fail to create an instance. Defaults to none.
+            search_failures (int): Number of searches answered with 503 before searches succeed. Defaults to 0.
+        """
+        self.offers = offers
+        self.latency = latency
+        self.failing_offers = set(failing_offers)
+        self.search_failures = search_failures
+        self.instances = {}
+        self.destroyed = []
+        # environment sent with each rented instance
+        self.envs = {}
+        self.active_requests = 0
+        self.max_active_requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/api/v0"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep connections alive between requests, as the real API does
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _respond(self, status: int, body: dict) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self, method: str) -> None:
+                with mock.lock:
+                    mock.active_requests += 1
+                    mock.max_active_requests = max(
+                        mock.max_active_requests, mock.active_requests
+                    )
+                try:
+                    time.sleep(mock.latency)
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length)) if length else {}
+                    path = self.path.split("?")[0]
+
+                    if method == "GET" and path == "/api/v0/bundles/":
+                        with mock.lock:
+                            failing = mock.search_failures > 0
+                            mock.search_failures -= 1
+                        if failing:
+                            return self._respond(503, {"error": "service unavailable"})
+                        available = [
+                            offer
+                            for offer in mock.offers
+                            if offer["id"] not in mock.instances.values()
+                        ]
+                        return self._respond(200, {"offers": available})
+
+                    match = re.fullmatch(r"/api/v0/asks/([^/]+)/", path)
+                    if method == "PUT" and match:
+                        offer_id = int(match.group(1))
+                        if offer_id in mock.failing_offers:
+                            return self._respond(400, {"error": "offer unavailable"})
+                        with mock.lock:
+                            instance_id = 1000 + len(mock.instances)
+                            mock.instances[instance_id] = offer_id
+                            mock.envs[instance_id] = body.get("env", {})
+                        return self._respond(
+                            200, {"success": True, "new_contract": instance_id}
+                        )
+
+                    match = re.fullmatch(r"/api/v0/instances/([^/]+)/", path)
+                    if method == "DELETE" and match:
+                        instance_id = int(match.group(1))
+                        if instance_id not in mock.instances:
+                            return self._respond(404, {"error": "no such instance"})
+                        with mock.lock:
+                            mock.destroyed.append(instance_id)
+                        return self._respond(200, {"success": True})
+
+                    self._respond(404, {"error": "not found"})
+                finally:
+                    with mock.lock:
+                        mock.active_requests -= 1
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_PUT(self):
+                self._handle("PUT")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        return Handler
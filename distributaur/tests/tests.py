@@ -1,14 +1,34 @@
+import importlib
 import json
 import pytest
 import time
+import threading
 import os
 import tempfile
 from unittest.mock import MagicMock, patch
 
 from huggingface_hub import HfApi
-
-from ..distributaur import create_from_config
-from .worker import example_test_function
+from redis.exceptions import ConnectionError as RedisConnectionError
+from requests.exceptions import HTTPError
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from kombu.exceptions import DecodeError
+from kombu.serialization import dumps, loads
+
+from ..affinity import HEARTBEAT_TTL
+from ..autoscaler import Autoscaler
+from ..benchmark.startup import LAZY_MODULES, import_times
+from ..blobstore import BLOB_MARKER, DEFAULT_BLOB_TTL, BlobCache, is_blob_ref
+from ..cache import AssetCache
+from ..clients import HttpClient
+from ..distributaur import DEFAULT_PRIORITY, Distributaur, create_from_config
+from ..file_index import RepoFileIndex
+from ..job import add_job_consumer
+from ..offers import DEFAULT_FLOPS_SECONDS, OfferScorer, min_gpu_ram, min_reliability
+from ..profiles import get_worker_profile, worker_command
+from ..serialization import available_serializers, get_serializer
+from ..uploader import UploadQueue
+from .mock_vast import MockVastServer
+from .worker import count_setup, example_test_function, render_with_cache
 
 
 @pytest.fixture
@@ -48,7 +68,7 @@ def test_execute_function(mock_delay, mock_task_function):
     params = {"arg1": 1, "arg2": 2}
     distributaur.execute_function(mock_task_function.__name__, params)
 
-    mock_delay.assert_called_once_with(mock_task_function.__name__, json.dumps(params))
+    mock_delay.assert_called_once_with(mock_task_function.__name__, params)
     print("Test passed")
 
 
@@ -74,6 +94,328 @@ def test_execute_function():
     print("Task execution test passed")
 
 
+def test_execute_many():
+    distributaur = create_from_config()
+
+    distributaur.register_function(example_test_function)
+    redis_client = distributaur.get_redis_connection()
+    queue_length = distributaur.get_queue_length("celery")
+
+    # pass a generator so the arguments are never materialized as a list
+    task_params = ({"arg1": i, "arg2": 20} for i in range(25))
+    batch = distributaur.execute_many("example_test_function", task_params, chunk_size=10)
+
+    assert len(batch) == 25
+    assert len(set(batch.task_ids)) == 25
+    assert batch[0].id == batch.task_ids[0]
+    assert distributaur.get_queue_length("celery") == queue_length + 25
+    print("Bulk task execution test passed")
+
+
+def test_execute_jobs_skips_done():
+    distributaur = create_from_config()
+
+    distributaur.register_function(example_test_function)
+    redis_client = distributaur.get_redis_connection()
+    repo_id = "test/planner"
+    distributaur.file_indexes[repo_id] = RepoFileIndex(lambda: ["result_0.txt"])
+
+    job_configs = [
+        {"outputs": [f"result_{i}.txt"], "task_params": {"arg1": i, "arg2": 20}}
+        for i in range(5)
+    ]
+    task_ids = [
+        distributaur.get_job_task_id("example_test_function", job_config)
+        for job_config in job_configs
+    ]
+    assert len(set(task_ids)) == 5
+    # the second job already reported success, its output was not found
+    distributaur.update_function_status(task_ids[1], "success", job_id="planner-test")
+
+    plan = distributaur.plan_jobs("example_test_function", job_configs, repo_id, "planner-test")
+    assert plan["done"] == 2
+    assert plan["task_ids"] == task_ids[2:]
+
+    queue_length = distributaur.get_queue_length("celery")
+    batch = distributaur.execute_jobs(
+        "example_test_function", job_configs, repo_id, job_id="planner-test"
+    )
+    assert batch.task_ids == task_ids[2:]
+    assert distributaur.get_queue_length("celery") == queue_length + 3
+    assert distributaur.get_job_progress("planner-test") == {"success": 1, "submitted": 3}
+    distributaur.delete_job_status("planner-test")
+    del distributaur.file_indexes[repo_id]
+
+
+def test_batch_task_execution():
+    distributaur = create_from_config()
+
+    distributaur.register_function(example_test_function)
+    args_batch = [{"arg1": 1, "arg2": 2}, {"arg1": 1}, {"arg1": 3, "arg2": 4}]
+
+    # run the task body in-process; the second item is missing an argument
+    results = distributaur.call_function_batch_task(
+        "example_test_function", args_batch
+    )
+    assert results[0] == {"result": "Result: arg1+arg2=3"}
+    assert "error" in results[1]
+    assert results[2] == {"result": "Result: arg1+arg2=7"}
+
+    task_params = ({"arg1": i, "arg2": 20} for i in range(25))
+    batch = distributaur.execute_many(
+        "example_test_function", task_params, batch_size=10
+    )
+    assert len(batch) == 3
+    assert batch.item_counts == [10, 10, 5]
+    assert batch[2].item_count == 5
+    print("Batch task execution test passed")
+
+
+@pytest.mark.parametrize("serializer", available_serializers())
+def test_serializer_roundtrip(serializer):
+    task_args = ("example_test_function", {"arg1": 1, "arg2": [1.5, "two"], "arg3": None})
+    if serializer != "json":
+        task_args[1]["buffer"] = b"\x00\x01binary"
+
+    content_type, content_encoding, data = dumps(
+        task_args, serializer=get_serializer(serializer)
+    )
+    decoded = loads(data, content_type, content_encoding, accept=[content_type])
+    assert decoded[0] == task_args[0]
+    assert decoded[1] == task_args[1]
+
+
+def test_pickle_serializer_allowlist():
+    # a pickled reference to os.system must not be loaded by workers
+    content_type, content_encoding, data = dumps(
+        {"value": os.system}, serializer=get_serializer("pickle")
+    )
+    with pytest.raises(DecodeError):
+        loads(data, content_type, content_encoding, accept=[content_type])
+
+
+def test_offload_large_arguments():
+    distributaur = create_from_config()
+    threshold = distributaur.get_env("BLOB_THRESHOLD")
+    scene = "x" * threshold
+
+    args = distributaur._offload_args({"scene": scene, "frame": 1})
+    assert is_blob_ref(args["scene"])
+    assert args["frame"] == 1
+
+    # the same value is stored once under the same digest
+    assert distributaur._offload_args({"scene": scene})["scene"] == args["scene"]
+    assert distributaur.get_blob_store().get(args["scene"][BLOB_MARKER]) is not None
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        distributaur.blob_cache = BlobCache(cache_dir)
+        assert distributaur._resolve_args(args) == {"scene": scene, "frame": 1}
+        assert os.listdir(cache_dir) == [args["scene"][BLOB_MARKER]]
+        distributaur.blob_cache = None
+
+    # once the memo of a blob expires, the next reference stores it again if it expired in the meantime
+    digest = args["scene"][BLOB_MARKER]
+    redis_client = distributaur.get_redis_connection()
+    redis_client.delete(f"blob:{digest}")
+    distributaur._offload_args({"scene": scene})
+    assert redis_client.get(f"blob:{digest}") is None
+    distributaur.stored_blobs[(digest, DEFAULT_BLOB_TTL)] = 0
+    distributaur._offload_args({"scene": scene})
+    assert redis_client.get(f"blob:{digest}") is not None
+
+    # a result blob with a shorter TTL is tracked separately and does not shorten the argument's expiry
+    distributaur.offload(scene, ttl=60)
+    assert (digest, 60) in distributaur.stored_blobs
+    assert redis_client.ttl(f"blob:{digest}") > 60
+
+
+def test_blob_cache_eviction():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        blob_cache = BlobCache(cache_dir, max_bytes=250)
+        for index, digest in enumerate(["a", "b", "c"]):
+            blob_cache.put(digest, b"x" * 100)
+            os.utime(os.path.join(cache_dir, digest), (index, index))
+            blob_cache._evict()
+        # reading a blob makes it the most recently used one
+        assert blob_cache.get("a") is None and blob_cache.get("b") is not None
+        blob_cache.put("d", b"x" * 100)
+        assert sorted(os.listdir(cache_dir)) == ["b", "d"]
+
+        # blobs larger than the cache are not cached
+        blob_cache.put("e", b"x" * 300)
+        assert blob_cache.get("e") is None
+
+
+@pytest.mark.parametrize("use_events", [True, False])
+def test_monitor_tasks(use_events):
+    distributaur = create_from_config()
+    backend = distributaur.app.backend
+    tasks = [distributaur.app.AsyncResult(f"monitor_test_{i}") for i in range(6)]
+
+    # half of the tasks finish before monitoring starts, the rest while it is running
+    for task in tasks[:3]:
+        backend.store_result(task.id, "done", "SUCCESS")
+
+    def finish_remaining():
+        time.sleep(0.5)
+        for task in tasks[3:]:
+            backend.store_result(task.id, "done", "SUCCESS")
+
+    finisher = threading.Thread(target=finish_remaining)
+    finisher.start()
+    distributaur.monitor_tasks(
+        tasks, update_interval=0.1, print_statements=False, use_events=use_events
+    )
+    finisher.join()
+
+    assert all(task.ready() for task in tasks)
+    print("Task monitoring test passed")
+
+
+def test_result_policy():
+    distributaur = create_from_config()
+    distributaur.register_function(example_test_function)
+    redis_client = distributaur.get_redis_connection()
+    backend = distributaur.app.backend
+    threshold = distributaur.settings["RESULT_THRESHOLD"]
+    assert distributaur.app.conf.result_expires == distributaur.settings["RESULT_EXPIRES"]
+
+    # small results are stored inline, large ones in the blob store behind a reference
+    assert distributaur._offload_result("small") == "small"
+    large = ["x" * 100] * (threshold // 50)
+    ref = distributaur._offload_result(large)
+    assert is_blob_ref(ref)
+    assert distributaur.resolve_result(ref) == large
+    assert 0 < redis_client.ttl(f"blob:{ref[BLOB_MARKER]}") <= distributaur.settings["RESULT_EXPIRES"]
+
+    # as_completed resolves references, so callers see the return value
+    task = distributaur.app.AsyncResult("result_policy_test")
+    backend.store_result(task.id, ref, "SUCCESS")
+    assert list(distributaur.as_completed([task])) == [(task, large)]
+    assert distributaur.get_result(task, timeout=1) == large
+    backend.forget(task.id)
+
+    # fire-and-forget tasks tell the worker not to store their result
+    queue_length = distributaur.get_queue_length("celery")
+    distributaur.execute_function("example_test_function", {"arg1": 1, "arg2": 2}, ignore_result=True)
+    distributaur.execute_many("example_test_function", [{"arg1": 1, "arg2": 2}])
+    with patch.dict(distributaur.settings, {"IGNORE_RESULT": True}):
+        distributaur.execute_many("example_test_function", [{"arg1": 1, "arg2": 2}])
+    queue_key = distributaur._queue_keys("celery")[DEFAULT_PRIORITY]
+    messages = [json.loads(m) for m in redis_client.lrange(queue_key, 0, 2)]
+    assert distributaur.get_queue_length("celery") == queue_length + 3
+    # the queue is a list pushed on the left, so the newest message comes first
+    assert [m["headers"]["ignore_result"] for m in messages] == [True, False, True]
+
+
+@pytest.mark.parametrize("use_events", [True, False])
+def test_as_completed(use_events):
+    distributaur = create_from_config()
+    backend = distributaur.app.backend
+    tasks = [
+        distributaur.app.AsyncResult(f"as_completed_test_{use_events}_{i}") for i in range(4)
+    ]
+    backend.store_result(tasks[2].id, "result 2", "SUCCESS")
+
+    def finish_in_reverse():
+        for task in tasks[3::-1]:
+            time.sleep(0.2)
+            if task is tasks[1]:
+                backend.mark_as_failure(task.id, ValueError("failed 1"))
+            elif task is not tasks[2]:
+                backend.store_result(task.id, f"result {task.id[-1]}", "SUCCESS")
+
+    finisher = threading.Thread(target=finish_in_reverse)
+    finisher.start()
+    completed = list(
+        distributaur.as_completed(
+            tasks, propagate=False, update_interval=0.05, use_events=use_events
+        )
+    )
+    finisher.join()
+
+    # the task finished before iterating comes first, then the others in completion order
+    assert [task.id for task, _ in completed] == [tasks[i].id for i in [2, 3, 1, 0]]
+    assert [result for _, result in completed if not isinstance(result, Exception)] == [
+        "result 2",
+        "result 3",
+        "result 0",
+    ]
+    assert isinstance(completed[2][1], ValueError)
+
+    with pytest.raises(ValueError):
+        list(distributaur.as_completed(tasks, update_interval=0.05, use_events=use_events))
+
+    pending = distributaur.app.AsyncResult("as_completed_test_pending")
+    with pytest.raises(CeleryTimeoutError):
+        list(distributaur.as_completed([pending], timeout=0.2, update_interval=0.05))
+    for task in tasks:
+        backend.forget(task.id)
+
+
+def test_as_completed_yields_right_away():
+    distributaur = create_from_config()
+    backend = distributaur.app.backend
+    tasks = [distributaur.app.AsyncResult(f"as_completed_fast_{i}") for i in range(2)]
+
+    def finish_first():
+        time.sleep(0.2)
+        backend.store_result(tasks[0].id, "fast", "SUCCESS")
+
+    # a completion is yielded when its event arrives, not at the end of the update interval
+    finisher = threading.Thread(target=finish_first)
+    start = time.time()
+    finisher.start()
+    completed = distributaur.as_completed(tasks, update_interval=5)
+    assert next(completed) == (tasks[0], "fast")
+    assert time.time() - start < 1.5
+    finisher.join()
+    completed.close()
+    backend.forget(tasks[0].id)
+
+
+@pytest.mark.parametrize("use_events", [True, False])
+def test_watch_ignored_tasks(use_events):
+    distributaur = create_from_config()
+    job_id = f"ignored-test-{use_events}"
+    tasks = [distributaur.app.AsyncResult(f"ignored_test_{use_events}_{i}") for i in range(3)]
+    for task in tasks:
+        task.ignored = True
+        task.job_id = job_id
+
+    # tasks sent with ignore_result only record their completion in their job's status hash
+    def finish_tasks():
+        for index, task in enumerate(tasks):
+            time.sleep(0.2)
+            distributaur.update_function_status(
+                task.id, "failure" if index == 1 else "success", job_id=job_id
+            )
+
+    finisher = threading.Thread(target=finish_tasks)
+    finisher.start()
+    completed = list(
+        distributaur.as_completed(
+            tasks, timeout=5, propagate=False, update_interval=0.05, use_events=use_events
+        )
+    )
+    finisher.join()
+    assert [task.id for task, _ in completed] == [task.id for task in tasks]
+    assert completed[0][1] is None and isinstance(completed[1][1], RuntimeError)
+
+    # monitor_tasks returns once all of them are recorded
+    distributaur.monitor_tasks(
+        tasks, update_interval=0.05, print_statements=False, use_events=use_events
+    )
+
+    # handles of tasks sent with ignore_result carry their job, so they can be followed the same way
+    distributaur.register_function(example_test_function)
+    batch = distributaur.execute_many(
+        "example_test_function", [{"arg1": 1, "arg2": 2}], job_id=job_id, ignore_result=True
+    )
+    assert batch[0].ignored and batch[0].job_id == job_id
+    distributaur.delete_job_status(job_id)
+
+
 # def test_worker_task_execution():
 #     distributaur = create_from_config()
 
@@ -105,27 +447,533 @@ def test_execute_function():
 #     print("Worker task execution test passed")
 
 
+def test_speculative_execution():
+    distributaur = create_from_config()
+    redis_client = distributaur.get_redis_connection()
+    backend = distributaur.app.backend
+    task = distributaur.app.AsyncResult("speculative_test")
+    # a successful task ignores later states, so a result left by an earlier run is removed first
+    backend.forget(task.id)
+    redis_client.delete("task_durations")
+    for _ in range(20):
+        distributaur.record_task_duration(0.01)
+
+    # a worker started the task, sent to the affinity queue of another worker, and published its arguments
+    # and routing options, then got stuck
+    distributaur.call_function_task.push_request(
+        id=task.id,
+        delivery_info={"routing_key": "affinity.stuck", "priority": 2},
+        job_id="speculative-job",
+        affinity="scene",
+        affinity_fallback="speculative-test",
+        ignore_result=False,
+    )
+    try:
+        with patch.object(distributaur.call_function_task, "update_state") as update_state:
+            distributaur._publish_started("example_test_function", {"arg1": 1, "arg2": 2})
+    finally:
+        distributaur.call_function_task.pop_request()
+    message = update_state.call_args.kwargs["meta"]
+    backend.store_result(task.id, message, "STARTED")
+    queue_key = distributaur._queue_keys("speculative-test")[2]
+    redis_client.delete(queue_key)
+
+    def finish_copy():
+        # the speculative copy is queued under the same task ID, with the routing options of the original
+        # minus its affinity queue, and finishes first
+        while not redis_client.llen(queue_key):
+            time.sleep(0.05)
+        copy = json.loads(redis_client.lpop(queue_key))
+        assert copy["headers"]["id"] == task.id
+        assert copy["headers"]["job_id"] == "speculative-job"
+        assert copy["headers"]["affinity"] == "scene"
+        assert not copy["headers"]["ignore_result"]
+        backend.store_result(task.id, "Result: arg1+arg2=3", "SUCCESS")
+
+    finisher = threading.Thread(target=finish_copy)
+    finisher.start()
+    with patch.object(distributaur.app.control, "revoke") as revoke:
+        distributaur.monitor_tasks(
+            [task], update_interval=0.1, print_statements=False, speculative=True, speculative_factor=1
+        )
+    finisher.join()
+
+    # the straggling copy is revoked, and its late REVOKED state cannot overwrite the result
+    revoke.assert_called_once()
+    assert revoke.call_args.args == (task.id,)
+    assert revoke.call_args.kwargs["terminate"]
+    backend.mark_as_revoked(task.id)
+    assert task.get(timeout=1) == "Result: arg1+arg2=3"
+    backend.forget(task.id)
+    redis_client.delete("task_durations")
+
+
+def test_upload_claims():
+    distributaur = create_from_config()
+    redis_client = distributaur.get_redis_connection()
+
+    def execution(token):
+        request = MagicMock(id="claim_test", execution_token=token, upload_claims=[])
+        return patch("distributaur.distributaur.current_task", MagicMock(request=request))
+
+    # two copies of the same task: only the first to claim an output uploads it
+    with execution("first"):
+        assert distributaur._claim_upload("result.txt")
+        assert distributaur._claim_upload("result.txt")
+    with execution("second"):
+        assert not distributaur._claim_upload("result.txt")
+
+    # outside of tasks uploads are never skipped
+    assert distributaur._claim_upload("result.txt")
+
+    # a failed execution releases its claims for the retry
+    with execution("first") as current_task:
+        current_task.request.upload_claims = ["upload_claim:claim_test:result.txt"]
+        distributaur._release_upload_claims()
+    with execution("retry"):
+        assert distributaur._claim_upload("result.txt")
+    redis_client.delete("upload_claim:claim_test:result.txt")
+
+
 def test_task_status_update():
     distributaur = create_from_config()
     redis_client = distributaur.get_redis_connection()
 
-    task_status_keys = redis_client.keys("task_status:*")
-    if task_status_keys:
-        redis_client.delete(*task_status_keys)
+    distributaur.delete_job_status("status-test")
 
     task_id = "test_task_123"
     status = "COMPLETED"
 
-    distributaur.update_function_status(task_id, status)
+    distributaur.update_function_status(task_id, status, job_id="status-test")
 
-    status_from_redis = redis_client.get(f"task_status:{task_id}").decode()
-    assert status_from_redis == status
+    assert distributaur.get_task_statuses([task_id, "unknown"], "status-test") == [status, None]
+    assert redis_client.hget("job_status:status-test", task_id).decode() == status
 
-    redis_client.delete(f"task_status:{task_id}")
+    # repeated updates of a task move it between counters instead of counting it twice
+    distributaur.update_function_status(task_id, "success", job_id="status-test")
+    distributaur.update_function_status(task_id, "success", job_id="status-test")
+    distributaur.update_function_status("test_task_456", "success", job_id="status-test")
+    assert distributaur.get_job_progress("status-test") == {"COMPLETED": 0, "success": 2}
+    assert 0 < redis_client.ttl("job_status:status-test") <= distributaur.settings["STATUS_TTL"]
+    assert 0 < redis_client.ttl("job_counts:status-test") <= distributaur.settings["STATUS_TTL"]
+
+    distributaur.delete_job_status("status-test")
+    assert not redis_client.exists("job_status:status-test", "job_counts:status-test")
 
     print("Task status update test passed")
 
 
+def test_jobs_are_isolated():
+    distributaur = create_from_config()
+    distributaur.register_function(example_test_function)
+    redis_client = distributaur.get_redis_connection()
+    backend = distributaur.app.backend
+
+    job_a = distributaur.create_job("isolation-a")
+    job_b = distributaur.create_job("isolation-b", cleanup_on_exit=False)
+    assert job_a.queue == "job.isolation-a"
+    assert redis_client.hget("job_queues", "job.isolation-a") == b"celery"
+
+    batch_a = job_a.submit_many("example_test_function", [{"arg1": i, "arg2": 1} for i in range(3)])
+    task_b = job_b.submit("example_test_function", {"arg1": 1, "arg2": 2})
+    assert distributaur.get_queue_length("job.isolation-a") == 3
+    assert distributaur.get_queue_length("job.isolation-b") == 1
+    assert job_a.submitted == 3
+    assert job_b.submitted == 1
+
+    # a worker finished the first task of each job
+    for task_id, job_id in [(batch_a.task_ids[0], "isolation-a"), (task_b.id, "isolation-b")]:
+        distributaur.update_function_status(task_id, "success", job_id=job_id)
+        backend.store_result(task_id, "done", "SUCCESS")
+    assert job_a.progress() == {"submitted": 3, "success": 1}
+
+    # cleaning up one job leaves the queue, statuses and results of the other alone
+    job_a.cleanup()
+    assert distributaur.get_queue_length("job.isolation-a") == 0
+    assert not redis_client.exists(backend.get_key_for_task(batch_a.task_ids[0]))
+    assert not redis_client.exists("job_status:isolation-a", "job_counts:isolation-a")
+    assert distributaur.get_queue_length("job.isolation-b") == 1
+    assert redis_client.exists(backend.get_key_for_task(task_b.id))
+    assert job_b.progress() == {"submitted": 1, "success": 1}
+
+    # tasks without a job belong to the default job shared by all drivers, which is never cleaned up on exit
+    distributaur.execute_function(
+        "example_test_function", {"arg1": 1, "arg2": 2}, queue="default-job-test"
+    )
+    assert "default" not in distributaur.jobs
+
+    # on exit only the jobs marked for cleanup are deleted
+    jobs = distributaur.jobs
+    distributaur.jobs = {"isolation-a": job_a, "isolation-b": job_b}
+    distributaur._cleanup_jobs()
+    distributaur.jobs = jobs
+    assert not redis_client.hexists("job_queues", "job.isolation-a")
+    # a job kept for another process keeps its queued tasks and the workers consuming them
+    assert redis_client.hexists("job_queues", "job.isolation-b")
+    assert distributaur.get_queue_length("job.isolation-b") == 1
+    job_b.cleanup()
+    job_b.close()
+    assert distributaur.get_queue_length("job.isolation-b") == 0
+    assert not redis_client.exists(backend.get_key_for_task(task_b.id))
+
+
+def test_job_queues_follow_parent_queue():
+    distributaur = create_from_config()
+    redis_client = distributaur.get_redis_connection()
+    redis_client.delete("job_queues")
+    job = distributaur.create_job("parent-bulk", parent_queue="bulk")
+    default_job = distributaur.create_job("parent-default")
+    assert redis_client.hget("job_queues", "job.parent-bulk") == b"bulk"
+    assert redis_client.hget("job_queues", "job.parent-default") == b"celery"
+
+    def consumer(*queues):
+        sender = MagicMock()
+        sender.hostname = f"{'-'.join(queues)}@test"
+        sender.task_consumer.queues = [MagicMock() for _ in queues]
+        for queue, name in zip(sender.task_consumer.queues, queues):
+            queue.name = name
+        sender.call_soon = lambda f, *args: f(*args)
+        return sender
+
+    def added(sender):
+        return {c.args[0] for c in sender.add_task_queue.call_args_list if c.args[0].startswith("job.")}
+
+    # workers started after the jobs only consume from the queues of jobs on their own queues
+    preview, bulk = consumer("preview"), consumer("bulk", "celery")
+    for sender in [preview, bulk]:
+        distributaur._register_worker(sender)
+        distributaur.affinity.unregister_worker(sender.hostname)
+    assert added(preview) == set()
+    assert added(bulk) == {"job.parent-bulk", "job.parent-default"}
+
+    # so do running workers told about a new job
+    preview, bulk = consumer("preview"), consumer("bulk")
+    for sender in [preview, bulk]:
+        add_job_consumer(MagicMock(consumer=sender), "job.parent-bulk", "bulk")
+    assert added(preview) == set()
+    assert added(bulk) == {"job.parent-bulk"}
+
+    # draining a node of an autoscaler stops it consuming from the queues of the jobs on its queue
+    autoscaler = Autoscaler(distributaur, "image", "worker", 1.0, 1, 60, queue="bulk")
+    redis_client.hset("workers", "parent-node", "bulk@test")
+    node = {"instance_id": "parent-node"}
+    with patch.object(distributaur.app.control, "cancel_consumer") as cancel, patch.object(
+        distributaur.app.control, "add_consumer"
+    ) as add:
+        autoscaler._drain(node)
+        autoscaler._resume(node)
+    for mock in [cancel, add]:
+        queues = {c.args[0] for c in mock.call_args_list}
+        assert {"bulk", "job.parent-bulk"} <= queues
+        assert "job.parent-default" not in queues
+        assert all(c.kwargs["destination"] == ["bulk@test"] for c in mock.call_args_list)
+    redis_client.hdel("workers", "parent-node")
+    distributaur.affinity.unregister_worker("bulk@test")
+    job.close()
+    default_job.close()
+    assert not redis_client.exists("job_queues")
+    assert distributaur.get_queue_length("default-job-test") == 1
+    redis_client.delete(*distributaur._queue_keys("default-job-test"))
+
+
+def test_priority_routing():
+    distributaur = create_from_config()
+    redis_client = distributaur.get_redis_connection()
+    keys = distributaur._queue_keys("routing-test")
+    redis_client.delete(*keys)
+
+    @distributaur.register_function(queue="routing-test", priority=1)
+    def preview_function(arg1, arg2):
+        return arg1 + arg2
+
+    # tasks of the function go to its queue with its priority, unless given others when submitted
+    distributaur.execute_function("preview_function", {"arg1": 1, "arg2": 2})
+    distributaur.execute_many("preview_function", [{"arg1": i, "arg2": 2} for i in range(3)])
+    distributaur.execute_batch("preview_function", [{"arg1": 1, "arg2": 2}], priority=0)
+    assert redis_client.llen(keys[1]) == 4
+    assert redis_client.llen(keys[0]) == 1
+    assert distributaur.get_queue_length("routing-test") == 5
+    message = json.loads(redis_client.lindex(keys[1], 0))
+    assert message["properties"]["priority"] == 1
+    assert message["headers"]["task"] == "call_function_task"
+
+    # other functions keep going to the default queue with the default priority
+    assert distributaur._route_function("call_function_task", ("example_test_function", {}), {}, {}) == {
+        "queue": "celery",
+        "priority": DEFAULT_PRIORITY,
+    }
+    redis_client.delete(*keys)
+
+
+def test_affinity_routing():
+    distributaur = create_from_config()
+    redis_client = distributaur.get_redis_connection()
+    affinity_queue = distributaur.affinity.queue_for("holder@test")
+    keys = distributaur._queue_keys(affinity_queue) + distributaur._queue_keys("affinity-test")
+    redis_client.delete(*keys, "affinity:scene-a", "affinity:scene-b")
+
+    @distributaur.register_function(queue="affinity-test")
+    def render_scene(scene):
+        return scene
+
+    # without a worker holding the key, the task goes to the function's queue and carries the key
+    distributaur.execute_function("render_scene", {"scene": "a"}, affinity="scene-a")
+    message = json.loads(redis_client.lpop(distributaur._queue_keys("affinity-test")[DEFAULT_PRIORITY]))
+    assert message["headers"]["affinity"] == "scene-a"
+    assert "affinity_deadline" not in message["headers"]
+
+    # a worker that ran a task with the key gets the next ones in its affinity queue
+    distributaur.affinity.add_worker("holder@test")
+    distributaur.affinity.record("scene-a", "holder@test")
+    assert distributaur.affinity.get_holders("scene-a") == {"holder@test": affinity_queue}
+    distributaur.execute_function("render_scene", {"scene": "a"}, affinity="scene-a")
+    distributaur.execute_many(
+        "render_scene", [{"scene": "a"}, {"scene": "b"}], affinity=lambda args: f"scene-{args['scene']}"
+    )
+    assert distributaur.get_queue_length(affinity_queue) == 2
+    assert distributaur.get_queue_length("affinity-test") == 1
+    message = json.loads(redis_client.lindex(distributaur._queue_keys(affinity_queue)[DEFAULT_PRIORITY], 0))
+    assert message["headers"]["affinity_fallback"] == "affinity-test"
+
+    # queues are only read once the earliest deadline of their tasks passed
+    assert redis_client.zscore("affinity_deadlines", affinity_queue) > time.time()
+    assert distributaur.affinity.rebalance() == 0
+    assert distributaur.get_queue_length(affinity_queue) == 2
+
+    # tasks waiting for longer than the timeout are moved to the head of the function's queue, oldest first
+    redis_client.delete(*distributaur._queue_keys(affinity_queue), "affinity_deadlines")
+    distributaur.affinity.timeout = 0
+    distributaur.execute_many(
+        "render_scene", [{"scene": "a"}, {"scene": "c"}], affinity=lambda args: "scene-a"
+    )
+    assert distributaur.affinity.rebalance() == 2
+    fallback_key = distributaur._queue_keys("affinity-test")[DEFAULT_PRIORITY]
+    moved = [json.loads(redis_client.rpop(fallback_key)) for _ in range(2)]
+    assert ["'a'" in m["headers"]["argsrepr"] for m in moved] == [True, False]
+    assert moved[0]["properties"]["delivery_info"]["routing_key"] == "affinity-test"
+    assert distributaur.get_queue_length(affinity_queue) == 0
+
+    # the tasks of a worker that drains are moved back right away, and its heartbeats do not register it again
+    distributaur.affinity.timeout = distributaur.settings["AFFINITY_TIMEOUT"]
+    distributaur.execute_function("render_scene", {"scene": "a"}, affinity="scene-a")
+    assert distributaur.affinity.unregister_worker("holder@test") == 1
+    distributaur.affinity.heartbeat("holder@test")
+    assert distributaur.affinity.get_holders("scene-a") == {}
+    assert not redis_client.sismember("affinity_queues", affinity_queue)
+
+    # a worker that misses its heartbeats, e.g. on a preempted node, stops getting tasks and its tasks move back
+    distributaur.affinity.add_worker("holder@test")
+    distributaur.affinity.heartbeat("holder@test")
+    assert 0 < redis_client.ttl("affinity_worker:holder@test") <= HEARTBEAT_TTL
+    distributaur.execute_function("render_scene", {"scene": "a"}, affinity="scene-a")
+    redis_client.delete("affinity_worker:holder@test")
+    assert distributaur.affinity.rebalance() == 1
+    assert distributaur.affinity.get_holders("scene-a") == {}
+    assert distributaur.get_queue_length(affinity_queue) == 0
+
+    distributaur.affinity.routed = False
+    redis_client.delete(
+        *keys, "affinity:scene-a", "affinity:scene-b", "affinity_deadlines", "affinity_drained:holder@test"
+    )
+
+
+@pytest.mark.parametrize("pool", ["threads", "processes"])
+def test_local_executor(pool):
+    distributaur = Distributaur(
+        hf_repo_id="test/local", hf_token="token", vast_api_key="key", executor=pool, local_workers=2
+    )
+    distributaur.register_function(example_test_function)
+
+    # nothing goes through Redis
+    with patch.object(distributaur, "get_redis_connection", side_effect=AssertionError):
+        task = distributaur.execute_function("example_test_function", {"arg1": 1, "arg2": 2})
+        assert distributaur.get_result(task, timeout=10) == "Result: arg1+arg2=3"
+
+        batch = distributaur.execute_many(
+            "example_test_function", ({"arg1": i, "arg2": 1} for i in range(10))
+        )
+        batched = distributaur.execute_many(
+            "example_test_function", ({"arg1": i, "arg2": 1} for i in range(10)), batch_size=4
+        )
+        assert [task.item_count for task in batched] == [4, 4, 2]
+        distributaur.monitor_tasks(list(batch) + list(batched), print_statements=False)
+        assert batch.results().join(timeout=10) == [f"Result: arg1+arg2={i + 1}" for i in range(10)]
+        assert batched[2].get() == [{"result": "Result: arg1+arg2=9"}, {"result": "Result: arg1+arg2=10"}]
+
+        results = dict(distributaur.as_completed(batch, timeout=10))
+        assert sorted(results.values()) == sorted(batch.results().join())
+
+        failing = distributaur.execute_function("example_test_function", {"arg1": 1})
+        assert isinstance(list(distributaur.as_completed([failing], propagate=False))[0][1], TypeError)
+        with pytest.raises(TypeError):
+            failing.get(timeout=10)
+    distributaur.executor.shutdown()
+
+    with pytest.raises(ValueError):
+        Distributaur(hf_repo_id="test/local", hf_token="token", vast_api_key="key", executor="dask")
+
+
+@pytest.mark.parametrize("pool", ["threads", "processes"])
+def test_function_setup_and_cache(pool):
+    distributaur = Distributaur(
+        hf_repo_id="test/local", hf_token="token", vast_api_key="key", executor=pool, local_workers=2
+    )
+    distributaur.register_function(setup=count_setup, cache=True)(render_with_cache)
+    distributaur.register_function(example_test_function)
+    assert distributaur._get_function("example_test_function") is example_test_function
+
+    batch = distributaur.execute_many(
+        "render_with_cache", [{"asset": f"scene-{i % 3}"} for i in range(30)]
+    )
+    results = batch.results().join(timeout=30)
+    distributaur.executor.shutdown()
+    # the setup hook ran once per process, and assets are loaded once per process and reused
+    for pid, setup_calls, loaded in results:
+        assert setup_calls == 1
+        assert loaded.endswith(f"loaded by {pid}")
+    if pool == "threads":
+        cache = distributaur.get_function_cache()
+        assert {"scene-0", "scene-1", "scene-2"} <= set(cache._entries)
+        assert cache.get_stats()["misses"] >= 3
+
+
+def test_asset_cache_eviction():
+    cache = AssetCache(max_bytes=100)
+    assert cache.put("a", b"x" * 40)
+    assert cache.put("b", b"x" * 40)
+    assert cache.get("a") is not None
+    # b is the least recently used value, so it is evicted to make room for c
+    assert cache.put("c", b"x" * 40)
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert not cache.put("d", b"x" * 101)
+    assert "d" not in cache
+
+    loads = []
+    assert cache.get_or_load("e", lambda: loads.append(1) or "e", size=10) == "e"
+    assert cache.get_or_load("e", lambda: loads.append(1) or "e", size=10) == "e"
+    assert loads == [1]
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1 and stats["size"] == 90 and stats["entries"] == 3
+
+    cache.clear()
+    assert len(cache) == 0 and cache.get_stats()["size"] == 0
+
+
+def test_upload_queue():
+    class FlakyApi:
+        def __init__(self):
+            self.commits = []
+            self.calls = 0
+
+        def create_commit(self, repo_id, repo_type, operations, commit_message):
+            self.calls += 1
+            if self.calls == 1:
+                raise HTTPError("503 Service Unavailable")
+            self.commits.append([operation.path_in_repo for operation in operations])
+
+    api = FlakyApi()
+    upload_queue = UploadQueue(api, "test/repo", max_files=3, max_wait=60, backoff=0.01)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i in range(5):
+            file_path = os.path.join(temp_dir, f"file_{i}.txt")
+            with open(file_path, "w") as f:
+                f.write("content")
+            upload_queue.put(file_path, f"file_{i}.txt")
+        # the same path again is coalesced into the pending commit
+        upload_queue.put(file_path, "file_4.txt")
+
+        assert upload_queue.flush(timeout=10)
+
+    assert sorted(sum(api.commits, [])) == [f"file_{i}.txt" for i in range(5)]
+    assert all(len(commit) <= 3 for commit in api.commits)
+    metrics = upload_queue.get_metrics()
+    assert metrics["queue_depth"] == 0
+    assert metrics["files_uploaded"] == 5
+    assert metrics["retries"] == 1
+    assert metrics["commits"] == len(api.commits)
+
+    assert upload_queue.close(timeout=10)
+    with pytest.raises(RuntimeError):
+        upload_queue.put(file_path, "file_0.txt")
+
+
+def test_upload_queue_flush_and_backpressure():
+    class BlockingApi:
+        def __init__(self):
+            self.commits = []
+            self.release = threading.Event()
+
+        def create_commit(self, repo_id, repo_type, operations, commit_message):
+            self.release.wait(10)
+            self.commits.append([operation.path_in_repo for operation in operations])
+
+    api = BlockingApi()
+    api.release.set()
+    upload_queue = UploadQueue(api, "test/repo", max_files=10, max_wait=60, max_queued_bytes=10)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_paths = []
+        for i in range(3):
+            file_paths.append(os.path.join(temp_dir, f"file_{i}.txt"))
+            with open(file_paths[-1], "w") as f:
+                f.write("12345")
+        upload_queue.put(file_paths[0], "file_0.txt")
+        upload_queue.put(file_paths[1], "file_1.txt")
+
+        # flush commits the waiting files at once instead of after max_wait
+        start = time.time()
+        assert upload_queue.flush(timeout=2)
+        assert time.time() - start < 2
+        assert api.commits == [["file_0.txt", "file_1.txt"]]
+
+        # put blocks while the queued files hold max_queued_bytes bytes
+        api.release.clear()
+        upload_queue.put(file_paths[0], "file_0.txt")
+        upload_queue.put(file_paths[1], "file_1.txt")
+        upload_queue.flush(timeout=0)
+        thread = threading.Thread(target=upload_queue.put, args=(file_paths[2], "file_2.txt"))
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+        assert upload_queue.get_metrics()["queued_bytes"] == 10
+        api.release.set()
+        thread.join(2)
+        assert not thread.is_alive()
+        assert upload_queue.close(timeout=2)
+
+    assert api.commits[1:] == [["file_0.txt", "file_1.txt"], ["file_2.txt"]]
+    assert upload_queue.get_metrics()["queued_bytes"] == 0
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_repo_file_index(shared):
+    distributaur = create_from_config()
+    listings = []
+
+    def list_files():
+        listings.append(time.time())
+        return ["a.txt", "b.txt"]
+
+    redis_client = distributaur.get_redis_connection() if shared else None
+    file_index = RepoFileIndex(list_files, ttl=60, redis_client=redis_client, key="repo_files:test")
+    file_index.invalidate()
+
+    assert file_index.contains(["a.txt", "c.txt"]) == [True, False]
+    assert file_index.contains(["b.txt"]) == [True]
+    assert len(listings) == 1
+
+    # uploads and deletions update the index without listing the repository again
+    file_index.add(["c.txt"])
+    file_index.discard(["a.txt"])
+    assert file_index.contains(["a.txt", "c.txt"]) == [False, True]
+    assert sorted(file_index.paths()) == ["b.txt", "c.txt"]
+    assert len(listings) == 1
+
+    file_index.invalidate()
+    assert file_index.contains(["a.txt", "c.txt"]) == [True, False]
+    assert len(listings) == 2
+    file_index.invalidate()
+
+
 def test_initialize_repo():
     distributaur = create_from_config()
 
@@ -342,6 +1190,52 @@ def test_get_redis_connection_force_new():
     assert redis_client1 is not redis_client2
 
 
+def test_redis_pool():
+    distributaur = Distributaur(
+        hf_repo_id="test/pool",
+        hf_token="token",
+        vast_api_key="key",
+        redis_host=os.getenv("REDIS_HOST", "localhost"),
+        redis_password=os.getenv("REDIS_PASSWORD", ""),
+        redis_port=os.getenv("REDIS_PORT", 6379),
+        redis_username=os.getenv("REDIS_USER", "default"),
+        redis_pool_size=2,
+        redis_pool_timeout=0.2,
+    )
+    redis_client = distributaur.get_redis_connection()
+    # the result backend and every client of the instance share one pool
+    assert distributaur.app.backend.client.connection_pool is distributaur.get_redis_pool()
+    assert distributaur.get_redis_connection(force_new=True).connection_pool is redis_client.connection_pool
+    assert distributaur.get_redis_pool_stats()["max_connections"] == 2
+
+    # subscriptions hold their connection, so a third command has to wait and gives up after the timeout
+    subscriptions = [redis_client.pubsub() for _ in range(2)]
+    for index, pubsub in enumerate(subscriptions):
+        pubsub.subscribe(f"pool-test-{index}")
+    with pytest.raises(RedisConnectionError):
+        redis_client.ping()
+    stats = distributaur.get_redis_pool_stats()
+    assert stats["role"] == "driver"
+    assert stats["in_use"] == 2 and stats["connections_opened"] == 2
+    assert stats["waits"] == 1 and stats["timeouts"] == 1 and stats["wait_time"] >= 0.2
+
+    for pubsub in subscriptions:
+        pubsub.close()
+    assert redis_client.ping()
+    assert distributaur.get_redis_pool_stats()["connections_opened"] == 2
+
+    # a process becoming a worker resizes its pool in place, so the backend keeps sharing it
+    pool = distributaur.get_redis_pool()
+    distributaur.settings["REDIS_POOL_SIZE"] = 3
+    distributaur._set_worker_role()
+    assert distributaur.get_redis_pool() is pool
+    assert distributaur.app.backend.client.connection_pool is pool
+    assert distributaur.get_redis_connection().connection_pool is pool
+    assert distributaur.get_redis_pool_stats()["max_connections"] == 3
+    assert distributaur.app.backend.client.ping()
+    distributaur.get_redis_pool().disconnect()
+
+
 def test_get_env_with_default():
     distributaur = create_from_config()
     default_value = "default"
@@ -350,7 +1244,7 @@ def test_get_env_with_default():
     assert value == default_value
 
 
-@patch("requests.get")
+@patch("requests.Session.get")
 def test_search_offers(mock_get):
     distributaur = create_from_config()
     max_price = 1.0
@@ -366,7 +1260,7 @@ def test_search_offers(mock_get):
     assert offers[1]["id"] == "offer2"
 
 
-@patch("requests.put")
+@patch("requests.Session.put")
 def test_create_instance(mock_put):
     distributaur = create_from_config()
     offer_id = "offer1"
@@ -382,6 +1276,327 @@ def test_create_instance(mock_put):
 
     assert instance["new_contract"] == "instance1"
 
+    distributaur.create_instance(offer_id, image, module_name, queues=["interactive", "celery"])
+    assert mock_put.call_args.kwargs["json"]["onstart"].endswith(" -Q interactive,celery")
+
+
+def test_worker_profiles():
+    distributaur = create_from_config()
+    # the default profile runs one long task at a time and acknowledges it once done
+    assert distributaur.app.conf.task_acks_late is True
+    assert distributaur.app.conf.worker_prefetch_multiplier == 1
+    assert distributaur.app.conf.worker_concurrency == 1
+
+    profile = get_worker_profile("io", concurrency=8)
+    assert profile["pool"] == "threads" and profile["concurrency"] == 8
+    assert worker_command("tasks", profile, ["celery"]) == (
+        "celery -A tasks worker --loglevel=info --pool=threads --concurrency=8 --prefetch-multiplier=4 -Q celery"
+    )
+    # short-cpu runs a process per core, so the worker picks its own concurrency
+    assert "--concurrency" not in worker_command("tasks", get_worker_profile("short-cpu"))
+    with pytest.raises(ValueError):
+        get_worker_profile("unknown")
+
+
+def test_rent_terminate_nodes_concurrently():
+    distributaur = create_from_config()
+    offers = [{"id": i, "dph_total": 0.1 + i / 100} for i in range(8)]
+    vast_api_url = distributaur.settings["VAST_API_URL"]
+
+    with MockVastServer(offers, latency=0.2, failing_offers={2}) as server:
+        distributaur.settings["VAST_API_URL"] = server.url
+        try:
+            nodes = distributaur.rent_nodes(1.0, 6, "test_image", "distributaur.example.worker")
+            assert len(nodes) == 6
+            # the failing offer is replaced by the next cheapest one
+            assert sorted(node["offer_id"] for node in nodes) == [0, 1, 3, 4, 5, 6]
+            assert distributaur.rented_instances == {node["instance_id"] for node in nodes}
+            assert server.max_active_requests > 1
+
+            result = distributaur.terminate_nodes(nodes + [{"instance_id": 999}])
+            assert sorted(result["terminated"]) == sorted(server.destroyed)
+            assert len(result["terminated"]) == 6
+            assert result["failed"] == [999]
+            assert not distributaur.rented_instances
+
+            # a destroyed instance is reported as terminated even if Redis fails to forget it
+            node = distributaur.rent_nodes(1.0, 1, "test_image", "distributaur.example.worker")[0]
+            with patch.object(
+                distributaur, "get_redis_connection", side_effect=RedisConnectionError("down")
+            ):
+                result = distributaur.terminate_nodes([node])
+            assert result["terminated"] == [node["instance_id"]]
+            assert not distributaur.rented_instances
+        finally:
+            distributaur.settings["VAST_API_URL"] = vast_api_url
+
+
+def test_instance_env_round_trip():
+    distributaur_module = importlib.import_module("..distributaur", __package__)
+    distributaur = create_from_config()
+    offers = [{"id": 0, "dph_total": 0.1}]
+    vast_api_url = distributaur.settings["VAST_API_URL"]
+    settings = dict(distributaur.settings)
+
+    with MockVastServer(offers, latency=0) as server:
+        distributaur.settings.update(
+            VAST_API_URL=server.url, SPECULATIVE_EXECUTION=True, IGNORE_RESULT=False
+        )
+        try:
+            node = distributaur.rent_nodes(1.0, 1, "test_image", "distributaur.example.worker")[0]
+            distributaur.terminate_nodes([node])
+            sent = dict(distributaur.settings)
+        finally:
+            distributaur.settings.clear()
+            distributaur.settings.update(settings)
+            distributaur.settings["VAST_API_URL"] = vast_api_url
+
+    env = server.envs[node["instance_id"]]
+    assert all(isinstance(value, str) for value in env.values())
+    assert env["SPECULATIVE_EXECUTION"] == "1"
+    assert env["IGNORE_RESULT"] == "0"
+    # a worker started with the environment parses it back to the same settings
+    with patch.dict(os.environ, env), patch.object(distributaur_module, "distributaur", None):
+        worker = create_from_config("missing_config.json", "missing.env")
+    assert worker.settings == sent
+
+
+def test_http_client_reuse_and_retries():
+    http_client = HttpClient(timeout=5, retries=3, backoff=0)
+    offers = [{"id": 0, "dph_total": 0.1}]
+
+    with MockVastServer(offers, latency=0, search_failures=2) as server:
+        session = http_client.new_session()
+        for _ in range(3):
+            response = session.get(f"{server.url}/bundles/")
+            assert response.status_code == 200
+
+    metrics = http_client.get_metrics()
+    assert metrics["requests"] == 3
+    # the first search was retried twice after 503 responses
+    assert metrics["retries"] == 2
+    assert metrics["connections_opened"] == 1
+    assert metrics["connections_reused"] == 4
+    assert metrics["average_latency"] > 0
+
+
+def test_autoscaler():
+    distributaur = create_from_config()
+    redis_client = distributaur.get_redis_connection()
+    redis_client.delete("task_durations", "autoscaler-test")
+    offers = [{"id": i, "dph_total": 0.1 + i / 100} for i in range(10)]
+    vast_api_url = distributaur.settings["VAST_API_URL"]
+
+    class FakeClock:
+        now = 0.0
+
+        def __call__(self):
+            return self.now
+
+        def sleep(self, seconds):
+            self.now += seconds
+
+    clock = FakeClock()
+    with MockVastServer(offers, latency=0) as server:
+        distributaur.settings["VAST_API_URL"] = server.url
+        try:
+            autoscaler = distributaur.create_autoscaler(
+                "test_image",
+                "distributaur.example.worker",
+                max_price=1.0,
+                max_nodes=8,
+                target_seconds=1000,
+                queue="autoscaler-test",
+                cooldown=100,
+                clock=clock,
+                sleep=clock.sleep,
+            )
+
+            # 100 tasks of 60 seconds in 1000 seconds need 6 nodes
+            redis_client.rpush("autoscaler-test", *range(100))
+            for _ in range(10):
+                distributaur.record_task_duration(60)
+            decision = autoscaler.step()
+            assert decision["desired_nodes"] == 6
+            assert decision["rented"] == 6
+
+            # tasks got slower, but new nodes are only rented after the cooldown
+            for _ in range(1000):
+                distributaur.record_task_duration(90)
+            clock.sleep(50)
+            assert autoscaler.step()["rented"] == 0
+            clock.sleep(50)
+            decision = autoscaler.step()
+            assert decision["desired_nodes"] == 8
+            assert decision["rented"] == 2
+
+            # most of the work is done, surplus nodes are drained and destroyed
+            redis_client.ltrim("autoscaler-test", 0, 9)
+            clock.sleep(100)
+            decision = autoscaler.step()
+            assert decision["desired_nodes"] == 2
+            assert decision["destroyed"] == 6
+            assert len(server.destroyed) == 6
+
+            redis_client.delete("autoscaler-test")
+            autoscaler.run()
+            assert autoscaler.nodes == []
+            assert len(server.destroyed) == 8
+        finally:
+            distributaur.settings["VAST_API_URL"] = vast_api_url
+            redis_client.delete("task_durations", "autoscaler-test")
+
+
+def test_offer_scoring():
+    offers = [
+        # cheapest, but slow
+        {"id": 1, "machine_id": 10, "dph_total": 0.10, "total_flops": 10, "reliability2": 0.99, "gpu_ram": 8192},
+        # twice the price, five times the FLOPS
+        {"id": 2, "machine_id": 20, "dph_total": 0.20, "total_flops": 50, "reliability2": 0.99, "gpu_ram": 8192},
+        # fast, but unreliable
+        {"id": 3, "machine_id": 30, "dph_total": 0.20, "total_flops": 50, "reliability2": 0.5, "gpu_ram": 8192},
+        # fast, but too little GPU memory
+        {"id": 4, "machine_id": 40, "dph_total": 0.10, "total_flops": 100, "reliability2": 0.99, "gpu_ram": 4096},
+    ]
+
+    scorer = OfferScorer(filters=[min_gpu_ram(8), min_reliability(0.4)])
+    ranked = scorer.rank(offers)
+    assert [offer["id"] for offer in ranked] == [2, 3, 1]
+    # without measurements, durations are estimated with the default calibration, in tasks per hour per dollar
+    assert ranked[0]["score"] == pytest.approx(3600 / (DEFAULT_FLOPS_SECONDS / 50) * 0.99 / 0.20)
+
+    # measured durations override FLOPS: machine 20 turned out slower than its FLOPS suggest, and the
+    # duration of the unmeasured machine 30 is estimated from its FLOPS, calibrated on the measured machines
+    scorer = OfferScorer(
+        filters=[min_gpu_ram(8)], machine_durations={"10": 10.0, "20": 60.0}
+    )
+    ranked = scorer.rank(offers)
+    assert [offer["id"] for offer in ranked] == [1, 2, 3]
+    assert ranked[0]["score"] == pytest.approx(3600 / 10 * 0.99 / 0.10)
+    flops_seconds = (10 * 10 + 60 * 50) / 2
+    assert ranked[2]["score"] == pytest.approx(3600 / (flops_seconds / 50) * 0.5 / 0.20)
+
+    distributaur = create_from_config()
+    redis_client = distributaur.get_redis_connection()
+    redis_client.delete("machine_durations")
+    with patch.dict(os.environ, {"VAST_MACHINE_ID": "20"}):
+        distributaur.record_task_duration(50)
+        distributaur.record_task_duration(70)
+    assert distributaur.get_machine_durations() == {"20": 60.0}
+    redis_client.delete("machine_durations", "task_durations")
+
+
+def test_slow_node_eviction():
+    distributaur = create_from_config()
+    redis_client = distributaur.get_redis_connection()
+    redis_client.delete("task_durations", "autoscaler-test")
+    offers = [{"id": i, "dph_total": 0.1 + i / 100} for i in range(10)]
+    vast_api_url = distributaur.settings["VAST_API_URL"]
+
+    with MockVastServer(offers, latency=0) as server:
+        distributaur.settings["VAST_API_URL"] = server.url
+        try:
+            autoscaler = distributaur.create_autoscaler(
+                "test_image",
+                "distributaur.example.worker",
+                max_price=1.0,
+                max_nodes=4,
+                target_seconds=100,
+                queue="autoscaler-test",
+                cooldown=0,
+                evict_percentile=25,
+            )
+            redis_client.rpush("autoscaler-test", *range(100))
+            assert autoscaler.step()["rented"] == 4
+            instance_ids = [str(node["instance_id"]) for node in autoscaler.nodes]
+
+            # workers tag their completions with their instance ID; the last node is throttled
+            for instance_id in instance_ids:
+                duration = 30 if instance_id == instance_ids[-1] else 10
+                with patch.dict(os.environ, {"CONTAINER_ID": instance_id}):
+                    for i in range(5):
+                        distributaur.update_function_status(f"task-{instance_id}-{i}", "success", duration)
+
+            stats = distributaur.get_node_stats()
+            assert stats[instance_ids[0]]["tasks"] == 5
+            assert stats[instance_ids[-1]]["throughput"] == pytest.approx(120)
+            assert distributaur.find_slow_nodes(instance_ids, percentile=25) == [instance_ids[-1]]
+
+            # the slow node is drained, destroyed and replaced
+            decision = autoscaler.step()
+            assert decision["evicted"] == 1
+            assert decision["rented"] == 1
+            assert decision["destroyed"] == 1
+            assert server.destroyed == [int(instance_ids[-1])]
+            assert instance_ids[-1] not in distributaur.get_node_stats()
+            assert len(autoscaler.nodes) == 4
+        finally:
+            autoscaler.shutdown()
+            distributaur.settings["VAST_API_URL"] = vast_api_url
+            redis_client.delete("task_durations", "autoscaler-test", "nodes")
+            for instance_id in instance_ids:
+                redis_client.delete(f"node_tasks:{instance_id}")
+
+
+def test_import_time():
+    # heavy dependencies are imported where they are used, so workers and drivers start quickly
+    times = import_times("distributaur.distributaur")
+    assert "celery" in times
+    loaded = [name for name in LAZY_MODULES if name in times]
+    assert loaded == [], f"importing distributaur loaded {loaded}"
+
+    # the clients are created on first use, and the config and the Hugging Face client still work
+    distributaur = Distributaur()
+    assert distributaur.http_client is None
+    assert isinstance(distributaur.get_hf_api(), HfApi)
+    assert distributaur.get_http_client() is distributaur.http_client
+
+
+
+@pytest.mark.parametrize("module", ["profiles", "results", "serializers", "startup"])
+def test_benchmarks_import(module):
+    # the benchmarks are only run by hand, so check they still import after changes to what they use
+    importlib.import_module(f"distributaur.benchmark.{module}")
+
+
+def test_serializer_benchmark():
+    from ..benchmark.serializers import benchmark
+
+    for name in available_serializers():
+        encoded_size, encode_ms, decode_ms = benchmark(name, 1024, repeat=2)
+        assert encoded_size > 1024 and encode_ms >= 0 and decode_ms >= 0
+
+
+def test_results_benchmark():
+    from ..benchmark.results import MODES, benchmark
+
+    distributaur = create_from_config()
+    settings = dict(distributaur.settings)
+    redis_client = distributaur.get_redis_connection()
+    blobs = set(redis_client.keys("blob:*"))
+    try:
+        with tempfile.TemporaryDirectory() as blob_dir:
+            for mode in MODES:
+                used, elapsed = benchmark(distributaur, mode, 20, 2048, blob_dir)
+                assert elapsed >= 0
+                # the results and blobs stored by the benchmark are deleted afterwards
+                assert set(redis_client.keys("blob:*")) == blobs
+    finally:
+        distributaur.settings.update(settings)
+
+
+def test_profiles_benchmark_times_completions():
+    from ..benchmark.profiles import completed_at
+
+    distributaur = create_from_config()
+    task_id = "profiles-benchmark-completion"
+    before = time.time()
+    distributaur.app.backend.store_result(task_id, 1, "SUCCESS")
+    # completions are timed by the worker, not by when the driver reads the result
+    time.sleep(0.5)
+    assert before - 0.1 <= completed_at(distributaur.app.AsyncResult(task_id)) <= before + 0.2
+    distributaur.app.backend.forget(task_id)
+
 
 from io import StringIO
 import subprocess
@@ -1,3 +1,5 @@
+import os
+
 from ..distributaur import create_from_config
 
 distributaur = create_from_config()
@@ -8,6 +10,16 @@ def example_test_function(arg1, arg2):
     return f"Result: arg1+arg2={arg1+arg2}"
 
 
+# setup hook and function using the asset cache of the worker process
+def count_setup(cache):
+    cache.put("setup_calls", cache.get("setup_calls", 0) + 1, size=0)
+
+
+def render_with_cache(asset, cache):
+    loaded = cache.get_or_load(asset, lambda: f"{asset} loaded by {os.getpid()}", size=1)
+    return os.getpid(), cache.get("setup_calls"), loaded
+
+
 celery = distributaur.app
 
 
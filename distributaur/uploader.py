@@ -0,0 +1,253 @@
+import os
+import queue
+import random
+import threading
+import time
+from typing import Callable, List
+
+from celery.utils.log import get_task_logger
+
+
+__all__ = ["UploadQueue"]
+
+logger = get_task_logger(__name__)
+
+# put on the queue by flush to end the batch being collected without waiting for max_wait
+_FLUSH = object()
+
+
+class UploadQueue:
+    """
+    Background uploader that coalesces files into multi-file commits to a Hugging Face repository. Files are
+    committed once max_files files or max_bytes bytes are waiting, or max_wait seconds after the oldest waiting
+    file was queued, whichever comes first. Failed commits are retried with exponential backoff. Queued files
+    are held in memory until they are committed, so put blocks while max_queued_bytes bytes are waiting.
+    """
+
+    def __init__(
+        self,
+        api,
+        repo_id: str,
+        repo_type: str = "dataset",
+        max_files: int = 100,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_wait: float = 10.0,
+        max_queued_bytes: int = 1024 * 1024 * 1024,
+        max_retries: int = 5,
+        backoff: float = 2.0,
+        on_commit: Callable[[List[str]], None] = None,
+    ) -> None:
+        """
+        Initialize the queue and start its upload thread.
+
+        Args:
+            api: Object with the create_commit method of huggingface_hub.HfApi, e.g. an HfApi instance.
+            repo_id (str): The ID of the repository to upload to.
+            repo_type (str): The type of the repository. Defaults to "dataset".
+            max_files (int): Maximum number of files per commit. Defaults to 100.
+            max_bytes (int): Commit as soon as this many bytes are waiting. Defaults to 256 MiB.
+            max_wait (float): Maximum number of seconds a file waits for other files to join its commit.
+                Defaults to 10.
+            max_queued_bytes (int): Maximum number of bytes held by queued files. Files larger than this are
+                still queued once nothing else is waiting. Defaults to 1 GiB.
+            max_retries (int): Number of times a failed commit is retried before its files are dropped.
+                Defaults to 5.
+            backoff (float): Seconds to wait before the first retry, doubled for every further retry.
+                Defaults to 2.
+            on_commit (Callable[[List[str]], None]): Called with the paths of the files of every successful
+                commit. Defaults to None.
+        """
+        self.api = api
+        self.repo_id = repo_id
+        self.repo_type = repo_type
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_wait = max_wait
+        self.max_queued_bytes = max_queued_bytes
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_commit = on_commit
+
+        self.metrics = {
+            "queue_depth": 0,
+            "queued_bytes": 0,
+            "files_uploaded": 0,
+            "bytes_uploaded": 0,
+            "files_failed": 0,
+            "commits": 0,
+            "retries": 0,
+            "last_commit_latency": 0.0,
+            "total_commit_latency": 0.0,
+        }
+        self._queue = queue.Queue()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="distributaur-upload-queue", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, file_path: str, path_in_repo: str) -> None:
+        """
+        Queue a file for upload. The file is read immediately, so it can be deleted as soon as this returns.
+        Blocks while the queued files hold max_queued_bytes bytes.
+
+        Args:
+            file_path (str): The path of the file to upload.
+            path_in_repo (str): The path of the file in the repository.
+
+        Raises:
+            RuntimeError: If the queue was closed.
+        """
+        if self._closed:
+            raise RuntimeError("Cannot upload files after the upload queue was closed")
+
+        size = os.path.getsize(file_path)
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.metrics["queued_bytes"] == 0
+                or self.metrics["queued_bytes"] + size <= self.max_queued_bytes
+            )
+            self.metrics["queue_depth"] += 1
+            self.metrics["queued_bytes"] += size
+
+        with open(file_path, "rb") as f:
+            data = f.read()
+        if len(data) != size:
+            with self._condition:
+                self.metrics["queued_bytes"] += len(data) - size
+        self._queue.put((path_in_repo, data))
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Commit every queued file without waiting for max_wait, and block until they are uploaded or dropped.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait. Defaults to None (wait until done).
+
+        Returns:
+            bool: True if the queue is empty, False if the timeout expired first.
+        """
+        self._queue.put(_FLUSH)
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self.metrics["queue_depth"] == 0, timeout=timeout
+            )
+
+    def close(self, timeout: float = None) -> bool:
+        """
+        Flush the queue and stop the upload thread.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the flush. Defaults to None.
+
+        Returns:
+            bool: True if every queued file was handled before the queue closed.
+        """
+        if self._closed:
+            return True
+        self._closed = True
+        flushed = self.flush(timeout)
+        self._queue.put(None)
+        self._thread.join(timeout)
+        return flushed
+
+    def get_metrics(self) -> dict:
+        """
+        Return a snapshot of the queue metrics.
+
+        Returns:
+            dict: Queue depth, bytes held by queued files, uploaded and failed file counts, commit count, retries and commit latencies
+            in seconds, including the average latency per commit.
+        """
+        with self._condition:
+            metrics = dict(self.metrics)
+        commits = metrics["commits"]
+        metrics["average_commit_latency"] = (
+            metrics["total_commit_latency"] / commits if commits else 0.0
+        )
+        return metrics
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            if item is _FLUSH:
+                continue
+
+            # files for the same path in one commit are coalesced, the latest version wins
+            files = {item[0]: item[1]}
+            dequeued = 1
+            size = len(item[1])
+            deadline = time.time() + self.max_wait
+            while len(files) < self.max_files and size < self.max_bytes:
+                timeout = deadline - time.time()
+                try:
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _FLUSH:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                files[item[0]] = item[1]
+                dequeued += 1
+                size += len(item[1])
+
+            self._commit(files, dequeued, size)
+
+    def _commit(self, files: dict, dequeued: int, dequeued_bytes: int) -> None:
+        from huggingface_hub import CommitOperationAdd
+
+        operations = [
+            CommitOperationAdd(path_in_repo=path_in_repo, path_or_fileobj=data)
+            for path_in_repo, data in files.items()
+        ]
+        size = sum(len(data) for data in files.values())
+
+        for attempt in range(self.max_retries + 1):
+            start_time = time.time()
+            try:
+                self.api.create_commit(
+                    repo_id=self.repo_id,
+                    repo_type=self.repo_type,
+                    operations=operations,
+                    commit_message=f"Upload {len(operations)} files",
+                )
+                latency = time.time() - start_time
+                logger.info(f"Uploaded {len(operations)} files to Hugging Face repo {self.repo_id}")
+                with self._condition:
+                    self.metrics["commits"] += 1
+                    self.metrics["files_uploaded"] += len(operations)
+                    self.metrics["bytes_uploaded"] += size
+                    self.metrics["last_commit_latency"] = latency
+                    self.metrics["total_commit_latency"] += latency
+                if self.on_commit is not None:
+                    self.on_commit(list(files))
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(
+                        f"Failed to upload {len(operations)} files to Hugging Face repo {self.repo_id}: {e}"
+                    )
+                    with self._condition:
+                        self.metrics["files_failed"] += len(operations)
+                    break
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+                logger.warning(
+                    f"Upload to Hugging Face repo {self.repo_id} failed, retrying in {delay:.1f} seconds: {e}"
+                )
+                with self._condition:
+                    self.metrics["retries"] += 1
+                time.sleep(delay)
+
+        with self._condition:
+            self.metrics["queue_depth"] -= dequeued
+            self.metrics["queued_bytes"] -= dequeued_bytes
+            self._condition.notify_all()